@@ -22,6 +22,8 @@ except ImportError:
 # 添加模块路径
 sys.path.append(os.path.dirname(__file__))
 
+from product_alias_index import ProductAliasIndex
+
 logger = logging.getLogger(__name__)
 
 class CartManager:
@@ -256,27 +258,14 @@ class CartManager:
             return False
     
     def _find_product(self, products, product_id):
-        """CHANGE: 多种方式查找产品，兼容 W7841 / W-7841 等键名差异"""
+        """CHANGE: 多种方式查找产品，兼容 W7841 / W-7841 / w7841 等键名差异（别名索引，一次 dict 查询）"""
         if not products or not product_id:
             return None
-        pid = str(product_id).strip()
-        if pid in products:
-            return products[pid]
-        pid_no_hyphen = pid.replace('-', '')
-        if pid_no_hyphen in products:
-            return products[pid_no_hyphen]
-        import re
-        m = re.match(r'^([A-Za-z]+)(\d.*)$', pid_no_hyphen)
-        if m:
-            alt = m.group(1) + '-' + m.group(2)
-            if alt in products:
-                return products[alt]
-        for k, v in products.items():
-            if str(k).strip().replace('-', '') == pid_no_hyphen:
-                return v
-            if str(k).strip().upper() == pid.upper():
-                return v
-        return None
+        if hasattr(self.db, 'get_product_alias_index'):
+            index = self.db.get_product_alias_index(products)
+        else:
+            index = ProductAliasIndex(products.keys())
+        return index.lookup(products, product_id)
     
     def _get_price_tier(self, product, field_names, default=0):
         """CHANGE: 从产品中按多个可能的字段名读取价格层级"""
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PWA 产品目录快照（CatalogSnapshot）
+
+- 一次性从 PostgreSQL（或 SQLite）加载 Cristy 与其他供应商产品，组成不可变、带版本号的内存快照；
+- 后台线程按可配置间隔刷新，刷新完成后整体替换引用（原子切换），请求线程在列表/详情路径上不再访问数据库；
+- 内容指纹不变时不递增版本号，便于后续按版本缓存派生结构（索引、分页等）；
+- 传入 shared_store（SharedCatalogStore，多 gunicorn worker 共用的本机 SQLite）时，只有持有租约的 worker 查询数据源并发布，
+  其他 worker 每 CATALOG_SHARED_POLL_SECONDS 秒比对版本号并加载同一份快照，各 worker 版本号一致。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# CHANGE: 快照后台刷新间隔（秒），Render 上可用环境变量 CATALOG_REFRESH_SECONDS 调整
+DEFAULT_CATALOG_REFRESH_SECONDS = 60
+# 使用共享存储时检查其他 worker 是否已发布新版本的间隔（秒）
+DEFAULT_SHARED_POLL_SECONDS = 5
+
+
+def merge_product_rows(*row_lists: List[Tuple[Any, Dict]]) -> Dict[Any, Dict]:
+    """按 pid 与 product_code 双 key 合并多组 [(pid, pinfo)]，与 _get_products_dict_from_postgres 结构一致（后者覆盖前者）。"""
+    out = {}
+    for rows in row_lists:
+        for pid, pinfo in rows or ():
+            if pid is None:
+                continue
+            out[pid] = pinfo
+            code = (pinfo.get('product_code') or '').strip() or str(pid)
+            if code:
+                out[code] = pinfo
+    return out
+
+
+def _fingerprint(products: Dict, cristy, others) -> str:
+    """计算快照内容指纹：内容未变时版本号保持不变"""
+    h = hashlib.sha1()
+    for part in (cristy, others):
+        h.update(json.dumps(list(part), sort_keys=True, default=str, ensure_ascii=False).encode('utf-8'))
+    h.update(json.dumps(sorted(((str(k), v) for k, v in products.items()), key=lambda kv: kv[0]),
+                        default=str, ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+class CatalogSnapshot:
+    """不可变产品目录快照。
+
+    products / products_with_others 为只读映射，cristy / others 为元组；其中的 pinfo 字典由所有请求共享，调用方只读不写。
+    derived() 用于按快照缓存派生结构（如别名索引、搜索索引），同一版本只构建一次。
+    """
+
+    __slots__ = ('version', 'fingerprint', 'loaded_at', 'source', 'products', 'cristy', 'others',
+                 'products_with_others', '_derived', '_derived_lock')
+
+    def __init__(self, version: int, products: Dict, cristy: List[Tuple[Any, Dict]], others: List[Tuple[Any, Dict]],
+                 source: str = 'postgresql', fingerprint: str = '', loaded_at: Optional[float] = None):
+        _set = object.__setattr__
+        _set(self, 'version', int(version))
+        _set(self, 'fingerprint', fingerprint or _fingerprint(products, cristy, others))
+        _set(self, 'loaded_at', loaded_at or time.time())
+        _set(self, 'source', source)
+        _set(self, 'products', MappingProxyType(dict(products)))
+        _set(self, 'cristy', tuple(cristy or ()))
+        _set(self, 'others', tuple(others or ()))
+        # CHANGE: PRODUCTOS 以图为准需要「全库 + PG 非Cristy」映射，原来每次请求都往 products 里合并，现在预先合并一次
+        _merged = dict(products)
+        _merged.update(merge_product_rows(others))
+        _set(self, 'products_with_others', MappingProxyType(_merged))
+        _set(self, '_derived', {})
+        _set(self, '_derived_lock', threading.RLock())  # 派生结构可依赖其他派生结构（同线程重入）
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CatalogSnapshot 为只读快照，请通过 CatalogSnapshotManager 刷新')
+
+    def __delattr__(self, name):
+        raise AttributeError('CatalogSnapshot 为只读快照')
+
+    def __len__(self):
+        return len(self.products)
+
+    def __repr__(self):
+        return (f"CatalogSnapshot(version={self.version}, products={len(self.products)}, "
+                f"cristy={len(self.cristy)}, others={len(self.others)}, source={self.source!r})")
+
+    def derived(self, name: str, builder: Callable[['CatalogSnapshot'], Any]) -> Any:
+        """返回按本快照缓存的派生结构；不存在时调用 builder(snapshot) 构建一次。"""
+        value = self._derived.get(name)
+        if value is not None:
+            return value
+        with self._derived_lock:
+            value = self._derived.get(name)
+            if value is None:
+                value = builder(self)
+                self._derived[name] = value
+        return value
+
+
+class CatalogSnapshotManager:
+    """持有当前 CatalogSnapshot，负责首次加载、后台定时刷新与原子切换。
+
+    loader() 需返回 dict：{'products': {...}, 'cristy': [...], 'others': [...], 'source': 'postgresql'}。
+    """
+
+    def __init__(self, loader: Callable[[], Dict[str, Any]], refresh_interval: Optional[float] = None,
+                 name: str = 'catalog', shared_store=None):
+        self._loader = loader
+        self.shared_store = shared_store
+        if refresh_interval is None:
+            try:
+                refresh_interval = float(os.getenv('CATALOG_REFRESH_SECONDS', DEFAULT_CATALOG_REFRESH_SECONDS))
+            except (TypeError, ValueError):
+                refresh_interval = DEFAULT_CATALOG_REFRESH_SECONDS
+        self.refresh_interval = max(1.0, float(refresh_interval))
+        self.name = name
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[CatalogSnapshot], None]] = []
+        self.refresh_count = 0
+        self.last_refresh_at: Optional[float] = None
+        self.last_refresh_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        try:
+            self.shared_poll_interval = max(0.5, float(os.getenv('CATALOG_SHARED_POLL_SECONDS', DEFAULT_SHARED_POLL_SECONDS)))
+        except (TypeError, ValueError):
+            self.shared_poll_interval = float(DEFAULT_SHARED_POLL_SECONDS)
+        self.shared_adopt_count = 0
+
+    @property
+    def version(self) -> int:
+        snap = self._snapshot
+        return snap.version if snap is not None else 0
+
+    def add_listener(self, fn: Callable[[CatalogSnapshot], None]) -> None:
+        """注册快照切换回调（版本号变化时调用），用于失效依赖目录版本的缓存"""
+        self._listeners.append(fn)
+
+    def get(self) -> CatalogSnapshot:
+        """返回当前快照；尚未加载时同步加载一次（并发请求只会触发一次加载）"""
+        snap = self._snapshot
+        if snap is not None:
+            return snap
+        self.refresh()
+        snap = self._snapshot
+        if snap is None:
+            # 加载失败时返回空快照，保持与原先「PG 查询失败返回空列表」一致
+            snap = CatalogSnapshot(0, {}, [], [], source='empty')
+        return snap
+
+    def _load_source(self, current: Optional[CatalogSnapshot]) -> Optional[Tuple[Dict, list, list, str, str]]:
+        """调用 loader；返回 (products, cristy, others, source, fingerprint)，失败或得到空目录（已有快照时）返回 None"""
+        t0 = time.time()
+        try:
+            data = self._loader() or {}
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"⚠️ [{self.name}] 产品目录快照加载失败，继续使用旧快照: {e}")
+            return None
+        products = data.get('products') or {}
+        cristy = data.get('cristy') or []
+        others = data.get('others') or []
+        self.last_refresh_at = time.time()
+        self.last_refresh_seconds = self.last_refresh_at - t0
+        self.refresh_count += 1
+        if current is not None and current.products and not products:
+            self.last_error = 'empty catalog from loader'
+            logger.warning(f"⚠️ [{self.name}] 刷新得到空目录，保留旧快照 v{current.version}")
+            return None
+        return products, cristy, others, data.get('source') or 'postgresql', _fingerprint(products, cristy, others)
+
+    def _switch(self, snap: CatalogSnapshot) -> CatalogSnapshot:
+        """替换当前快照并通知监听者（调用方不持有 _refresh_lock）"""
+        for fn in list(self._listeners):
+            try:
+                fn(snap)
+            except Exception as e:
+                logger.warning(f"⚠️ [{self.name}] 快照切换回调失败: {e}")
+        return snap
+
+    def sync_shared(self, rebuild: bool = False) -> Optional[CatalogSnapshot]:
+        """CHANGE: 共享存储模式：存储中的快照已过刷新间隔（或 rebuild=True）且取得租约时，由本 worker 查询数据源并发布；
+        之后若存储版本与当前不同，加载存储中的快照。返回切换后的新快照，未切换返回 None。"""
+        store = self.shared_store
+        switched = None
+        with self._refresh_lock:
+            current = self._snapshot
+            head = store.head()
+            due = head is None or rebuild or time.time() - head.updated_at >= self.refresh_interval
+            built = None
+            acquired = due and store.try_acquire()
+            if not acquired and head is None and current is None:
+                # 首次启动且其他 worker 正在加载：等待其发布（租约过期则由本 worker 接手）
+                deadline = time.time() + store.lease_seconds
+                while head is None and not acquired and time.time() < deadline:
+                    time.sleep(0.5)
+                    head = store.head()
+                    acquired = head is None and store.try_acquire()
+            if acquired:
+                try:
+                    loaded = self._load_source(current)
+                    if loaded is not None:
+                        products, cristy, others, source, fp = loaded
+                        version = store.publish(fp, {'products': products, 'cristy': cristy, 'others': others}, source)
+                        self.last_error = None
+                        if current is None or current.fingerprint != fp:
+                            built = CatalogSnapshot(version, products, cristy, others, source=source, fingerprint=fp)
+                finally:
+                    store.release()
+                head = store.head()
+            if built is not None and head is not None and head.fingerprint == built.fingerprint:
+                switched = built
+            elif head is not None and (current is None or current.fingerprint != head.fingerprint
+                                       or current.version != head.version):
+                stored = store.read()
+                if stored is not None:
+                    data = stored.data
+                    switched = CatalogSnapshot(stored.version, data.get('products') or {}, data.get('cristy') or [],
+                                               data.get('others') or [], source=stored.source,
+                                               fingerprint=stored.fingerprint)
+                    self.shared_adopt_count += 1
+            if switched is not None:
+                self._snapshot = switched
+                logger.info(f"📦 [{self.name}] 产品目录快照已切换为共享 v{switched.version}: 产品={len(switched.products)}, "
+                            f"Cristy={len(switched.cristy)}, 其他={len(switched.others)}")
+        return self._switch(switched) if switched is not None else None
+
+    def refresh(self, force: bool = False) -> CatalogSnapshot:
+        """从数据源重新加载；内容指纹变化时生成新版本并原子替换当前快照"""
+        if self.shared_store is not None:
+            try:
+                self.sync_shared(rebuild=force)
+                return self._snapshot
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"⚠️ [{self.name}] 共享目录存储访问失败，本次直接从数据源加载: {e}")
+        with self._refresh_lock:
+            current = self._snapshot
+            # 等锁期间其他线程已完成首次加载时直接返回
+            if current is not None and not force and self.last_refresh_at and \
+                    time.time() - self.last_refresh_at < 1.0:
+                return current
+            # CHANGE: PG 查询失败时 loader 返回空结果，不能用空目录覆盖已有快照（_load_source 返回 None）
+            loaded = self._load_source(current)
+            if loaded is None:
+                return current
+            products, cristy, others, source, fp = loaded
+            if current is not None and current.fingerprint == fp:
+                self.last_error = None
+                logger.debug(f"[{self.name}] 产品目录无变化，保持 v{current.version}")
+                return current
+            snap = CatalogSnapshot((current.version if current is not None else 0) + 1, products, cristy, others,
+                                   source=source, fingerprint=fp)
+            self._snapshot = snap
+            self.last_error = None
+            logger.info(f"📦 [{self.name}] 产品目录快照已切换为 v{snap.version}: 产品={len(snap.products)}, "
+                        f"Cristy={len(snap.cristy)}, 其他={len(snap.others)}, 用时 {self.last_refresh_seconds:.2f}s")
+        return self._switch(snap)
+
+    def start(self) -> None:
+        """启动后台刷新线程（守护线程）：先预热一次，之后每 refresh_interval 秒刷新"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}-refresh', daemon=True)
+        self._thread.start()
+        logger.info(f"🔄 [{self.name}] 产品目录后台刷新已启动，间隔 {self.refresh_interval:.0f}s")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _run(self) -> None:
+        if self._snapshot is None:
+            self.refresh(force=self.shared_store is None)
+        # 共享模式下频繁轮询版本号（只有到期且取得租约的 worker 才查询数据源）
+        interval = self.shared_poll_interval if self.shared_store is not None else self.refresh_interval
+        while not self._stop_event.wait(interval):
+            try:
+                if self.shared_store is not None:
+                    self.sync_shared()
+                else:
+                    self.refresh(force=True)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"⚠️ [{self.name}] 后台刷新异常: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """快照状态，供 /api/health 等监控输出"""
+        snap = self._snapshot
+        return {
+            'version': snap.version if snap is not None else 0,
+            'products': len(snap.products) if snap is not None else 0,
+            'cristy': len(snap.cristy) if snap is not None else 0,
+            'others': len(snap.others) if snap is not None else 0,
+            'source': snap.source if snap is not None else None,
+            'age_seconds': round(time.time() - snap.loaded_at, 1) if snap is not None else None,
+            'refresh_interval': self.refresh_interval,
+            'refresh_count': self.refresh_count,
+            'last_refresh_seconds': round(self.last_refresh_seconds, 3) if self.last_refresh_seconds is not None else None,
+            'last_error': self.last_error,
+            'shared': self._shared_stats(),
+        }
+
+    def _shared_stats(self) -> Optional[Dict[str, Any]]:
+        if self.shared_store is None:
+            return None
+        try:
+            out = self.shared_store.stats()
+        except Exception as e:
+            return {'error': str(e)}
+        out['adopted'] = self.shared_adopt_count
+        return out
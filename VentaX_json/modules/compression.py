@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP 响应压缩（ResponseCompressor）：按 Accept-Encoding 协商 br / gzip，供 PWACartAPIServer 与 ventax_customer_bot_server 共用
+
+- 动态响应（JSON / 文本）：after_request 中超过 COMPRESS_MIN_BYTES（默认 1024）时即时压缩；
+  带强 ETag 的响应（产品列表/详情，含物化分页）压缩结果按（ETag, 编码）缓存并以正文摘要（blake2b + 长度）校验，
+  同一内容只压缩一次，之后的请求只是一次摘要 + 字典查找；同一 ETag 下正文不同（如物化列表到期重建后 ?v= 变化）时重新压缩；压缩后 ETag 改为弱 ETag（内容编码不同，语义相同），If-None-Match 按弱比较仍命中；
+- 静态文件（pwa_cart/ 下 app.js、styles.css、index.html 等）：send_static() 以最高压缩级别预先压缩，
+  按（路径, 编码）缓存并以 mtime_ns + 大小校验，文件变化后自动重建；条件请求 / Cache-Control 仍由 send_from_directory 处理；
+- brotli 为可选依赖（brotli 或 brotlicffi），未安装时只用 gzip。
+
+环境变量：COMPRESS_MIN_BYTES、COMPRESS_CACHE_MAX_MB（压缩结果缓存上限，默认 32）、COMPRESS_DISABLED=1 关闭。
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import brotli  # type: ignore
+    BROTLI_AVAILABLE = True
+except ImportError:
+    try:
+        import brotlicffi as brotli  # type: ignore
+        BROTLI_AVAILABLE = True
+    except ImportError:
+        brotli = None
+        BROTLI_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES') or 1024)
+DEFAULT_CACHE_BYTES = int(float(os.getenv('COMPRESS_CACHE_MAX_MB') or 32) * 1024 * 1024)
+# 即时压缩用较快的级别；按 ETag 缓存的结果只压缩一次，用较高级别；静态文件启动时预压缩，用最高级别
+DYNAMIC_LEVELS = {'br': 5, 'gzip': 6}
+CACHED_LEVELS = {'br': 8, 'gzip': 9}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'application/json', 'application/javascript', 'application/manifest+json', 'application/xml',
+    'image/svg+xml', 'text/css', 'text/html', 'text/javascript', 'text/plain', 'text/xml',
+})
+STATIC_EXTENSIONS = ('.js', '.css', '.html', '.json', '.svg', '.webmanifest', '.txt', '.xml')
+
+
+def compress_bytes(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _content_check(data: bytes) -> Tuple[bytes, int]:
+    """缓存的压缩结果与原文是否对应：只比长度不够（同长度的新正文会拿到旧的压缩字节）"""
+    return hashlib.blake2b(data, digest_size=16).digest(), len(data)
+
+
+class ResponseCompressor:
+    """协商编码 + 即时压缩 + 压缩结果 LRU（按字节数上限淘汰）"""
+
+    def __init__(self, min_size: int = DEFAULT_MIN_BYTES, max_cache_bytes: int = DEFAULT_CACHE_BYTES):
+        self.min_size = max(0, int(min_size))
+        self.max_cache_bytes = max(0, int(max_cache_bytes))
+        self.enabled = (os.getenv('COMPRESS_DISABLED') or '').strip().lower() not in ('1', 'true', 'yes')
+        self.encodings: Tuple[str, ...] = ('br', 'gzip') if BROTLI_AVAILABLE else ('gzip',)
+        # key -> (校验值, 压缩结果)；动态响应校验原文摘要 (blake2b, 长度)，静态文件校验 (mtime_ns, size)
+        self._cache: 'OrderedDict[Tuple, Tuple[Any, bytes]]' = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'dynamic': 0, 'cached': 0, 'static_built': 0, 'static_hits': 0,
+                          'bytes_in': 0, 'bytes_out': 0}
+
+    # ----- 协商 -----
+    def negotiate(self, accept_encodings) -> Optional[str]:
+        """accept_encodings 为 werkzeug 的 request.accept_encodings；q 值最高者优先，相同时 br 优先。无可用编码返回 None"""
+        if not self.enabled:
+            return None
+        best, best_q = None, 0.0
+        for enc in self.encodings:
+            q = accept_encodings[enc]
+            if q > best_q:
+                best, best_q = enc, q
+        return best
+
+    @staticmethod
+    def compressible(mimetype: Optional[str]) -> bool:
+        return bool(mimetype) and (mimetype in COMPRESSIBLE_MIMETYPES or mimetype.startswith('text/'))
+
+    # ----- 缓存（调用方持有 _lock） -----
+    def _cache_get(self, key: Tuple, check: Any) -> Optional[bytes]:
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != check:
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def _cache_put(self, key: Tuple, check: Any, data: bytes) -> None:
+        if len(data) > self.max_cache_bytes:
+            return
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cache_bytes -= len(old[1])
+        self._cache[key] = (check, data)
+        self._cache_bytes += len(data)
+        while self._cache_bytes > self.max_cache_bytes and self._cache:
+            _, (_, dropped) = self._cache.popitem(last=False)
+            self._cache_bytes -= len(dropped)
+
+    def _count(self, name: str, raw: int = 0, out: int = 0) -> None:
+        with self._lock:
+            self._counters[name] += 1
+            self._counters['bytes_in'] += raw
+            self._counters['bytes_out'] += out
+
+    # ----- 动态响应 -----
+    def compress_response(self, response, accept_encodings):
+        """after_request：200 且可压缩、未编码、非流式 / 非 send_file 的响应超过阈值时压缩（原地修改）"""
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+        if not self.compressible(response.mimetype) or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        encoding = self.negotiate(accept_encodings)
+        if encoding is None:
+            return response
+        etag, weak = response.get_etag()
+        body = None
+        if etag and not weak:
+            key = ('etag', etag, encoding)
+            check = _content_check(data)
+            with self._lock:
+                body = self._cache_get(key, check)
+            if body is None:
+                body = compress_bytes(data, encoding, CACHED_LEVELS[encoding])
+                with self._lock:
+                    self._cache_put(key, check, body)
+                self._count('dynamic', len(data), len(body))
+            else:
+                self._count('cached', len(data), len(body))
+            response.set_etag(etag, weak=True)
+        else:
+            body = compress_bytes(data, encoding, DYNAMIC_LEVELS[encoding])
+            self._count('dynamic', len(data), len(body))
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def init_app(self, app) -> 'ResponseCompressor':
+        """注册 after_request；应在其他 after_request 之前注册（Flask 倒序执行，压缩最后进行）"""
+        from flask import request
+
+        @app.after_request
+        def _compress_response(response):
+            try:
+                return self.compress_response(response, request.accept_encodings)
+            except Exception as e:
+                logger.warning(f"⚠️ 响应压缩失败，返回原文: {e}")
+                return response
+
+        # Flask 自带的 static 端点（static_url_path 下的文件）同样走预压缩
+        if app.has_static_folder and 'static' in app.view_functions:
+            def _static(filename):
+                return self.send_static(app.static_folder, filename, max_age=app.get_send_file_max_age(filename))
+            app.view_functions['static'] = _static
+        app.extensions['response_compressor'] = self
+        return self
+
+    # ----- 静态文件 -----
+    def _static_variant(self, path: str, encoding: str) -> Optional[bytes]:
+        st = os.stat(path)
+        check = (st.st_mtime_ns, st.st_size)
+        key = ('static', path, encoding)
+        with self._lock:
+            body = self._cache_get(key, check)
+        if body is not None:
+            self._count('static_hits', st.st_size, len(body))
+            return body
+        with open(path, 'rb') as f:
+            data = f.read()
+        body = compress_bytes(data, encoding, STATIC_LEVELS[encoding])
+        with self._lock:
+            self._cache_put(key, check, body)
+        self._count('static_built', len(data), len(body))
+        return body
+
+    def send_static(self, directory: str, filename: str, **kwargs):
+        """send_from_directory + 预压缩：200 响应且客户端接受压缩时换成缓存中的压缩结果（ETag 改为弱 ETag）"""
+        from flask import request, send_from_directory
+        from werkzeug.security import safe_join
+        response = send_from_directory(directory, filename, **kwargs)
+        if response.status_code != 200 or not self.compressible(response.mimetype):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(request.accept_encodings)
+        path = safe_join(directory, filename)
+        if encoding is None or not path or not os.path.isfile(path) or os.path.getsize(path) < self.min_size:
+            return response
+        body = self._static_variant(path, encoding)
+        response.close()
+        response.direct_passthrough = False
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def precompress_dir(self, directory: str, extensions: Iterable[str] = STATIC_EXTENSIONS) -> int:
+        """预先压缩 directory 本层的静态文件（所有可用编码），返回文件数；用于启动后台预热"""
+        count = 0
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(directory, name)
+            if not name.lower().endswith(tuple(extensions)) or not os.path.isfile(path):
+                continue
+            if os.path.getsize(path) < self.min_size:
+                continue
+            for encoding in self.encodings:
+                try:
+                    self._static_variant(path, encoding)
+                except OSError as e:
+                    logger.debug(f"预压缩跳过 {path}: {e}")
+            count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            out.update(entries=len(self._cache), cache_bytes=self._cache_bytes, max_cache_bytes=self.max_cache_bytes)
+        out.update(enabled=self.enabled, encodings=list(self.encodings), min_size=self.min_size)
+        out['ratio'] = round(out['bytes_out'] / out['bytes_in'], 3) if out['bytes_in'] else None
+        return out
@@ -5,6 +5,10 @@ import re
 import logging
 from datetime import datetime
 
+from product_alias_index import ProductAliasIndex
+from search_backends import install_sqlite_fts, sqlite_search_condition
+from sqlite_pool import SQLiteConnectionManager
+
 # CHANGE: 先初始化logger，避免在导入时使用未定义的logger
 logger = logging.getLogger(__name__)
 
@@ -72,15 +76,36 @@ class DatabaseManager:
         
         self.db_path = os.path.abspath(self.db_path)  # 转换为绝对路径
         self.logger.info(f"📁 数据库路径={self.db_path}")
+        # CHANGE: 产品别名索引缓存 (数据库文件签名, 索引)，数据库内容不变时复用
+        self._alias_index_cache = None
+        # CHANGE: 按线程复用长连接（PRAGMA 只执行一次、语句缓存跨调用命中），各方法 conn.close() 即归还
+        self._connections = SQLiteConnectionManager(self.db_path, name=os.path.basename(self.db_path))
         self._init_database()
         
+    def _connect(self):
+        """借出当前线程的数据库连接；调用方照旧 conn.close() 归还"""
+        return self._connections.connect()
+    
+    def transaction(self, immediate=False):
+        """事务上下文：with db.transaction() as conn: ...，正常结束提交，异常回滚；嵌套时使用 SAVEPOINT"""
+        return self._connections.transaction(immediate=immediate)
+    
+    def close(self):
+        """关闭所有线程的数据库连接（覆盖 / 删除数据库文件前调用）"""
+        self._connections.close()
+        self.logger.info(f"🔌 数据库连接已全部关闭: {self.db_path}")
+    
+    def connection_stats(self):
+        """连接复用统计（/api/health）"""
+        return self._connections.stats()
+        
     def _init_database(self):
         """初始化数据库"""
         try:
             # 确保数据库目录存在
             os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
             
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # 创建产品表（匹配主程序的表结构）
@@ -227,7 +252,7 @@ class DatabaseManager:
     def get_all_products(self):
         """获取所有产品 - 支持多规格价格"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # CHANGE: 根据数据库类型选择不同的SQL查询
@@ -365,10 +390,175 @@ class DatabaseManager:
             self.logger.error(traceback.format_exc())
             return {}
     
+    def _db_file_signature(self):
+        """数据库文件（含 WAL）的 mtime/size，用于判断产品数据是否变化"""
+        sig = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return tuple(sig)
+
+    def get_product_alias_index(self, products):
+        """CHANGE: 返回 get_all_products() 结果的别名索引；数据库文件与产品数未变时复用已构建的索引"""
+        sig = (self._db_file_signature(), len(products or {}))
+        cached = self._alias_index_cache
+        if cached is not None and cached[0] == sig:
+            return cached[1]
+        index = ProductAliasIndex((products or {}).keys())
+        self._alias_index_cache = (sig, index)
+        return index
+
+    def _products_page_columns(self):
+        """分页/搜索查询的列、基础条件与供应商列（spanish 库与旧英文库列名不同）"""
+        if self.use_spanish_db:
+            cols = ("id_producto", "codigo_producto", "nombre_producto", "precio_unidad", "precio_mayor", "precio_bulto",
+                    "ruta_imagen", "texto_procesado", "texto_original", "fecha_creacion", "codigo_proveedor",
+                    "channel_username", "inventario")
+            where = ["codigo_producto IS NOT NULL", "codigo_producto != ''", "esta_activo = 1"]
+            sup_col = "codigo_proveedor"
+        else:
+            cols = ("id", "product_code", "product_name", "price_unidad", "price_mayor", "price_bulto",
+                    "image_path", "processed_text", "original_text", "created_at", "NULL", "NULL", "stock")
+            where = ["product_code IS NOT NULL", "product_code != ''", "(is_active IS NULL OR is_active = 1)"]
+            sup_col = None
+        return cols, where, sup_col
+
+    @staticmethod
+    def _supplier_condition(sup_col, supplier, where, params, whitelist=None, exclude_prefixes=None, image_col=None):
+        """供应商条件（与服务端 _pg_products_filter 一致）：whitelist 为 other_supplier_codes 时，others 只含白名单供应商、
+        不指定 supplier 时为 Cristy + 白名单；exclude_prefixes 排除图片文件名以这些前缀开头的产品（未完成处理）"""
+        supplier_lower = (supplier or '').strip().lower()
+        codes = [c.strip().lower() for c in (whitelist or []) if c and c.strip()]
+        if sup_col and supplier_lower == 'cristy':
+            where.append(f"LOWER({sup_col}) = 'cristy'")
+        elif sup_col and supplier_lower == 'others':
+            if codes:
+                where.append(f"LOWER(COALESCE({sup_col}, '')) IN ({', '.join('?' * len(codes))})")
+                params.extend(codes)
+            else:
+                where.append(f"({sup_col} IS NULL OR LOWER({sup_col}) != 'cristy')")
+        elif sup_col and supplier_lower:
+            where.append(f"LOWER({sup_col}) = ?")
+            params.append(supplier_lower)
+        elif sup_col and codes:
+            where.append(f"(LOWER({sup_col}) = 'cristy' OR LOWER(COALESCE({sup_col}, '')) IN ({', '.join('?' * len(codes))}))")
+            params.extend(codes)
+        if image_col and exclude_prefixes and supplier_lower != 'cristy':
+            path = f"LOWER(REPLACE(COALESCE({image_col}, ''), '\\', '/'))"
+            for prefix in exclude_prefixes:
+                prefix = str(prefix or '').strip().lower().replace('%', '').replace('_', '\\_')
+                if prefix:
+                    where.append(f"{path} NOT LIKE ? ESCAPE '\\' AND {path} NOT LIKE ? ESCAPE '\\'")
+                    params.extend([prefix + '%', '%/' + prefix + '%'])
+
+    @staticmethod
+    def _products_page_row(row):
+        _unit, _mayor, _bulto = row[3], row[4], row[5]
+        return {
+            'id_producto': row[0],
+            'product_code': row[1],
+            'name': row[2] or f'Producto {row[1]}',
+            'price': float(_unit if (_unit is not None and _unit > 0) else (_mayor or _bulto or 0)),
+            'wholesale_price': float(_mayor or 0),
+            'bulk_price': float(_bulto or 0),
+            'image_path': row[6] or '',
+            'description': row[7] or row[8] or '',
+            'created_at': row[9] or '',
+            'codigo_proveedor': row[10] or '',
+            'channel_username': row[11] or '',
+            'stock': row[12] if row[12] is not None else 0,
+        }
+
+    def get_products_page(self, limit=30, after=None, offset=0, supplier=None, category=None, whitelist=None,
+                          exclude_prefixes=None):
+        """CHANGE: 产品分页（keyset）：ORDER BY 创建时间 DESC, id DESC，只读取 limit 行。
+        after=(created_at, id) 为上一页最后一行；offset 仅在无 after 时使用（兼容 page/limit）。
+        whitelist / exclude_prefixes 见 _supplier_condition（服务端传 other_supplier_codes 与 productos_exclude_file_prefixes）。
+        返回 [{'id_producto', 'product_code', 'name', 'price', 'wholesale_price', 'bulk_price', 'description',
+               'image_path', 'created_at', 'codigo_proveedor', 'channel_username', 'stock'}, ...]；
+        查询失败返回 None（与「没有更多行」的 [] 区分，调用方不能把失败当作列表结束）"""
+        # SQLite 产品库无分类列（get_all_products 统一为 default）
+        if category and category != 'default':
+            return []
+        conn = None
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cols, where, sup_col = self._products_page_columns()
+            id_col, created_col = cols[0], cols[9]
+            params = []
+            self._supplier_condition(sup_col, supplier, where, params, whitelist, exclude_prefixes, cols[6])
+            if after:
+                after_created, after_id = after
+                if after_created is None:
+                    where.append(f"({created_col} IS NULL AND {id_col} < ?)")
+                    params.append(after_id)
+                else:
+                    where.append(f"(({created_col}, {id_col}) < (?, ?) OR {created_col} IS NULL)")
+                    params.extend([after_created, after_id])
+            if not getattr(self, '_products_page_index_ready', False):
+                # 一次性建 (创建时间, id) 复合索引，keyset 翻页只扫 limit 行
+                try:
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_products_created_id ON products ({created_col} DESC, {id_col} DESC)")
+                    conn.commit()
+                except sqlite3.Error as e:
+                    self.logger.debug(f"创建分页索引失败（忽略）: {e}")
+                self._products_page_index_ready = True
+            # SQLite 中 NULL 最小，DESC 时自然排在最后（与 PG 的 NULLS LAST 一致）
+            sql = (f"SELECT {', '.join(cols)} FROM products WHERE {' AND '.join(where)} "
+                   f"ORDER BY {created_col} DESC, {id_col} DESC LIMIT ?")
+            params.append(int(limit))
+            if not after and offset:
+                sql += " OFFSET ?"
+                params.append(int(offset))
+            cursor.execute(sql, params)
+            return [self._products_page_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            self.logger.error(f"❌ 产品分页查询失败: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def search_products_page(self, search, limit=30, offset=0, supplier=None, category=None, whitelist=None,
+                             exclude_prefixes=None):
+        """CHANGE: 搜索下推到 SQLite：FTS5（trigram）虚表按关键词子串匹配，只取一页（LIMIT/OFFSET），
+        COUNT(*) OVER() 同时返回命中总数。返回 (rows, total)，行结构同 get_products_page；FTS5 不可用或查询失败返回 None（调用方回退进程内搜索）。"""
+        if category and category != 'default':
+            return [], 0
+        conn = None
+        try:
+            conn = self._connect()
+            if not getattr(self, '_products_fts_ready', False):
+                self._products_fts_ready = install_sqlite_fts(conn, spanish=self.use_spanish_db)
+                if not self._products_fts_ready:
+                    return None
+            cols, where, sup_col = self._products_page_columns()
+            id_col, created_col = cols[0], cols[9]
+            params = []
+            self._supplier_condition(sup_col, supplier, where, params, whitelist, exclude_prefixes, cols[6])
+            cond, cond_params = sqlite_search_condition(search, spanish=self.use_spanish_db, id_col=id_col)
+            where.append(cond)
+            params.extend(cond_params)
+            sql = (f"SELECT {', '.join(cols)}, COUNT(*) OVER () FROM products WHERE {' AND '.join(where)} "
+                   f"ORDER BY {created_col} DESC, {id_col} DESC LIMIT ? OFFSET ?")
+            params.extend([int(limit), max(0, int(offset))])
+            rows = conn.execute(sql, params).fetchall()
+            return [self._products_page_row(row) for row in rows], (rows[0][-1] if rows else 0)
+        except Exception as e:
+            self.logger.warning(f"⚠️ SQLite FTS5 搜索失败，回退进程内搜索: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
     def get_categories(self):
         """获取所有分类"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('SELECT * FROM categories')
@@ -388,7 +578,7 @@ class DatabaseManager:
     def get_product(self, product_id):
         """获取单个产品。支持按 codigo_producto/product_code 或 id_producto/id 查询（其他供应商可能用 id 当 code）。"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             pid_str = str(product_id).strip() if product_id is not None else ""
             if self.use_spanish_db:
@@ -448,7 +638,7 @@ class DatabaseManager:
     def get_product_image(self, product_id):
         """获取产品图片路径"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('SELECT image_path FROM products WHERE id = ?', (product_id,))
@@ -471,17 +661,8 @@ class DatabaseManager:
             self.logger.info(f"📥 开始获取购物车: user_id={user_id}, 数据库路径: {self.db_path}")
             self.logger.info(f"📥 数据库文件存在: {os.path.exists(self.db_path)}")
             
-            # 使用check_same_thread=False，避免多线程问题
-            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
-            # 设置WAL模式，改善并发性能
-            try:
-                conn.execute('PRAGMA journal_mode = WAL')
-            except:
-                pass  # 如果WAL模式不支持，忽略
-            # 设置超时时间，避免数据库锁定
-            conn.execute('PRAGMA busy_timeout = 10000')
-            # 确保读取最新数据
-            conn.execute('PRAGMA read_uncommitted = 1')
+            # CHANGE: WAL / busy_timeout 等 PRAGMA 在线程长连接建立时已执行一次（sqlite_pool）
+            conn = self._connect()
             cursor = conn.cursor()
             
             # 先检查user_carts表中是否有记录
@@ -509,6 +690,7 @@ class DatabaseManager:
             
             # 获取所有产品信息
             products = self.get_all_products()
+            alias_index = self.get_product_alias_index(products)
             self.logger.info(f"📦 产品字典大小: {len(products)}")
             
             # 手动构建购物车数据
@@ -518,22 +700,11 @@ class DatabaseManager:
                 self.logger.info(f"  📦 处理商品: product_id={product_id}, quantity={quantity}")
                 
                 # 从products字典中查找产品信息
-                product = products.get(str(product_id))
-                if not product:
-                    # 尝试字符串匹配
-                    for key, value in products.items():
-                        if str(key) == str(product_id):
-                            product = value
-                            self.logger.info(f"  ✅ 通过字符串匹配找到产品: {key}")
-                            break
-                if not product:
-                    # CHANGE: product_id 可能为 TG_JUGUETESFANG_90174 等形式，products 以数字 id 为 key；用数字部分再查
-                    nums = re.findall(r'\d+', str(product_id))
-                    for n in reversed(nums):  # 优先靠后的数字（如 90174）
-                        if products.get(str(n)):
-                            product = products[str(n)]
-                            self.logger.info(f"  ✅ 通过数字部分找到产品: product_id={product_id} -> key={n}")
-                            break
+                # CHANGE: 用别名索引解析（W-7841、10060_Al 等）；product_id 可能为 TG_JUGUETESFANG_90174 等形式，
+                # products 以数字 id 为 key，别名未命中时按数字部分（优先靠后的数字，如 90174）再查
+                product = alias_index.lookup(products, product_id, digits=True)
+                if product and str(product_id) not in products:
+                    self.logger.info(f"  ✅ 通过别名索引找到产品: product_id={product_id} -> key={alias_index.resolve(product_id, digits=True)}")
                 
                 if product:
                     # CHANGE: 增加 code（展示用产品代码，如 Y99），与 Sistema Factura 一致
@@ -578,17 +749,8 @@ class DatabaseManager:
             if cart:
                 self.logger.info(f"💾 购物车内容: {[item.get('product_id') for item in cart]}")
             
-            # 使用check_same_thread=False，避免多线程问题
-            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
-            # 设置WAL模式，改善并发性能
-            try:
-                conn.execute('PRAGMA journal_mode = WAL')
-            except:
-                pass  # 如果WAL模式不支持，忽略
-            # 设置超时时间，避免数据库锁定
-            conn.execute('PRAGMA busy_timeout = 10000')
-            # 确保立即写入
-            conn.execute('PRAGMA synchronous = NORMAL')
+            # CHANGE: WAL / busy_timeout 等 PRAGMA 在线程长连接建立时已执行一次（sqlite_pool）
+            conn = self._connect()
             cursor = conn.cursor()
             
             # 清空现有购物车
@@ -619,13 +781,11 @@ class DatabaseManager:
             # 立即同步到磁盘
             conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
             
-            # 验证保存是否成功（使用新的连接，确保读取到最新数据）
-            verify_conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
-            verify_cursor = verify_conn.cursor()
+            # 验证保存是否成功（事务已提交，同一连接读取到的即为已落盘数据）
+            verify_cursor = conn.cursor()
             verify_cursor.execute('SELECT COUNT(*) FROM user_carts WHERE user_id = ?', (user_id,))
             verify_count = verify_cursor.fetchone()[0]
-            verify_conn.close()
-            self.logger.info(f"✅ 保存后验证（新连接）: user_carts表中记录数={verify_count}")
+            self.logger.info(f"✅ 保存后验证: user_carts表中记录数={verify_count}")
             
             conn.close()
             self.logger.info(f"✅ 购物车保存成功: user_id={user_id}, 插入了 {inserted_count} 条记录")
@@ -711,15 +871,8 @@ class DatabaseManager:
             # 确保数据库表存在
             self._init_database()
             
-            # 使用check_same_thread=False，避免多线程问题
-            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
-            # 设置WAL模式，改善并发性能
-            try:
-                conn.execute('PRAGMA journal_mode = WAL')
-            except:
-                pass  # 如果WAL模式不支持，忽略
-            # 设置超时时间，避免数据库锁定
-            conn.execute('PRAGMA busy_timeout = 10000')
+            # CHANGE: WAL / busy_timeout 等 PRAGMA 在线程长连接建立时已执行一次（sqlite_pool）
+            conn = self._connect()
             # 注意：SQLite默认不启用外键约束，但在同一事务中插入数据时不需要外键约束
             # 暂时禁用外键约束，避免可能的约束检查问题
             # conn.execute("PRAGMA foreign_keys = ON")
@@ -942,6 +1095,7 @@ class DatabaseManager:
                     return True
                 return False
             products = self.get_all_products()
+            alias_index = self.get_product_alias_index(products)
             formatted_cart_items = []
             for item in cart_items:
                 pid = str(item.get('product_id', item.get('code', item.get('id', '')))).strip() or ''
@@ -952,18 +1106,7 @@ class DatabaseManager:
                     product_code = item_code
                     product_name = item_name or product_code
                 else:
-                    product = products.get(pid)
-                    if not product:
-                        for k, v in products.items():
-                            if str(k) == str(pid):
-                                product = v
-                                break
-                    if not product and pid:
-                        nums = re.findall(r'\d+', pid)
-                        for n in reversed(nums):
-                            if products.get(str(n)):
-                                product = products[str(n)]
-                                break
+                    product = alias_index.lookup(products, pid, digits=True)
                     if product:
                         product_code = str(product.get('id', pid) or pid)
                         resolved_name = (product.get('name') or '').strip() or product_code
@@ -1041,34 +1184,33 @@ class DatabaseManager:
                     # CHANGE: 同时写入 self.db_path 的 unified_orders，保证 get_user_orders（PWA 订单列表）读到与 CARRITO 一致的 total
                     try:
                         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        local_conn = sqlite3.connect(self.db_path)
-                        local_cur = local_conn.cursor()
-                        local_cur.execute('''
-                            CREATE TABLE IF NOT EXISTS unified_orders (
-                                order_id TEXT PRIMARY KEY,
-                                user_id TEXT,
-                                subtotal REAL,
-                                shipping REAL,
-                                total REAL,
-                                status TEXT,
-                                created_at TEXT,
-                                updated_at TEXT
-                            )
-                        ''')
-                        local_cur.execute('''
-                            INSERT OR REPLACE INTO unified_orders (order_id, user_id, subtotal, shipping, total, status, created_at, updated_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            order_data['order_id'],
-                            str(order_data['user_id']),
-                            float(order_data['subtotal']),
-                            float(order_data['shipping']),
-                            float(order_data['total']),
-                            order_data.get('status', 'pending'),
-                            now, now
-                        ))
-                        local_conn.commit()
-                        local_conn.close()
+                        # CHANGE: create_order 的主订单事务尚未提交，同一线程共用连接，transaction() 以 SAVEPOINT 写入，随主订单一起提交/回滚
+                        with self.transaction() as local_conn:
+                            local_cur = local_conn.cursor()
+                            local_cur.execute('''
+                                CREATE TABLE IF NOT EXISTS unified_orders (
+                                    order_id TEXT PRIMARY KEY,
+                                    user_id TEXT,
+                                    subtotal REAL,
+                                    shipping REAL,
+                                    total REAL,
+                                    status TEXT,
+                                    created_at TEXT,
+                                    updated_at TEXT
+                                )
+                            ''')
+                            local_cur.execute('''
+                                INSERT OR REPLACE INTO unified_orders (order_id, user_id, subtotal, shipping, total, status, created_at, updated_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            ''', (
+                                order_data['order_id'],
+                                str(order_data['user_id']),
+                                float(order_data['subtotal']),
+                                float(order_data['shipping']),
+                                float(order_data['total']),
+                                order_data.get('status', 'pending'),
+                                now, now
+                            ))
                         self.logger.info(f"✅ PWA订单已同步到本地 unified_orders (db_path): order_id={order_id}, total={order_data['total']}")
                     except Exception as local_err:
                         self.logger.warning(f"⚠️ 同步到本地 unified_orders 失败（不影响主流程）: {local_err}")
@@ -1119,7 +1261,7 @@ class DatabaseManager:
         orders_out = []
         conn = None
         try:
-            conn = sqlite3.connect(self.db_path, timeout=10.0)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('orders', 'order_items')"
@@ -1230,7 +1372,7 @@ class DatabaseManager:
             except Exception as shared_err:
                 self.logger.debug(f"📋 [get_user_orders] 从 shared_db 读取失败，回退到 db_path: {shared_err}")
 
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='unified_orders'")
             has_unified_orders = cursor.fetchone() is not None
@@ -1345,7 +1487,7 @@ class DatabaseManager:
     def get_order_detail(self, order_id, user_id=None):
         """获取订单详情（包括订单项） - CHANGE: 优先从unified_orders表读取，确保总价包含运费"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # CHANGE: 优先从unified_orders表读取订单详情
@@ -1502,7 +1644,7 @@ class DatabaseManager:
     def get_product_price_groups(self, product_code):
         """获取产品的所有价格组"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # 查询价格分组表
@@ -1539,7 +1681,7 @@ class DatabaseManager:
     def calculate_dynamic_price(self, product_code, group_number, quantity):
         """计算动态价格 - 支持多规格产品"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # 获取指定价格组的价格
@@ -1574,7 +1716,7 @@ class DatabaseManager:
     def create_user(self, email=None, password_hash=None, google_id=None, name=None, avatar_url=None, registration_method='email'):
         """创建新用户"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # 检查邮箱是否已存在
@@ -1623,7 +1765,7 @@ class DatabaseManager:
         try:
             # CHANGE: 确保邮箱是小写的，以便查询
             email = email.strip().lower() if email else ''
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             # CHANGE: 使用 LOWER() 函数进行不区分大小写的查询
             cursor.execute("""
@@ -1657,7 +1799,7 @@ class DatabaseManager:
     def get_user_by_google_id(self, google_id):
         """通过谷歌ID获取用户"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT id, email, password_hash, google_id, name, avatar_url, 
@@ -1690,7 +1832,7 @@ class DatabaseManager:
     def get_user_by_id(self, user_id):
         """通过ID获取用户"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT id, email, password_hash, google_id, name, avatar_url, 
@@ -1723,7 +1865,7 @@ class DatabaseManager:
     def update_user_last_login(self, user_id):
         """更新用户最后登录时间"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE users 
@@ -1742,7 +1884,7 @@ class DatabaseManager:
             user = self.get_user_by_email(email)
             if not user:
                 return None
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE users 
@@ -1759,7 +1901,7 @@ class DatabaseManager:
     def get_user_by_reset_token(self, token_hash):
         """通过重置 token 获取用户，仅当 token 有效且未过期时返回"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT id, email, password_hash, name FROM users 
@@ -1777,7 +1919,7 @@ class DatabaseManager:
     def update_password_and_clear_reset(self, user_id, password_hash):
         """更新密码并清除重置 token"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE users 
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产品分面统计（FacetIndex），用于 /api/products 响应中的 facets（供应商 / 分类 / 价格区间各有多少产品）
+
+按目录快照版本（CatalogSnapshot.derived）一次性建立：快照中每个可见产品占一个位，每个分面取值对应一个整数位图
+（Python int，按字节数组一次性生成）。统计时对「基础集合 & 其他分面的已选条件」与各取值位图做按位与再数 1，
+成本与分面取值个数（及位图字长）成正比，而不是每次请求遍历全部产品。
+
+分面语义：某个分面的计数应用「其他分面」的已选条件而不应用自身条件，客户端切换同一分面的取值时计数不变。
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+FACET_FIELDS = ('supplier', 'category', 'price_band')
+# 价格区间（单价，左闭右开）；最后一档无上限
+PRICE_BANDS: Tuple[Tuple[float, Optional[float], str], ...] = (
+    (0, 5, '0-5'),
+    (5, 10, '5-10'),
+    (10, 20, '10-20'),
+    (20, 50, '20-50'),
+    (50, None, '50+'),
+)
+
+
+def price_band(price) -> str:
+    """单价所在区间标签；无法解析的价格按 0 处理"""
+    try:
+        value = float(price or 0)
+    except (TypeError, ValueError):
+        value = 0.0
+    for low, high, label in PRICE_BANDS:
+        if value >= low and (high is None or value < high):
+            return label
+    return PRICE_BANDS[0][2]
+
+
+def _popcount(mask: int) -> int:
+    try:
+        return mask.bit_count()
+    except AttributeError:  # Python < 3.10
+        return bin(mask).count('1')
+
+
+def _facet_values(product_info: Dict) -> Dict[str, str]:
+    return {
+        'supplier': (product_info.get('codigo_proveedor') or '').strip(),
+        'category': str(product_info.get('category_id') or product_info.get('categoria') or 'default').strip(),
+        'price_band': price_band(product_info.get('price', product_info.get('precio_unidad'))),
+    }
+
+
+class FacetIndex:
+    """目录快照上的只读分面位图；counts() 返回各分面取值的产品数。
+    dedupe=False 时每行各占一位（物化列表按图片逐张列出，同一产品可能出现多次，计数需与列表条数一致）"""
+
+    def __init__(self, rows: Iterable[Tuple[Any, Dict]], dedupe: bool = True):
+        positions: Dict[str, int] = {}
+        members: Dict[str, Dict[str, List[int]]] = {f: {} for f in FACET_FIELDS}
+        labels: Dict[str, Dict[str, str]] = {f: {} for f in FACET_FIELDS}
+        by_code: Dict[str, int] = {}
+        for product_id, product_info in rows:
+            if not isinstance(product_info, dict):
+                continue
+            key = str(product_id)
+            if key in positions:
+                continue
+            # 快照按 pid 与 product_code 双 key 收录同一产品：同一代码只占一个位，两个 key 都映射到该位
+            code = str(product_info.get('product_code') or product_info.get('codigo_producto') or key).strip().lower()
+            if not dedupe:
+                code = f'{len(by_code)}\x00{code}'
+            pos = by_code.get(code)
+            if pos is not None:
+                positions[key] = pos
+                continue
+            pos = positions[key] = by_code[code] = len(by_code)
+            for facet, value in _facet_values(product_info).items():
+                norm = value.lower()
+                labels[facet].setdefault(norm, value)
+                members[facet].setdefault(norm, []).append(pos)
+        size = len(by_code)
+        self._size = size
+        self._positions = positions
+        self._labels = labels
+        self._bitmaps: Dict[str, Dict[str, int]] = {
+            facet: {norm: self._bitmap(pos_list, size) for norm, pos_list in values.items()}
+            for facet, values in members.items()
+        }
+        self.all = (1 << size) - 1
+
+    @staticmethod
+    def _bitmap(pos_list: List[int], size: int) -> int:
+        buf = bytearray((size + 7) // 8)
+        for pos in pos_list:
+            buf[pos >> 3] |= 1 << (pos & 7)
+        return int.from_bytes(bytes(buf), 'little')
+
+    def __len__(self):
+        return self._size
+
+    def stats(self) -> Dict[str, int]:
+        return {'products': self._size, **{f: len(v) for f, v in self._bitmaps.items()}}
+
+    def value_mask(self, facet: str, value: Optional[str]) -> int:
+        """某分面取值的位图（不区分大小写）；未选择时为全集，未知取值为空集"""
+        if value is None or str(value).strip() == '':
+            return self.all
+        return self._bitmaps.get(facet, {}).get(str(value).strip().lower(), 0)
+
+    def mask_for(self, product_ids: Iterable[Any]) -> int:
+        """任意产品集合（如搜索命中）的位图；不在快照中的产品忽略"""
+        positions = self._positions
+        buf = bytearray((self._size + 7) // 8)
+        for product_id in product_ids:
+            pos = positions.get(str(product_id))
+            if pos is not None:
+                buf[pos >> 3] |= 1 << (pos & 7)
+        return int.from_bytes(bytes(buf), 'little')
+
+    def counts(self, base: Optional[int] = None, selected: Optional[Dict[str, Optional[str]]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """base 为基础集合位图（默认全集）；selected 为 {分面: 已选取值}。返回 {分面: [{'value', 'count'}, ...]}，按数量降序，
+        price_band 按区间顺序；数量为 0 的取值省略"""
+        base = self.all if base is None else base
+        selected = selected or {}
+        masks = {f: self.value_mask(f, selected.get(f)) for f in FACET_FIELDS}
+        band_order = {label.lower(): i for i, (_, _, label) in enumerate(PRICE_BANDS)}
+        out: Dict[str, List[Dict[str, Any]]] = {}
+        for facet in FACET_FIELDS:
+            scope = base
+            for other in FACET_FIELDS:
+                if other != facet:
+                    scope &= masks[other]
+            values = []
+            for norm, bitmap in self._bitmaps[facet].items():
+                count = _popcount(bitmap & scope) if scope else 0
+                if count:
+                    values.append({'value': self._labels[facet][norm], 'count': count})
+            if facet == 'price_band':
+                values.sort(key=lambda v: band_order.get(v['value'].lower(), len(band_order)))
+            else:
+                values.sort(key=lambda v: (-v['count'], v['value'].lower()))
+            out[facet] = values
+        return out
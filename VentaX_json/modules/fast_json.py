@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可替换的快速 JSON 编码（FastJSONProvider），用于所有 API 响应（jsonify / app.json）
+
+Flask 默认 DefaultJSONProvider 用标准库 json（ensure_ascii 转义、每次判断缩进）。安装 orjson 或 ujson 时改用它们编码：
+- JSON_ENCODER=auto（默认，orjson 已安装时用 orjson，否则 stdlib）/ orjson / ujson / stdlib；
+  ujson 需显式指定：它把 Decimal 直接输出为数字、dataclass 输出为 {}，不经过 default，与 Flask 原输出不同；
+- 输出与 Flask 紧凑模式语义一致：键排序、紧凑分隔符；datetime/date 仍为 HTTP 日期、Decimal 为字符串（走 Flask 的 default）；
+  快速编码器直接输出 UTF-8（不做 \\uXXXX 转义），stdlib 保持原 ensure_ascii 行为，字节与原先完全相同；
+- 快速编码器不支持的值（超 64 位整数等）回退 stdlib；
+- dumps_bytes() 直接得到 bytes，json_response() 可直接接收缓存中已编码的 bytes（如物化分页），不再二次编码。
+
+微基准（30 条产品一页、5000 条订单同步数据）：python fast_json.py --bench
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+try:
+    import ujson  # type: ignore
+except ImportError:
+    ujson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_BACKENDS = ('auto', 'orjson', 'ujson', 'stdlib')
+
+
+def available_backends() -> List[str]:
+    out = []
+    if orjson is not None:
+        out.append('orjson')
+    if ujson is not None:
+        out.append('ujson')
+    out.append('stdlib')
+    return out
+
+
+def configured_backend() -> str:
+    """读取 JSON_ENCODER；auto 只在 orjson 与 stdlib 间选择，指定的编码器未安装时按 auto 选择"""
+    value = (os.getenv('JSON_ENCODER') or 'auto').strip().lower()
+    if value not in JSON_BACKENDS:
+        logger.warning(f"⚠️ JSON_ENCODER={value!r} 无效，使用 auto")
+        value = 'auto'
+    available = available_backends()
+    if value != 'auto' and value not in available:
+        logger.warning(f"⚠️ JSON_ENCODER={value} 未安装，按 auto 选择")
+        value = 'auto'
+    if value == 'auto':
+        return 'orjson' if 'orjson' in available else 'stdlib'
+    return value
+
+
+def _encoder(backend: str, default: Callable[[Any], Any], ensure_ascii: bool = True) -> Callable[[Any], bytes]:
+    """返回 obj -> 紧凑、键排序的 UTF-8 JSON bytes"""
+    if backend == 'orjson':
+        option = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS |
+                  orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+        return lambda obj: orjson.dumps(obj, default=default, option=option)
+    if backend == 'ujson':
+        return lambda obj: ujson.dumps(obj, ensure_ascii=False, sort_keys=True, escape_forward_slashes=False,
+                                       default=default).encode('utf-8')
+    return lambda obj: json.dumps(obj, default=default, ensure_ascii=ensure_ascii, sort_keys=True,
+                                  separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider：紧凑输出走 orjson / ujson（已安装时），其余（缩进等）与 DefaultJSONProvider 相同"""
+
+    def __init__(self, app, backend: Optional[str] = None):
+        super().__init__(app)
+        self.backend = backend or configured_backend()
+        self._fast = _encoder(self.backend, self.default, self.ensure_ascii)
+        self._stdlib = _encoder('stdlib', self.default, self.ensure_ascii)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        """紧凑、键排序的 JSON bytes"""
+        try:
+            return self._fast(obj)
+        except (TypeError, OverflowError):
+            if self.backend == 'stdlib':
+                raise
+            return self._stdlib(obj)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if not kwargs or kwargs == {'separators': (',', ':')}:
+            return self.dumps_bytes(obj).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if self.backend == 'orjson' and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+
+def json_response(payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None):
+    """响应工厂：payload 为 bytes 时视为已编码的 JSON 直接使用（缓存 / 物化结果），否则用当前 app 的 provider 编码"""
+    from flask import current_app
+    provider = current_app.json
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        body = bytes(payload)
+    elif isinstance(provider, FastJSONProvider):
+        body = provider.dumps_bytes(payload) + b'\n'
+    else:
+        body = provider.dumps(payload, separators=(',', ':')).encode('utf-8') + b'\n'
+    return current_app.response_class(body, status=status, headers=headers, mimetype=provider.mimetype)
+
+
+# ----- 微基准 -----
+def _bench_page(n: int = 30) -> Dict[str, Any]:
+    """与 /api/products 一页结构相同的样例（西语长描述）"""
+    desc = ("Set de organizadores plásticos para cocina, tapa hermética, apto para microondas y lavavajillas. "
+            "Medidas: 20×15×8 cm. Colores surtidos según disponibilidad; envío a todo Ecuador. ")
+    items = [{
+        'id': 10000 + i,
+        'product_code': f'{10000 + i}._AI',
+        'name': f'Organizador de cocina multiusos N°{i} – edición señorial',
+        'price': 2.5 + i * 0.25,
+        'wholesale_price': 2.0 + i * 0.2,
+        'bulk_price': 1.75 + i * 0.15,
+        'description': desc * 3,
+        'image_path': f'/api/images/{10000 + i}._AI.jpg?v=3f9a2c41b7d0e5a{i % 10}',
+        'image_srcset': ', '.join(f'/api/images/{10000 + i}._AI.jpg?v=3f9a2c41b7d0e5a{i % 10}&w={w}&fmt=webp {w}w'
+                                  for w in (160, 320, 480, 800)),
+        'category': 'hogar',
+        'created_at': f'2026-03-{i % 28 + 1:02d} 10:{i % 60:02d}:00',
+        'channel_username': 'NovedadesCristy_gye',
+        'codigo_proveedor': 'Cristy',
+    } for i in range(n)]
+    return {
+        'success': True,
+        'data': items,
+        'pagination': {'page': 1, 'limit': n, 'total': 4200, 'total_pages': 140},
+        'facets': {'supplier': [{'value': 'Cristy', 'count': 4200}],
+                   'category': [{'value': 'hogar', 'count': 2100}, {'value': 'cocina', 'count': 900}],
+                   'price_band': [{'value': '0-5', 'count': 3100}, {'value': '5-10', 'count': 1100}]},
+    }
+
+
+def _bench_orders(n: int = 5000) -> Dict[str, Any]:
+    """与 /api/sync/orders 结构相同的样例（get_orders_for_sync 的 order_data）"""
+    orders = []
+    for i in range(n):
+        items = [{'product_id': str(10000 + (i * 7 + k) % 4000), 'code': f'{10000 + (i * 7 + k) % 4000}._AI',
+                  'name': f'Organizador de cocina N°{k} – edición señorial', 'quantity': 1 + k % 12,
+                  'price': 2.5 + k * 0.25} for k in range(1 + i % 6)]
+        subtotal = round(sum(it['quantity'] * it['price'] for it in items), 2)
+        orders.append({
+            'order_id': f'ORD_{1700000000 + i}_{i:06d}',
+            'source': 'pwa',
+            'user_id': f'guest_{i * 7919 % 1000003}',
+            'nota': None,
+            'comprobante': f'001-002-{i:09d}',
+            'customer_info': {'name': f'María José Peñafiel {i}', 'phone': f'09{i:08d}',
+                              'address': 'Av. 9 de Octubre y Boyacá, Guayaquil', 'city': 'Guayaquil',
+                              'cedula': f'09{i:08d}', 'email': f'cliente{i}@correo.ec'},
+            'cart_items': items,
+            'subtotal': subtotal,
+            'shipping': 8.0,
+            'total': subtotal + 8.0,
+            'status': 'pending',
+            'pdf_path': None,
+        })
+    return {'success': True, 'data': orders}
+
+
+def _bench(rounds: int) -> int:
+    from flask import Flask
+    app = Flask(__name__)
+    flask_default = DefaultJSONProvider(app)
+    cases: List[Tuple[str, Callable[[Any], bytes]]] = [
+        ('flask-default', lambda obj: flask_default.dumps(obj, separators=(',', ':')).encode('utf-8')),
+    ]
+    for backend in available_backends():
+        provider = FastJSONProvider(app, backend=backend)
+        cases.append((backend, provider.dumps_bytes))
+    missing = [b for b in ('orjson', 'ujson') if b not in available_backends()]
+    payloads = [('page-30', _bench_page(), rounds), ('orders-5000', _bench_orders(), max(3, rounds // 100))]
+    print(f"{'payload':<14}{'encoder':<16}{'ms/op':>10}{'bytes':>12}{'vs flask':>10}")
+    for name, obj, n in payloads:
+        baseline = None
+        for label, encode in cases:
+            encode(obj)
+            t0 = time.perf_counter()
+            for _ in range(n):
+                out = encode(obj)
+            ms = (time.perf_counter() - t0) / n * 1000
+            baseline = baseline or ms
+            print(f"{name:<14}{label:<16}{ms:>10.3f}{len(out):>12}{baseline / ms:>9.1f}x")
+    if missing:
+        print(f"未安装: {', '.join(missing)}（pip install {' '.join(missing)} 后重跑）")
+    return 0
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='JSON 编码器微基准（30 条产品一页 / 5000 条订单同步）')
+    parser.add_argument('--bench', action='store_true', help='运行微基准')
+    parser.add_argument('--rounds', type=int, default=2000, help='一页样例的重复次数（订单样例为其 1/100）')
+    args = parser.parse_args()
+    if not args.bench:
+        parser.print_help()
+        sys.exit(0)
+    sys.exit(_bench(args.rounds))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产品图片文件名索引（ImageIndex）
+
+原来 get_products 每次请求都用 os.listdir + isfile/isdir 递归遍历 pwa_cart/Ya Subio、Ya Subio/Cristy、
+database/product_images、output_images（最多 10 层），图片多时是缓存未命中时最大的 CPU/系统调用开销。
+
+这里一次扫描 product_image_dirs，在内存中保存目录树（每个目录的文件名与子目录），之后按目录 mtime 增量更新：
+- 只对 mtime 变化的目录重新 listdir，未变化的目录只需一次 stat；新建/删除的子目录随父目录变化被发现；
+- 检查间隔可配置（环境变量 IMAGE_INDEX_CHECK_SECONDS，默认 5 秒），请求线程在检查进行中时直接使用当前结果；
+- mtime 未变的目录逐个 stat 其中的文件：原地覆盖图片不改变目录 mtime，文件大小或 mtime 变化同样视为内容变化；
+- 内容变化时递增 revision，派生的文件名列表按 revision 缓存；signature() 返回索引中文件的 (大小, mtime_ns)，
+  列表 ?v= 由它得出，因此 revision 不变时 ?v= 也不变（ETag 只需目录版本 + revision）。
+（标准库没有跨平台的 inotify，这里用 mtime 轮询，Windows 本地与 Render 上行为一致。）
+
+find() 供 /api/images/ 使用：按「主名（不含扩展名）小写」建映射，大小写与扩展名不敏感，一次 dict 查询定位文件；
+未命中的文件名进入有上限、带 TTL 的负缓存（IMAGE_NEGATIVE_CACHE_TTL / IMAGE_NEGATIVE_CACHE_MAX），索引 revision 变化时清空。
+"""
+
+import logging
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# CHANGE: 与原 _list_image_files_recursive 的 max_depth 一致
+DEFAULT_MAX_DEPTH = 10
+DEFAULT_CHECK_SECONDS = 5.0
+DEFAULT_NEGATIVE_TTL = 60.0
+DEFAULT_NEGATIVE_MAX = 10000
+# 正向查找结果缓存上限（revision 变化时清空）
+_FOUND_CACHE_MAX = 20000
+
+
+def is_image_filename(name: str) -> bool:
+    return (name or '').lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class _DirNode:
+    """单个目录的缓存：mtime、按 listdir 顺序的 (名称, 是否目录) 及文件的 (大小, mtime_ns)"""
+
+    __slots__ = ('mtime_ns', 'entries', 'sigs', 'files', 'file_set', 'subdirs')
+
+    def __init__(self, mtime_ns: int, entries: Tuple[Tuple[str, bool], ...], sigs: Dict[str, Tuple[int, int]]):
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.sigs = sigs
+        self.files = tuple(name for name, is_dir in entries if not is_dir)
+        self.file_set = frozenset(self.files)
+        self.subdirs = tuple(name for name, is_dir in entries if is_dir)
+
+
+class ImageIndex:
+    """图片目录索引。
+
+    roots：可配置图片目录（product_image_dirs），路径中含 ya_subio_marker 的目录在列表中排除 Cristy 子文件夹；
+    cristy_dirs：ULTIMO（Cristy）图片目录候选，取第一个存在的目录。
+    """
+
+    def __init__(self, roots: Sequence[str], cristy_dirs: Sequence[str] = (), ya_subio_marker: str = 'Ya Subio',
+                 exclude_subdirs: Iterable[str] = ('Cristy',), max_depth: int = DEFAULT_MAX_DEPTH,
+                 check_interval: Optional[float] = None, name: str = 'images'):
+        self.roots = [os.path.normpath(r) for r in roots if r]
+        self.cristy_dirs = [os.path.normpath(d) for d in cristy_dirs if d]
+        self.ya_subio_marker = ya_subio_marker
+        self.exclude_subdirs = tuple(exclude_subdirs or ())
+        self.max_depth = max_depth
+        if check_interval is None:
+            check_interval = _env_float('IMAGE_INDEX_CHECK_SECONDS', DEFAULT_CHECK_SECONDS)
+        self.check_interval = max(0.0, float(check_interval))
+        self.name = name
+        self.revision = 0
+        self._nodes: Dict[str, _DirNode] = {}
+        self._shallow: List[str] = []  # 只跟踪本层文件的目录（如详情页用的 Ya Subio 根目录）
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._derived: Dict[tuple, object] = {}
+        self._derived_revision = -1
+        self.scans = 0
+        self.relisted_dirs = 0
+        self.last_scan_seconds: Optional[float] = None
+        self.negative_ttl = max(0.0, _env_float('IMAGE_NEGATIVE_CACHE_TTL', DEFAULT_NEGATIVE_TTL))
+        self.negative_max = max(0, int(_env_float('IMAGE_NEGATIVE_CACHE_MAX', DEFAULT_NEGATIVE_MAX)))
+        self._found: Dict[tuple, str] = {}
+        self._negative: 'OrderedDict[tuple, float]' = OrderedDict()
+        self._lookup_revision = -1
+        self._lookup_lock = threading.Lock()
+        self.lookup_stats = {'hits': 0, 'misses': 0, 'negative_hits': 0}
+
+    # ----- 扫描 -----
+    @staticmethod
+    def _list_dir(path: str) -> Optional[_DirNode]:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            names = os.listdir(path)
+        except OSError:
+            return None
+        entries, sigs = [], {}
+        for name in names:
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                entries.append((name, False))
+                sigs[name] = (st.st_size, st.st_mtime_ns)
+            elif stat.S_ISDIR(st.st_mode):
+                entries.append((name, True))
+        return _DirNode(mtime_ns, tuple(entries), sigs)
+
+    @staticmethod
+    def _files_changed(path: str, node: _DirNode) -> bool:
+        """目录 mtime 未变时逐个 stat 文件：大小或 mtime 变化（原地覆盖）、文件消失都需重新 listdir"""
+        for name, sig in node.sigs.items():
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                return True
+            if (st.st_size, st.st_mtime_ns) != sig:
+                return True
+        return False
+
+    def _walk_nodes(self, path: str, depth: int, seen: Dict[str, int], changed: List[bool]) -> None:
+        """确保 path 及 max_depth 以内的子目录都有缓存节点（已缓存的节点不再 listdir）。
+        seen 记录每个目录被访问时的最小深度，同一目录既是根又是子目录（如 Ya Subio/Cristy）时按较浅的深度展开。"""
+        if depth >= self.max_depth or seen.get(path, self.max_depth) <= depth:
+            return
+        seen[path] = depth
+        node = self._nodes.get(path)
+        if node is None:
+            node = self._list_dir(path)
+            if node is None:
+                return
+            self._nodes[path] = node
+            self.relisted_dirs += 1
+            changed[0] = True
+        for sub in node.subdirs:
+            self._walk_nodes(os.path.join(path, sub), depth + 1, seen, changed)
+
+    def refresh(self, force: bool = False) -> int:
+        """增量刷新：stat 已缓存目录及其文件，目录 mtime 或文件 (大小, mtime) 变化的重新 listdir；返回当前 revision"""
+        if not force and self.scans and time.time() - self._last_check < self.check_interval:
+            return self.revision
+        if not self._lock.acquire(blocking=force or not self.scans):
+            # 其他线程正在刷新，先用当前结果
+            return self.revision
+        try:
+            if not force and self.scans and time.time() - self._last_check < self.check_interval:
+                return self.revision
+            t0 = time.time()
+            changed = [False]
+            for path, node in list(self._nodes.items()):
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    self._nodes.pop(path, None)
+                    changed[0] = True
+                    continue
+                if mtime_ns != node.mtime_ns or self._files_changed(path, node):
+                    new_node = self._list_dir(path)
+                    self.relisted_dirs += 1
+                    if new_node is None:
+                        self._nodes.pop(path, None)
+                        changed[0] = True
+                    else:
+                        if new_node.entries != node.entries or new_node.sigs != node.sigs:
+                            changed[0] = True
+                        self._nodes[path] = new_node
+            seen: Dict[str, int] = {}
+            for root in self.roots + self.cristy_dirs:
+                self._walk_nodes(root, 0, seen, changed)
+            for path in self._shallow:
+                if path not in self._nodes:
+                    node = self._list_dir(path)
+                    if node is not None:
+                        self._nodes[path] = node
+                        changed[0] = True
+                seen.setdefault(path, 0)
+            # 删除不再可达的目录（已删除或被移出）
+            for path in [p for p in self._nodes if p not in seen]:
+                del self._nodes[path]
+                changed[0] = True
+            if changed[0] or self.scans == 0:
+                self.revision += 1
+            self.scans += 1
+            self._last_check = time.time()
+            self.last_scan_seconds = self._last_check - t0
+            if changed[0]:
+                logger.info(f"📷 [{self.name}] 图片索引更新为 r{self.revision}: 目录 {len(self._nodes)} 个，"
+                            f"用时 {self.last_scan_seconds:.3f}s")
+            return self.revision
+        finally:
+            self._lock.release()
+
+    def _cached(self, key: tuple, builder):
+        """按 revision 缓存派生结果"""
+        self.refresh()
+        if self._derived_revision != self.revision:
+            self._derived = {}
+            self._derived_revision = self.revision
+        derived = self._derived
+        value = derived.get(key)
+        if value is None:
+            value = builder()
+            derived[key] = value
+        return value
+
+    def derived(self, name, builder):
+        """CHANGE: 供调用方缓存基于文件列表的派生结构（如 ImageMatchIndex），随 revision 失效重建"""
+        return self._cached(('derived', name), builder)
+
+    # ----- 查询 -----
+    def _iter_files(self, root: str, exclude_subdirs: Tuple[str, ...], images_only: bool):
+        """按原递归顺序（listdir 顺序，遇到子目录即展开）产出 (basename, 绝对路径)"""
+        nodes = self._nodes
+
+        def _walk(path, depth):
+            if depth >= self.max_depth:
+                return
+            node = nodes.get(path)
+            if node is None:
+                return
+            for name, is_dir in node.entries:
+                if not is_dir:
+                    if not images_only or is_image_filename(name):
+                        yield name, os.path.join(path, name)
+                elif name not in exclude_subdirs:
+                    yield from _walk(os.path.join(path, name), depth + 1)
+
+        return _walk(os.path.normpath(root), 0)
+
+    def files(self, root: str, exclude_subdirs: Iterable[str] = ()) -> Tuple[str, ...]:
+        """root 递归下的图片文件名（basename，可重复），等同原 _list_image_files_recursive(_exclude)"""
+        exclude = tuple(exclude_subdirs or ())
+        return self._cached(('files', root, exclude),
+                            lambda: tuple(n for n, _ in self._iter_files(root, exclude, True)))
+
+    def dir_files(self, path: str) -> Tuple[str, ...]:
+        """path 本层的所有文件名（不递归、不限扩展名），目录未被跟踪时加入跟踪"""
+        path = os.path.normpath(path)
+        if path not in self._nodes and path not in self._shallow:
+            with self._lock:
+                if path not in self._shallow:
+                    self._shallow.append(path)
+            self.refresh(force=True)
+        node = self._nodes.get(path)
+        return node.files if node is not None else ()
+
+    def signature(self, path: str) -> Optional[Tuple[int, int]]:
+        """索引中文件的 (大小, mtime_ns)，与 revision 同步更新；文件不在索引中时返回 None"""
+        node = self._nodes.get(os.path.dirname(os.path.normpath(path)))
+        return node.sigs.get(os.path.basename(path)) if node is not None else None
+
+    def cristy_dir(self) -> Optional[str]:
+        """ULTIMO 图片目录：cristy_dirs 中第一个存在的目录"""
+        for d in self.cristy_dirs:
+            if d in self._nodes:
+                return d
+        return None
+
+    def listing_sets(self) -> Dict[str, Tuple[str, ...]]:
+        """产品列表用的三组文件名（与原 get_products 中逻辑一致）：
+        ya_subio_no_cristy：所有目录（Ya Subio 排除 Cristy 子文件夹）去重；
+        ya_subio_only：仅 Ya Subio 目录（排除 Cristy）；
+        cristy：ULTIMO 图片目录递归。"""
+        def _build():
+            no_cristy, ya_only, seen = [], [], set()
+            for root in self.roots:
+                if root not in self._nodes:
+                    continue
+                is_ya_subio = self.ya_subio_marker in root or os.path.basename(root.rstrip(os.sep)) == self.ya_subio_marker
+                for f in self.files(root, self.exclude_subdirs if is_ya_subio else ()):
+                    if f not in seen:
+                        seen.add(f)
+                        no_cristy.append(f)
+                        if is_ya_subio:
+                            ya_only.append(f)
+            cristy_dir = self.cristy_dir()
+            cristy = self.files(cristy_dir) if cristy_dir else ()
+            return {
+                'ya_subio_no_cristy': tuple(no_cristy),
+                'ya_subio_only': tuple(ya_only),
+                'cristy': tuple(cristy),
+            }
+        return self._cached(('listing_sets',), _build)
+
+    def _stem_map(self, root: str, exclude_subdirs: Tuple[str, ...]) -> Dict[str, str]:
+        """root 递归下「主名小写 -> 绝对路径」（不限扩展名，同主名取遍历顺序中第一个），
+        等同原 _find_file_recursive 的匹配条件（文件名相同或主名相同，均不区分大小写）"""
+        def _build():
+            out = {}
+            for name, path in self._iter_files(root, exclude_subdirs, False):
+                out.setdefault(os.path.splitext(name)[0].lower(), path)
+            return out
+        return self._cached(('stem_map', root, exclude_subdirs), _build)
+
+    def _find_uncached(self, names: Tuple[str, ...], trees: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> Optional[str]:
+        for root, exclude in trees:
+            root = os.path.normpath(root)
+            node = self._nodes.get(root)
+            if node is None:
+                continue
+            # 1) 根目录下精确文件名
+            for name in names:
+                if name in node.file_set:
+                    return os.path.join(root, name)
+            # 2) 递归：主名相同（大小写、扩展名不敏感）
+            stems = self._stem_map(root, exclude)
+            for name in names:
+                path = stems.get(os.path.splitext(name)[0].lower())
+                if path:
+                    return path
+        return None
+
+    def find(self, names: Sequence[str], trees: Sequence[Tuple[str, Iterable[str]]]) -> Optional[str]:
+        """按 trees 顺序（[(目录, 排除的子目录名), ...]）查找 names 中任一文件名，返回绝对路径或 None。
+        命中与未命中都会缓存：命中在 revision 不变时直接返回，未命中在 TTL 内直接返回 None。"""
+        names = tuple(n for n in dict.fromkeys(names) if n)
+        trees = tuple((os.path.normpath(r), tuple(ex or ())) for r, ex in trees if r)
+        if not names:
+            return None
+        key = (names, trees)
+        self.refresh()
+        now = time.time()
+        with self._lookup_lock:
+            if self._lookup_revision != self.revision:
+                self._found.clear()
+                self._negative.clear()
+                self._lookup_revision = self.revision
+            path = self._found.get(key)
+            if path is not None:
+                self.lookup_stats['hits'] += 1
+                return path
+            expires = self._negative.get(key)
+            if expires is not None:
+                if expires > now:
+                    self.lookup_stats['negative_hits'] += 1
+                    return None
+                del self._negative[key]
+        path = self._find_uncached(names, trees)
+        with self._lookup_lock:
+            if path is not None:
+                self.lookup_stats['hits'] += 1
+                if len(self._found) >= _FOUND_CACHE_MAX:
+                    self._found.clear()
+                self._found[key] = path
+            else:
+                self.lookup_stats['misses'] += 1
+                if self.negative_ttl > 0 and self.negative_max > 0:
+                    self._negative[key] = now + self.negative_ttl
+                    self._negative.move_to_end(key)
+                    while len(self._negative) > self.negative_max:
+                        self._negative.popitem(last=False)
+        return path
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'revision': self.revision,
+            'dirs': len(self._nodes),
+            'roots': list(self.roots),
+            'cristy_dir': self.cristy_dir(),
+            'scans': self.scans,
+            'relisted_dirs': self.relisted_dirs,
+            'check_interval': self.check_interval,
+            'last_scan_seconds': round(self.last_scan_seconds, 4) if self.last_scan_seconds is not None else None,
+            'lookups': dict(self.lookup_stats),
+            'negative_cache_size': len(self._negative),
+        }
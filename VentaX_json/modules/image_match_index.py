@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片文件名 -> 产品 的匹配索引（ImageMatchIndex）
+
+get_products 通用列表分支原来对每个产品调用 resolve_image_for_product，最多六次遍历整份图片文件列表
+（精确文件名、._AI/._Al 规范化、telegram_<id>、msg_<id>_ 前缀、数字段候选、子串 _file_base_matches_product），
+每次未缓存请求的成本为 O(产品数 × 图片数) 的 splitext/正则/子串运算。
+
+这里对一份有序文件列表一次性建立索引（随 ImageIndex revision 重建）：
+- 文件名小写 -> 第一个文件；主名小写 / 规范化主名 / 数字段 / msg_<id>_ 前缀 -> 文件序号列表（保持原列表顺序）；
+- 子串规则（最后一轮）：「文件主名是 product_id 的子串」枚举 product_id 的子串查表，
+  「product_id 是文件主名的子串」用三字母组倒排表取最短的倒排链逐个验证。
+每一轮都返回「原线性扫描中第一个满足条件的文件」，结果与 resolve_image_linear（原实现，保留作对照）完全一致；
+python image_match_index.py --selfcheck 用内置样例 + 随机语料验证两者一致。
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Sequence
+
+# 查找结果缓存上限，超出后整体清空（索引随图片 revision 重建）
+_MEMO_MAX = 8192
+
+_SEGMENT_SPLIT_RE = re.compile(r'[_\-.\s]+')
+
+
+def normalize_image_filename(name):
+    """去掉文件名两侧方括号，使 DB 路径与 pwa_cart/Ya Subio 实际文件名一致；支持全角【】"""
+    if not name or not isinstance(name, str):
+        return name
+    s = name.strip()
+    if len(s) >= 2 and s[0] == '[' and s[-1] == ']':
+        return s[1:-1].strip()
+    # CHANGE: 支持全角括号 【30568】-> 30568，便于 DB 路径与磁盘文件名匹配
+    s = re.sub(r'[【\[](\d+)[】\]]', r'\1', s)
+    return s
+
+
+def normalize_base_ai_al(base):
+    """CHANGE: 文件名 ._AI 与 ._Al 等价（磁盘可能存为 ._Al.jpg），便于匹配"""
+    if not base or not isinstance(base, str):
+        return (base or '').strip().lower()
+    s = base.strip().lower()
+    if s.endswith('._al') and not s.endswith('._ai'):
+        return s[:-4] + '._ai'
+    return s
+
+
+def file_base_matches_product(base_f, pid):
+    """CHANGE: 仅当图片文件名（base）与产品标识一致时才算匹配，通过图片名字匹配不可能出错。"""
+    if not pid:
+        return False
+    pid_str = (str(pid).strip().lower()).strip()
+    base_s = (base_f if isinstance(base_f, str) else str(base_f)).strip().lower()
+    if not pid_str or not base_s:
+        return False
+    norm_pid = normalize_base_ai_al(pid_str)
+    norm_base = normalize_base_ai_al(base_s)
+    return (norm_base == norm_pid or norm_pid in norm_base or norm_base in norm_pid)
+
+
+def message_id_from_name(name):
+    """从 DB 文件名或 product_id 提取 message_id 数字，如 Importadora_Chinito_26820 -> 26820"""
+    if not name:
+        return None
+    s = (name if isinstance(name, str) else str(name)).replace('-', '_').strip().lower()
+    parts = s.split('_')
+    # 原图片文件名格式 msg_{message_id}_{codigo}：取第二段为 message_id
+    if len(parts) >= 2 and parts[0] == 'msg' and parts[1].isdigit() and len(parts[1]) >= 2:
+        return parts[1]
+    for p in reversed(parts):
+        if p.isdigit() and len(p) >= 2:
+            return p
+    return None
+
+
+def _api_path_filename(img_path: str) -> str:
+    """/api/images/<名>?v= -> <名>；其他路径取 basename（均去方括号）"""
+    if img_path.startswith('/api/images/'):
+        return normalize_image_filename(img_path.replace('/api/images/', '').split('?')[0].strip())
+    return normalize_image_filename(os.path.basename(img_path.replace('/', os.sep).replace('\\', os.sep).strip()))
+
+
+def _basename_filename(img_path: str) -> str:
+    return normalize_image_filename(os.path.basename(img_path.replace('/', os.path.sep).replace('\\', os.sep).strip()))
+
+
+def _number_to_try(mid, base_db: str):
+    if mid:
+        return mid
+    if base_db:
+        for p in reversed(_SEGMENT_SPLIT_RE.split(base_db.lower())):
+            if p.isdigit() and len(p) >= 2:
+                return p
+    return None
+
+
+def resolve_image_linear(files: Sequence[str], pid, img_path) -> str:
+    """原 get_products 内 resolve_image_for_product 的线性实现，仅作 ImageMatchIndex 的对照基准（--selfcheck）"""
+    if not files:
+        return ''
+    mid = None
+    if img_path:
+        fname = _api_path_filename(img_path)
+        if fname:
+            base_db = os.path.splitext(fname)[0]
+            for f in files:
+                base_f = os.path.splitext(f)[0]
+                if f.lower() == fname.lower():
+                    if file_base_matches_product(base_f, pid):
+                        return f'/api/images/{f}'
+                    if base_f.lower() == base_db.lower():
+                        return f'/api/images/{f}'
+            for f in files:
+                base_f = os.path.splitext(f)[0]
+                if (base_f.lower() == base_db.lower() or normalize_base_ai_al(base_f) == normalize_base_ai_al(base_db)) and file_base_matches_product(base_f, pid):
+                    return f'/api/images/{f}'
+            for f in files:
+                base_f = os.path.splitext(f)[0]
+                if base_f.lower() == base_db.lower():
+                    return f'/api/images/{f}'
+    if not mid and img_path:
+        fname = _basename_filename(img_path)
+        base_db = os.path.splitext(fname)[0] if fname else ''
+        mid = message_id_from_name(base_db)
+    if mid:
+        tg_name = 'telegram_' + mid
+        for f in files:
+            base_f = os.path.splitext(f)[0]
+            if base_f.lower() == tg_name and file_base_matches_product(base_f, pid):
+                return f'/api/images/{f}'
+        for f in files:
+            base_f = os.path.splitext(f)[0]
+            if base_f.lower() == mid and file_base_matches_product(base_f, pid):
+                return f'/api/images/{f}'
+        msg_prefix = 'msg_' + mid + '_'
+        for f in files:
+            base_f = os.path.splitext(f)[0]
+            if base_f.lower().startswith(msg_prefix) and file_base_matches_product(base_f, pid):
+                return f'/api/images/{f}'
+    base_db = ''
+    if img_path:
+        fname = _api_path_filename(img_path)
+        base_db = os.path.splitext(fname)[0] if fname else ''
+    if not base_db and pid:
+        base_db = str(pid).strip()
+    num_to_try = _number_to_try(mid, base_db)
+    if num_to_try:
+        candidates = [f for f in files if num_to_try in _SEGMENT_SPLIT_RE.split(os.path.splitext(f)[0].lower())]
+        if candidates:
+            if base_db:
+                for f in candidates:
+                    base_f = os.path.splitext(f)[0]
+                    if (base_db.lower() in base_f.lower() or base_f.lower() in base_db.lower() or normalize_base_ai_al(base_f) == normalize_base_ai_al(base_db)) and file_base_matches_product(base_f, pid):
+                        return f'/api/images/{f}'
+            for f in candidates:
+                base_f = os.path.splitext(f)[0]
+                if file_base_matches_product(base_f, pid):
+                    return f'/api/images/{f}'
+    for f in files:
+        base_f = os.path.splitext(f)[0]
+        if file_base_matches_product(base_f, pid):
+            return f'/api/images/{f}'
+    return ''
+
+
+def _append(table: Dict[str, List[int]], key: str, i: int) -> None:
+    lst = table.get(key)
+    if lst is None:
+        table[key] = [i]
+    elif lst[-1] != i:
+        lst.append(i)
+
+
+class ImageMatchIndex:
+    """对有序图片文件名列表建立的只读匹配索引；resolve() 与 resolve_image_linear() 结果一致"""
+
+    def __init__(self, files: Sequence[str]):
+        self.files = tuple(files)
+        by_lower: Dict[str, int] = {}
+        by_base_lower: Dict[str, List[int]] = {}
+        by_norm_base: Dict[str, List[int]] = {}
+        by_segment: Dict[str, List[int]] = {}
+        by_msg_id: Dict[str, List[int]] = {}
+        trigrams: Dict[str, List[int]] = {}
+        base_lower: List[str] = []
+        norm_base: List[str] = []
+        for i, f in enumerate(self.files):
+            bl = os.path.splitext(f)[0].lower()
+            nb = normalize_base_ai_al(bl)
+            base_lower.append(bl)
+            norm_base.append(nb)
+            by_lower.setdefault(f.lower(), i)
+            _append(by_base_lower, bl, i)
+            _append(by_norm_base, nb, i)
+            for seg in _SEGMENT_SPLIT_RE.split(bl):
+                _append(by_segment, seg, i)
+            # msg_<id>_xxx：startswith('msg_' + id + '_') 等价于 msg_ 之后到下一个 _ 的一段等于 id
+            if bl.startswith('msg_'):
+                head, sep, _ = bl[4:].partition('_')
+                if sep:
+                    _append(by_msg_id, head, i)
+            for k in range(len(nb) - 2):
+                _append(trigrams, nb[k:k + 3], i)
+        self._by_lower = by_lower
+        self._by_base_lower = by_base_lower
+        self._by_norm_base = by_norm_base
+        self._by_segment = by_segment
+        self._by_msg_id = by_msg_id
+        self._trigrams = trigrams
+        self._base_lower = base_lower
+        self._norm_base = norm_base
+        self._norm_base_lengths = sorted({len(nb) for nb in norm_base if nb})
+        self._memo: Dict[tuple, str] = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    @staticmethod
+    def _norm_pid(pid) -> str:
+        """file_base_matches_product 中 product_id 一侧的规范形式；空串表示任何文件都不匹配"""
+        if not pid:
+            return ''
+        pid_str = (str(pid).strip().lower()).strip()
+        return normalize_base_ai_al(pid_str) if pid_str else ''
+
+    def _matches(self, i: int, norm_pid: str) -> bool:
+        nb = self._norm_base[i]
+        return bool(norm_pid and nb) and (nb == norm_pid or norm_pid in nb or nb in norm_pid)
+
+    def _first_match(self, norm_pid: str) -> Optional[int]:
+        """等价于按顺序扫描全部文件取第一个 file_base_matches_product 为真的序号"""
+        if not norm_pid:
+            return None
+        best = None
+        # 文件主名（规范化）是 product_id 的子串（含相等）：枚举 product_id 中长度存在于索引的子串
+        by_norm_base = self._by_norm_base
+        n = len(norm_pid)
+        for length in self._norm_base_lengths:
+            if length > n:
+                break
+            for start in range(n - length + 1):
+                lst = by_norm_base.get(norm_pid[start:start + length])
+                if lst and (best is None or lst[0] < best):
+                    best = lst[0]
+        # product_id 是文件主名的子串：取最短的三字母组倒排链逐个验证（链内序号递增，首个命中即最小）
+        norm_base = self._norm_base
+        if n >= 3:
+            shortest = None
+            for k in range(n - 2):
+                lst = self._trigrams.get(norm_pid[k:k + 3])
+                if not lst:
+                    return best
+                if shortest is None or len(lst) < len(shortest):
+                    shortest = lst
+            candidates = shortest
+        else:
+            candidates = range(len(norm_base))
+        for i in candidates:
+            if best is not None and i >= best:
+                break
+            if norm_pid in norm_base[i]:
+                return i
+        return best
+
+    def resolve(self, pid, img_path) -> str:
+        """返回 '/api/images/<文件名>'，无匹配返回 ''（规则与顺序同 resolve_image_linear）"""
+        if not self.files:
+            return ''
+        memo_key = (pid, img_path)
+        try:
+            cached = self._memo.get(memo_key)
+        except TypeError:
+            memo_key, cached = None, None
+        if cached is not None:
+            return cached
+        i = self._resolve_index(pid, img_path)
+        result = f'/api/images/{self.files[i]}' if i is not None else ''
+        if memo_key is not None:
+            if len(self._memo) >= _MEMO_MAX:
+                self._memo.clear()
+            self._memo[memo_key] = result
+        return result
+
+    def _resolve_index(self, pid, img_path) -> Optional[int]:
+        norm_pid = self._norm_pid(pid)
+        mid = None
+        # 1) 有 DB 路径：精确文件名 -> 规范化主名且与产品一致 -> 主名相同
+        if img_path:
+            fname = _api_path_filename(img_path)
+            if fname:
+                base_db = os.path.splitext(fname)[0]
+                i = self._by_lower.get(fname.lower())
+                if i is not None:
+                    return i
+                for i in self._by_norm_base.get(normalize_base_ai_al(base_db), ()):
+                    if self._matches(i, norm_pid):
+                        return i
+                lst = self._by_base_lower.get(base_db.lower())
+                if lst:
+                    return lst[0]
+        # 2) message_id：telegram_<id> -> <id> -> msg_<id>_ 前缀
+        if img_path:
+            fname = _basename_filename(img_path)
+            mid = message_id_from_name(os.path.splitext(fname)[0] if fname else '')
+        if mid:
+            for table, key in ((self._by_base_lower, 'telegram_' + mid), (self._by_base_lower, mid),
+                               (self._by_msg_id, mid)):
+                for i in table.get(key, ()):
+                    if self._matches(i, norm_pid):
+                        return i
+        # 3) 数字段候选，优先主名互相包含
+        base_db = ''
+        if img_path:
+            fname = _api_path_filename(img_path)
+            base_db = os.path.splitext(fname)[0] if fname else ''
+        if not base_db and pid:
+            base_db = str(pid).strip()
+        num_to_try = _number_to_try(mid, base_db)
+        if num_to_try:
+            candidates = self._by_segment.get(num_to_try, ())
+            if candidates and base_db:
+                bdl = base_db.lower()
+                norm_db = normalize_base_ai_al(base_db)
+                for i in candidates:
+                    bl = self._base_lower[i]
+                    if (bdl in bl or bl in bdl or self._norm_base[i] == norm_db) and self._matches(i, norm_pid):
+                        return i
+            for i in candidates:
+                if self._matches(i, norm_pid):
+                    return i
+        # 4) 文件主名与 product_id 互相包含
+        return self._first_match(norm_pid)
+
+
+def _selfcheck(rounds: int = 3000, seed: int = 7) -> int:
+    """内置样例 + 随机语料对照 resolve_image_linear，返回不一致数"""
+    import random
+    files = [
+        'W7841.jpg', 'w7841.png', 'W-7841.jpg', '10060._Al.jpg', '10060._AI.png', '10060.jpg', '[30568].jpg', '30568.jpg',
+        'telegram_26820.jpg', '26820.jpg', 'msg_26820_ABC12.jpg', 'msg_26821_x.jpg', 'msg_268_.jpg',
+        'importadoraWoni_115_no_white.jpg', 'Importadora_Chinito_26820.jpg', 'TG_JUGUETESFANG_90174.jpg',
+        'ab.jpg', 'a.jpg', 'x.y.z.jpg', '.hidden.jpg', ' spaced .jpg', 'CR-001 rojo.webp', 'cr_001.jpg', 'Ñandú_12.jpg',
+        'IMP158_7788_a.jpg', 'ayacuchoamoreshop-4455.png', '4455.png', 'sub/dir.jpg',
+    ]
+    cases = [
+        ('W7841', '/api/images/W7841.jpg'), ('w-7841', ''), ('10060_Al', '/api/images/10060._AI.jpg'),
+        ('10060', '/api/images/10060._Al.jpg?v=1'), ('30568', '/api/images/[30568].jpg'),
+        ('Importadora_Chinito_26820', '/api/images/Importadora_Chinito_26820.jpeg'), ('26820', 'telegram_26820.jpg'),
+        ('msg_26820_abc12', '/api/images/msg_26820_ABC12.png'), ('TG_JUGUETESFANG_90174', ''), ('90174', ''),
+        ('importadoraWoni_115', '/api/images/importadoraWoni_115.jpg'), ('a', ''), ('', '/api/images/ab.jpg'),
+        (None, '/api/images/missing_4455.jpg'), ('ÑANDÚ', ''), ('cr-001', 'D:\\imgs\\CR-001 rojo.webp'),
+        ('spaced', '/api/images/ spaced .jpg'), ('IMP158_7788', '/pwa_cart/static/img/IMP158_7788_a.jpg'),
+        (4455, ''), ('zzz', '/api/images/sub/dir.jpg'), ('hidden', '.hidden.jpg'),
+    ]
+    alphabet = ['a', 'b', 'W', '7', '8', '1', '0', '_', '-', '.', ' ', 'msg_', 'telegram_', '_Al', '._AI', '26820', '12']
+    rnd = random.Random(seed)
+
+    def _word():
+        return ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 6)))
+
+    for _ in range(rounds):
+        cases.append((rnd.choice([_word(), None, '', rnd.choice(files).rsplit('.', 1)[0]]),
+                      rnd.choice(['', '/api/images/' + _word() + '.jpg', _word() + '.png',
+                                  '/api/images/' + rnd.choice(files) + '?v=abc'])))
+    corpora = [files, files[::-1], [], [_word() + rnd.choice(['.jpg', '.png', '']) for _ in range(400)]]
+    mismatches = 0
+    for corpus in corpora:
+        index = ImageMatchIndex(corpus)
+        for pid, img_path in cases:
+            expected = resolve_image_linear(corpus, pid, img_path)
+            got = index.resolve(pid, img_path)
+            if got != expected:
+                mismatches += 1
+                print(f"❌ 不一致 pid={pid!r} img_path={img_path!r}: 线性={expected!r} 索引={got!r}")
+    print(f"{'✅' if not mismatches else '❌'} ImageMatchIndex 自检: {len(corpora)} 组语料 × {len(cases)} 个用例，不一致 {mismatches} 个")
+    return mismatches
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='ImageMatchIndex 与原线性匹配规则的一致性自检')
+    parser.add_argument('--selfcheck', action='store_true', help='运行内置样例 + 随机语料对照')
+    parser.add_argument('--rounds', type=int, default=3000, help='随机用例数')
+    args = parser.parse_args()
+    if not args.selfcheck:
+        parser.print_help()
+        sys.exit(0)
+    sys.exit(1 if _selfcheck(args.rounds) else 0)
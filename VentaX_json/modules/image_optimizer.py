@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线批量生成产品图片缩略变体（WebP），并写出 JSON 清单。
+
+遍历 product_image_dirs（与 pwa_cart_api_server 相同的配置来源：port_config.json pwa_cart.product_image_dirs、
+环境变量 PWA_PRODUCT_IMAGE_DIRS，默认 pwa_cart/Ya Subio），按列表卡片与详情页常用档位预先缩放编码；
+编码分散到多个 CPU 核（ProcessPoolExecutor），源文件 mtime/大小未变且输出仍在的图片直接跳过。
+
+清单（默认 pwa_cart/optimized/manifest.json）结构：
+  {"images": {"<文件名>": {"source": 相对清单目录的源路径, "mtime_ns", "bytes", "width", "height",
+                           "variants": {"320": {"path", "format", "width", "height", "bytes"}, ...}}}}
+API 服务启动时加载该清单（image_variants.ImageVariantManifest），/api/images/<名>?w= 命中即直接发送预生成文件；
+输出目录连同清单也可随图片上传到 Cloudflare Pages / R2。
+
+用法：
+  python image_optimizer.py
+  python image_optimizer.py --widths 320,960 --workers 4
+  python image_optimizer.py --dirs "D:/Ya Subio" --out "D:/optimized" --force
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+from image_index import is_image_filename
+from image_variants import (DEFAULT_OPTIMIZED_DIR, DEFAULT_QUALITY, MANIFEST_NAME, PIL_AVAILABLE, VARIANT_FORMATS,
+                            encode_variant, pil_supports)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# 列表卡片 srcset（160/320/640）+ 详情页（960）
+DEFAULT_OPTIMIZE_WIDTHS = (160, 320, 640, 960)
+PWA_YA_SUBIO_BASE = os.path.normpath(os.path.join(SCRIPT_DIR, 'pwa_cart', 'Ya Subio'))
+
+
+def _configured_image_dirs():
+    """与 PWACartAPIServer 相同：port_config.json -> PWA_PRODUCT_IMAGE_DIRS -> 默认 Ya Subio，再加入存在的 Telegram/output_images 目录"""
+    dirs = []
+    config_path = os.path.join(SCRIPT_DIR, '..', 'port_config.json')
+    try:
+        if os.path.isfile(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                _dirs = (json.load(f).get('pwa_cart') or {}).get('product_image_dirs')
+            if isinstance(_dirs, list):
+                dirs = [os.path.normpath(str(d).strip()) for d in _dirs if str(d).strip()]
+    except Exception as e:
+        logger.warning("读取 port_config.json 图片路径失败: %s", e)
+    if not dirs and os.getenv('PWA_PRODUCT_IMAGE_DIRS'):
+        dirs = [os.path.normpath(p.strip()) for p in os.getenv('PWA_PRODUCT_IMAGE_DIRS', '').split(',') if p.strip()]
+    if not dirs:
+        dirs = [PWA_YA_SUBIO_BASE]
+    for extra in (os.path.join(SCRIPT_DIR, '..', 'database', 'product_images'),
+                  os.path.join(SCRIPT_DIR, '..', '..', 'output_images')):
+        extra = os.path.normpath(os.path.abspath(extra))
+        if extra not in dirs and os.path.isdir(extra):
+            dirs.append(extra)
+    return dirs
+
+
+def _iter_sources(dirs, out_dir):
+    """按 /api/images/ 的查找顺序产出 (根目录, 源文件路径)：各目录先 Cristy 子文件夹，再其余部分；跳过输出目录"""
+    out_dir = os.path.normcase(os.path.abspath(out_dir))
+    for root in dirs:
+        if not os.path.isdir(root):
+            logger.warning("图片目录不存在，跳过: %s", root)
+            continue
+        for base, skip in ((os.path.join(root, 'Cristy'), ()), (root, ('Cristy',))):
+            if not os.path.isdir(base):
+                continue
+            for cur, subdirs, files in os.walk(base):
+                subdirs[:] = sorted(d for d in subdirs
+                                    if not (cur == base and d in skip)
+                                    and os.path.normcase(os.path.abspath(os.path.join(cur, d))) != out_dir)
+                for name in sorted(files):
+                    if is_image_filename(name):
+                        yield root, os.path.join(cur, name)
+
+
+def _root_labels(dirs):
+    """每个图片目录在输出目录下的子目录名（目录名，重名时加序号）"""
+    labels, used = {}, set()
+    for root in dirs:
+        label = os.path.basename(os.path.normpath(root)) or 'images'
+        n = 2
+        candidate = label
+        while candidate in used:
+            candidate = f"{label}_{n}"
+            n += 1
+        used.add(candidate)
+        labels[root] = candidate
+    return labels
+
+
+def _relpath(path, start):
+    try:
+        return os.path.relpath(path, start).replace(os.sep, '/')
+    except ValueError:
+        # Windows 下跨盘符时无法取相对路径
+        return os.path.abspath(path)
+
+
+def _optimize_one(source, targets, fmt, quality):
+    """工作进程：按各档位编码一张图。targets 为 [(宽度, 输出路径)]；返回 {宽度: (宽, 高, 字节数)} 与源图尺寸"""
+    from PIL import Image
+    with Image.open(source) as im:
+        src_size = im.size
+    out = {}
+    for width, target in targets:
+        w, h = encode_variant(source, target, width, fmt, quality)
+        out[width] = (w, h, os.path.getsize(target))
+    return src_size, out
+
+
+def _entry_up_to_date(entry, st, widths, fmt, out_dir):
+    if not entry or entry.get('mtime_ns') != st.st_mtime_ns or entry.get('bytes') != st.st_size:
+        return False
+    variants = entry.get('variants') or {}
+    for w in widths:
+        v = variants.get(str(w))
+        if not v or v.get('format') != fmt or not os.path.isfile(os.path.join(out_dir, v.get('path') or '')):
+            return False
+    return True
+
+
+def _load_manifest(path):
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f) or {}
+    except Exception as e:
+        logger.warning("旧清单无法读取，将全部重新生成 %s: %s", path, e)
+        return {}
+
+
+def _write_manifest(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量生成产品图片 WebP 缩略变体与清单")
+    parser.add_argument("--dirs", nargs='*', default=None, help="图片目录（默认与 API 服务相同的 product_image_dirs）")
+    parser.add_argument("--out", default=None, help=f"输出目录（默认 IMAGE_OPTIMIZED_DIR 或 {DEFAULT_OPTIMIZED_DIR}）")
+    parser.add_argument("--widths", default=None,
+                        help=f"逗号分隔的宽度档位（默认 {','.join(map(str, DEFAULT_OPTIMIZE_WIDTHS))}）")
+    parser.add_argument("--format", default='webp', choices=sorted(VARIANT_FORMATS), help="输出格式（默认 webp）")
+    parser.add_argument("--quality", type=int, default=None, help=f"编码质量（默认 IMAGE_VARIANT_QUALITY 或 {DEFAULT_QUALITY}）")
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--force", action="store_true", help="忽略 mtime，全部重新生成")
+    args = parser.parse_args()
+
+    if not PIL_AVAILABLE:
+        logger.error("未安装 Pillow（pip install Pillow），无法生成图片变体")
+        sys.exit(1)
+    fmt = 'jpeg' if args.format == 'jpg' else args.format
+    if not pil_supports(fmt):
+        logger.error("当前 Pillow 不支持编码 %s", fmt)
+        sys.exit(1)
+    try:
+        widths = sorted({int(w) for w in (args.widths or '').split(',') if w.strip()}) or list(DEFAULT_OPTIMIZE_WIDTHS)
+    except ValueError:
+        logger.error("--widths 格式错误: %s", args.widths)
+        sys.exit(1)
+    quality = args.quality or int(os.getenv('IMAGE_VARIANT_QUALITY') or DEFAULT_QUALITY)
+    quality = max(1, min(100, quality))
+    out_dir = os.path.abspath(args.out or os.getenv('IMAGE_OPTIMIZED_DIR') or DEFAULT_OPTIMIZED_DIR)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    dirs = [os.path.normpath(os.path.abspath(d)) for d in (args.dirs or _configured_image_dirs())]
+    os.makedirs(out_dir, exist_ok=True)
+    logger.info("图片目录: %s", dirs)
+    logger.info("输出目录: %s，档位 %s，格式 %s，质量 %d", out_dir, widths, fmt, quality)
+
+    old_images = {} if args.force else (_load_manifest(manifest_path).get('images') or {})
+    labels = _root_labels(dirs)
+    ext = VARIANT_FORMATS[fmt][2]
+    images, tasks, skipped = {}, {}, 0
+    for root, source in _iter_sources(dirs, out_dir):
+        name = os.path.basename(source)
+        if name in images or name in tasks:
+            # 同名文件以 /api/images/ 查找顺序中第一个为准
+            continue
+        try:
+            st = os.stat(source)
+        except OSError:
+            continue
+        rel_source = _relpath(source, out_dir)
+        old = old_images.get(name)
+        if old and old.get('source') == rel_source and _entry_up_to_date(old, st, widths, fmt, out_dir):
+            images[name] = old
+            skipped += 1
+            continue
+        stem = os.path.splitext(os.path.relpath(source, root))[0]
+        targets = [(w, os.path.join(out_dir, labels[root], f"{stem}.w{w}{ext}")) for w in widths]
+        tasks[name] = (source, rel_source, st, targets)
+
+    logger.info("共 %d 张图片：%d 张未变化跳过，%d 张待生成", len(images) + len(tasks), skipped, len(tasks))
+    t0 = time.time()
+    failed = 0
+    if tasks:
+        with ProcessPoolExecutor(max_workers=args.workers or os.cpu_count() or 1) as pool:
+            futures = {pool.submit(_optimize_one, t[0], t[3], fmt, quality): name for name, t in tasks.items()}
+            for i, future in enumerate(as_completed(futures), 1):
+                name = futures[future]
+                source, rel_source, st, targets = tasks[name]
+                try:
+                    (src_w, src_h), out = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.warning("生成失败 %s: %s", source, e)
+                    continue
+                images[name] = {
+                    'source': rel_source,
+                    'mtime_ns': st.st_mtime_ns,
+                    'bytes': st.st_size,
+                    'width': src_w,
+                    'height': src_h,
+                    'variants': {
+                        str(w): {'path': _relpath(target, out_dir), 'format': fmt,
+                                 'width': out[w][0], 'height': out[w][1], 'bytes': out[w][2]}
+                        for w, target in targets
+                    },
+                }
+                if i % 100 == 0:
+                    logger.info("进度 %d / %d", i, len(tasks))
+
+    # 删除旧清单中已不再引用的变体文件（源图删除或改名）
+    keep = {v['path'] for e in images.values() for v in (e.get('variants') or {}).values()}
+    removed = 0
+    for entry in old_images.values():
+        for v in (entry.get('variants') or {}).values():
+            path = v.get('path')
+            if path and path not in keep and os.path.isfile(os.path.join(out_dir, path)):
+                try:
+                    os.remove(os.path.join(out_dir, path))
+                    removed += 1
+                except OSError:
+                    pass
+
+    _write_manifest(manifest_path, {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'format': fmt,
+        'quality': quality,
+        'widths': widths,
+        'images': images,
+    })
+    total = sum(v['bytes'] for e in images.values() for v in e['variants'].values())
+    logger.info("完成：生成 %d 张，失败 %d 张，删除旧变体 %d 个，用时 %.1fs；清单 %s（%d 张，变体共 %.1f MB）",
+                len(tasks) - failed, failed, removed, time.time() - t0, manifest_path, len(images), total / 1024 / 1024)
+    if failed:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
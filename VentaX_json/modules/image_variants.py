@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产品图片缩略变体（/api/images/<name>?w=320&fmt=webp）
+
+PWA 网格只显示小图，但 /api/images/ 原来总是返回 Ya Subio 中的原尺寸 JPEG（常见几百 KB），厄瓜多尔移动网络下很慢。
+这里按需生成缩放 + 重新编码的变体：
+- 宽度只允许白名单（IMAGE_VARIANT_WIDTHS，请求值向上取到最近的档位），避免任意尺寸请求耗尽 CPU/磁盘；
+- 变体写入磁盘缓存目录（IMAGE_VARIANT_CACHE_DIR），key 为 (源文件路径, 源 mtime/大小, 宽度, 格式, 质量)；
+- 缓存总大小有上限（IMAGE_VARIANT_CACHE_MB），超出时按最近使用时间淘汰（LRU）；
+- 同一 key 加锁，并发的首次请求只编码一次。
+Pillow 为可选依赖：未安装时 PIL_AVAILABLE=False，调用方直接返回原图。
+另有 ImageVariantManifest：读取 image_optimizer.py 离线预生成的变体清单，命中时不需在线编码。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+logger = logging.getLogger(__name__)
+
+# CHANGE: Pillow 可选，未安装时 /api/images/?w= 返回原图
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = ImageOps = None
+    PIL_AVAILABLE = False
+
+DEFAULT_WIDTHS = (160, 320, 480, 640, 960, 1280)
+# 列表卡片 srcset 使用的档位
+DEFAULT_SRCSET_WIDTHS = (160, 320, 640)
+DEFAULT_QUALITY = 80
+DEFAULT_CACHE_MB = 256
+# CHANGE: image_optimizer.py 离线预生成的输出目录与清单（可随图片一起上传 Pages/R2）
+DEFAULT_OPTIMIZED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pwa_cart', 'optimized')
+MANIFEST_NAME = 'manifest.json'
+
+# fmt 参数 -> (Pillow 格式名, MIME, 扩展名)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'avif': ('AVIF', 'image/avif', '.avif'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'jpg': ('JPEG', 'image/jpeg', '.jpg'),
+}
+
+
+def _env_widths(name: str, default: Sequence[int]) -> Tuple[int, ...]:
+    raw = (os.getenv(name) or '').strip()
+    if not raw:
+        return tuple(default)
+    try:
+        widths = sorted({int(w) for w in raw.split(',') if w.strip()})
+        return tuple(w for w in widths if w > 0) or tuple(default)
+    except ValueError:
+        logger.warning(f"⚠️ 环境变量 {name}={raw!r} 非法，使用默认值 {default}")
+        return tuple(default)
+
+
+def pil_supports(fmt: str) -> bool:
+    """当前 Pillow 是否能编码该格式（AVIF 需要 Pillow 11.3+ 或 pillow-avif-plugin）"""
+    if not PIL_AVAILABLE:
+        return False
+    spec = VARIANT_FORMATS.get(fmt)
+    if not spec:
+        return False
+    Image.init()
+    return spec[0] in Image.SAVE
+
+
+def encode_variant(source_path: str, target_path: str, width: int, fmt: str,
+                   quality: int = DEFAULT_QUALITY) -> Tuple[int, int]:
+    """把 source_path 缩放到不超过 width 宽并按 fmt 编码写入 target_path（先写临时文件再替换），返回输出尺寸 (宽, 高)。
+    在线缓存（ImageVariantCache）与离线批处理（image_optimizer.py）共用。"""
+    pil_format = VARIANT_FORMATS[fmt][0]
+    with Image.open(source_path) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.width > width:
+            height = max(1, round(im.height * width / im.width))
+            im = im.resize((width, height), Image.LANCZOS)
+        if pil_format == 'JPEG':
+            if im.mode != 'RGB':
+                im = im.convert('RGB')
+        elif im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'A' in im.getbands() or 'transparency' in im.info else 'RGB')
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                save_kwargs = {'quality': quality}
+                if pil_format == 'WEBP':
+                    save_kwargs['method'] = 4
+                elif pil_format == 'JPEG':
+                    save_kwargs.update(optimize=True, progressive=True)
+                im.save(f, format=pil_format, **save_kwargs)
+            os.replace(tmp_path, target_path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return im.width, im.height
+
+
+class ImageVariantCache:
+    """缩略变体磁盘缓存（大小受限的 LRU）"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+                 widths: Optional[Sequence[int]] = None, quality: Optional[int] = None):
+        self.cache_dir = os.path.abspath(cache_dir or os.getenv('IMAGE_VARIANT_CACHE_DIR') or
+                                         os.path.join(tempfile.gettempdir(), 'ventax_image_variants'))
+        if max_bytes is None:
+            try:
+                max_bytes = int(float(os.getenv('IMAGE_VARIANT_CACHE_MB') or DEFAULT_CACHE_MB) * 1024 * 1024)
+            except ValueError:
+                max_bytes = DEFAULT_CACHE_MB * 1024 * 1024
+        self.max_bytes = max(1024 * 1024, int(max_bytes))
+        self.widths = tuple(sorted(widths)) if widths else _env_widths('IMAGE_VARIANT_WIDTHS', DEFAULT_WIDTHS)
+        if quality is None:
+            try:
+                quality = int(os.getenv('IMAGE_VARIANT_QUALITY') or DEFAULT_QUALITY)
+            except ValueError:
+                quality = DEFAULT_QUALITY
+        self.quality = max(1, min(100, quality))
+        self._entries: 'OrderedDict[str, Tuple[str, int]]' = OrderedDict()  # key -> (路径, 字节数)，末尾为最近使用
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, list] = {}  # key -> [Lock, 引用计数]
+        self._loaded = False
+        self.stats_counters = {'hits': 0, 'encoded': 0, 'evicted': 0, 'errors': 0}
+
+    # ----- 参数规范化 -----
+    def normalize_width(self, width) -> Optional[int]:
+        """请求宽度向上取到白名单档位；超过最大档位时取最大档位，非法值返回 None"""
+        try:
+            w = int(width)
+        except (TypeError, ValueError):
+            return None
+        if w <= 0:
+            return None
+        for allowed in self.widths:
+            if allowed >= w:
+                return allowed
+        return self.widths[-1] if self.widths else None
+
+    @staticmethod
+    def normalize_format(fmt) -> Optional[str]:
+        """fmt 参数规范化；AVIF 不可用时退回 WebP"""
+        f = (fmt or 'webp').strip().lower()
+        if f not in VARIANT_FORMATS:
+            return None
+        if f == 'jpg':
+            f = 'jpeg'
+        if f == 'avif' and not pil_supports('avif'):
+            f = 'webp'
+        return f
+
+    # ----- 缓存 -----
+    def _load_existing(self) -> None:
+        """启动后首次使用时登记磁盘上已有的变体（按 mtime 排 LRU 顺序）"""
+        if self._loaded:
+            return
+        found = []
+        try:
+            for sub in os.listdir(self.cache_dir):
+                sub_path = os.path.join(self.cache_dir, sub)
+                if not os.path.isdir(sub_path):
+                    continue
+                for name in os.listdir(sub_path):
+                    if name.endswith('.tmp'):
+                        continue
+                    path = os.path.join(sub_path, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, os.path.splitext(name)[0], path, st.st_size))
+        except OSError:
+            pass
+        found.sort()
+        for _, key, path, size in found:
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+        self._loaded = True
+        self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, (path, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.stats_counters['evicted'] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _variant_key(self, source_path: str, st: os.stat_result, width: int, fmt: str) -> str:
+        raw = f"{os.path.abspath(source_path)}|{st.st_mtime_ns}|{st.st_size}|{width}|{fmt}|{self.quality}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _acquire_key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = [threading.Lock(), 0]
+                self._key_locks[key] = entry
+            entry[1] += 1
+        entry[0].acquire()
+        return entry[0]
+
+    def _release_key_lock(self, key: str) -> None:
+        with self._lock:
+            entry = self._key_locks.get(key)
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._key_locks[key]
+
+    def _encode(self, source_path: str, target_path: str, width: int, fmt: str) -> None:
+        encode_variant(source_path, target_path, width, fmt, self.quality)
+
+    def get(self, source_path: str, width, fmt='webp') -> Optional[Tuple[str, str, str]]:
+        """返回 (变体路径, MIME, 变体版本 key)；Pillow 不可用、参数非法或编码失败时返回 None（调用方回退原图）"""
+        if not PIL_AVAILABLE:
+            return None
+        width = self.normalize_width(width)
+        fmt = self.normalize_format(fmt)
+        if not width or not fmt:
+            return None
+        try:
+            st = os.stat(source_path)
+        except OSError:
+            return None
+        key = self._variant_key(source_path, st, width, fmt)
+        target = os.path.join(self.cache_dir, key[:2], key + VARIANT_FORMATS[fmt][2])
+        mimetype = VARIANT_FORMATS[fmt][1]
+        with self._lock:
+            self._load_existing()
+            entry = self._entries.get(key)
+            if entry is not None and os.path.isfile(entry[0]):
+                self._entries.move_to_end(key)
+                self.stats_counters['hits'] += 1
+                return entry[0], mimetype, key
+        self._acquire_key_lock(key)
+        try:
+            # 等锁期间其他线程可能已编码完成
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and os.path.isfile(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.stats_counters['hits'] += 1
+                    return entry[0], mimetype, key
+            t0 = time.time()
+            try:
+                self._encode(source_path, target, width, fmt)
+                size = os.path.getsize(target)
+            except Exception as e:
+                with self._lock:
+                    self.stats_counters['errors'] += 1
+                logger.warning(f"⚠️ 图片变体生成失败 {os.path.basename(source_path)} w={width} fmt={fmt}: {e}")
+                return None
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._total_bytes -= old[1]
+                self._entries[key] = (target, size)
+                self._total_bytes += size
+                self.stats_counters['encoded'] += 1
+                self._evict_locked()
+            logger.info(f"🖼️ 图片变体已生成: {os.path.basename(source_path)} w={width} {fmt} "
+                        f"{st.st_size // 1024}KB -> {size // 1024}KB，用时 {time.time() - t0:.2f}s")
+            return target, mimetype, key
+        finally:
+            self._release_key_lock(key)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return dict(self.stats_counters, entries=len(self._entries), bytes=self._total_bytes,
+                        max_bytes=self.max_bytes, widths=list(self.widths), pil=PIL_AVAILABLE,
+                        avif=pil_supports('avif'))
+
+
+class ImageVariantManifest:
+    """image_optimizer.py 写出的变体清单（只读）：启动时加载一次，?w= 请求先查清单，命中即直接发送预生成文件，
+    不需 Pillow、不占 Web 进程 CPU。清单项记录源文件相对路径与 mtime/大小，源图变化后该项视为过期，回退在线生成。"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = os.path.abspath(path or os.getenv('IMAGE_VARIANT_MANIFEST') or
+                                    os.path.join(DEFAULT_OPTIMIZED_DIR, MANIFEST_NAME))
+        self.base_dir = os.path.dirname(self.path)
+        self.images: Dict[str, dict] = {}
+        self.generated_at = None
+        self.stats_counters = {'hits': 0, 'stale': 0}
+
+    def __len__(self):
+        return len(self.images)
+
+    def load(self) -> bool:
+        """读取清单；文件不存在或格式错误时清单为空（全部回退在线生成）"""
+        if not os.path.isfile(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            images = data.get('images') or {}
+            if not isinstance(images, dict):
+                raise ValueError('images 不是对象')
+        except Exception as e:
+            logger.warning(f"⚠️ 读取图片变体清单失败 {self.path}: {e}")
+            return False
+        self.images = images
+        self.generated_at = data.get('generated_at')
+        return True
+
+    def get(self, source_path: str, width: Optional[int], fmt: Optional[str]) -> Optional[Tuple[str, str, str]]:
+        """返回 (变体路径, MIME, 版本 key)，与 ImageVariantCache.get 一致；清单中无此档位或源图已变化时返回 None"""
+        if not self.images or not width or not fmt:
+            return None
+        entry = self.images.get(os.path.basename(source_path))
+        if not entry:
+            return None
+        variant = (entry.get('variants') or {}).get(str(width))
+        if not variant or variant.get('format') != fmt:
+            return None
+        if os.path.normpath(os.path.join(self.base_dir, entry.get('source') or '')) != os.path.normpath(source_path):
+            return None
+        try:
+            st = os.stat(source_path)
+        except OSError:
+            return None
+        if st.st_size != entry.get('bytes') or st.st_mtime_ns != entry.get('mtime_ns'):
+            self.stats_counters['stale'] += 1
+            return None
+        path = os.path.join(self.base_dir, variant['path'])
+        if not os.path.isfile(path):
+            return None
+        self.stats_counters['hits'] += 1
+        key = hashlib.sha1(f"{entry['source']}|{st.st_mtime_ns}|{st.st_size}|{width}|{fmt}".encode('utf-8')).hexdigest()
+        return path, VARIANT_FORMATS[fmt][1], key
+
+    def stats(self) -> Dict[str, object]:
+        return dict(self.stats_counters, path=self.path, images=len(self.images), generated_at=self.generated_at)
+
+
+def image_srcset(url: str, widths: Iterable[int] = DEFAULT_SRCSET_WIDTHS, fmt: str = 'webp') -> str:
+    """为 /api/images/ URL 生成 srcset 字符串："<url>?w=160&fmt=webp 160w, ..."（保留已有的 ?v=）"""
+    path, _, query = url.partition('?')
+    # srcset 以空格/逗号分隔候选，文件名需 URL 编码
+    url = quote(unquote(path), safe='/') + ('?' + query if query else '')
+    sep = '&' if query else '?'
+    return ', '.join(f"{url}{sep}w={w}&fmt={fmt} {w}w" for w in widths)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预先物化的产品列表分页（MaterializedListing），用于 /api/products 的「以图为准」分支
+（ULTIMO supplier=Cristy：cristy-image-first；PRODUCTOS supplier=others：productos-image-first）
+
+这两个分支的完整列表只取决于目录快照版本与图片索引 revision（分类 / 价格区间筛选由 select() 在其上取子列表），
+原先每次请求都要重建 文件名 -> 产品 映射、遍历全部图片、排序再切片。改为版本变化后建立一次：
+- 整份有序列表的每个条目按 Flask JSON 设置序列化一次（bytes）；
+- 常用页大小（LISTING_PAGE_SIZES，默认 30,500，前端固定 limit=500）建立时即拼好每一页的 JSON 数组字节串，
+  其他页大小在第一次请求时拼好并缓存（最多 MAX_EXTRA_PAGE_SIZES 种）；
+- 请求时 page(page, limit) 只是一次下标查找并返回字节串；
+- 建立时同时记录每条的分面取值（分类 / 价格区间 / 供应商，dedupe=False 的 FacetIndex，每条占一位）：
+  facets() 的计数与列表条数一致，select() 按 category / price_band 取子列表（同样物化，按选择缓存最多 MAX_SELECTIONS 种）。
+
+ListingStore 按视图保存当前物化结果，key（快照版本, 图片 revision）变化或超过 LISTING_PAGES_MAX_AGE_SECONDS
+（覆盖同名图片时目录 revision 不变，列表中的 ?v= 版本号靠这一上限刷新）时重建；重建期间其他请求继续使用旧结果。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from facet_index import FacetIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _page_sizes_from_env() -> Tuple[int, ...]:
+    sizes = []
+    for part in (os.getenv('LISTING_PAGE_SIZES') or '30,500').split(','):
+        try:
+            size = int(part.strip())
+        except ValueError:
+            continue
+        if size > 0 and size not in sizes:
+            sizes.append(size)
+    return tuple(sizes)
+
+
+DEFAULT_PAGE_SIZES = _page_sizes_from_env()
+DEFAULT_MAX_AGE_SECONDS = float(os.getenv('LISTING_PAGES_MAX_AGE_SECONDS') or 300)
+# 非预设页大小最多缓存的种类数，超过时丢弃最早的一种
+MAX_EXTRA_PAGE_SIZES = 8
+# 按分面筛选的子列表最多缓存的种类数，超过时丢弃最久未用的一种
+MAX_SELECTIONS = 32
+
+
+class MaterializedListing:
+    """一份有序列表的序列化结果；page() 返回该页的 JSON 数组（bytes）。
+    facet_rows 与 items_json 一一对应（FacetIndex 所需的 codigo_proveedor / category_id / price），提供时可 facets() / select()"""
+
+    def __init__(self, key: Any, items_json: Sequence[bytes], page_sizes: Iterable[int] = DEFAULT_PAGE_SIZES,
+                 facet_rows: Optional[Sequence[Dict[str, Any]]] = None):
+        self.key = key
+        self.built_at = time.time()
+        self._items = tuple(items_json)
+        self._facets = FacetIndex(enumerate(facet_rows), dedupe=False) if facet_rows is not None else None
+        self._selections: 'OrderedDict[Tuple, MaterializedListing]' = OrderedDict()
+        self._pages: Dict[int, Tuple[bytes, ...]] = {}
+        self._preset = tuple(page_sizes)
+        self._lock = threading.Lock()
+        for size in self._preset:
+            self._pages[size] = self._split(size)
+
+    @property
+    def total(self) -> int:
+        return len(self._items)
+
+    def _split(self, limit: int) -> Tuple[bytes, ...]:
+        items = self._items
+        return tuple(b'[' + b','.join(items[i:i + limit]) + b']' for i in range(0, len(items), limit))
+
+    def page(self, page: int, limit: int) -> bytes:
+        """第 page 页（从 1 开始）的 JSON 数组；超出范围返回 b'[]'"""
+        if page < 1 or limit < 1:
+            return b'[]'
+        pages = self._pages.get(limit)
+        if pages is None:
+            with self._lock:
+                pages = self._pages.get(limit)
+                if pages is None:
+                    extra = [s for s in self._pages if s not in self._preset]
+                    if len(extra) >= MAX_EXTRA_PAGE_SIZES:
+                        self._pages.pop(extra[0], None)
+                    pages = self._pages[limit] = self._split(limit)
+        return pages[page - 1] if page <= len(pages) else b'[]'
+
+    @staticmethod
+    def _selection(selected: Dict[str, Optional[str]]) -> Tuple:
+        return tuple(sorted((f, str(v).strip().lower()) for f, v in selected.items() if v is not None and str(v).strip()))
+
+    def facets(self, selected: Optional[Dict[str, Optional[str]]] = None) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """本列表的分面计数（某分面应用其他分面的已选条件）；未提供 facet_rows 时返回 None"""
+        if self._facets is None:
+            return None
+        return self._facets.counts(None, selected)
+
+    def select(self, selected: Dict[str, Optional[str]]) -> 'MaterializedListing':
+        """按分面取值（如 {'category': ..., 'price_band': ...}，不区分大小写）筛选的子列表，保持原顺序；无筛选条件时返回自身"""
+        selection = self._selection(selected)
+        if not selection or self._facets is None:
+            return self
+        with self._lock:
+            sub = self._selections.get(selection)
+            if sub is not None:
+                self._selections.move_to_end(selection)
+                return sub
+        mask = self._facets.all
+        for facet, value in selection:
+            mask &= self._facets.value_mask(facet, value)
+        bits = bin(mask)[:1:-1]  # 第 i 个字符为第 i 位
+        items = [item for i, item in enumerate(self._items) if i < len(bits) and bits[i] == '1']
+        sub = MaterializedListing((self.key, selection), items, self._preset)
+        with self._lock:
+            self._selections[selection] = sub
+            while len(self._selections) > MAX_SELECTIONS:
+                self._selections.popitem(last=False)
+        return sub
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'items': self.total,
+            'bytes': sum(len(b) for b in self._items),
+            'page_sizes': sorted(self._pages),
+            'selections': len(self._selections),
+            'age_seconds': round(time.time() - self.built_at, 1),
+        }
+
+
+class ListingStore:
+    """按视图（cristy / others）保存当前物化列表；get() 在 key 变化或过期时调用 build 重建（同一视图只有一个线程重建）"""
+
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE_SECONDS):
+        self.max_age = max(1.0, float(max_age))
+        # 视图 -> (key, 建立时间, MaterializedListing 或 None)；None 表示该视图在此 key 下不适用（无产品或无图片）
+        self._entries: Dict[str, Tuple[Any, float, Optional[MaterializedListing]]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.builds = 0
+
+    def _view_lock(self, view: str) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(view)
+            if lock is None:
+                lock = self._locks[view] = threading.Lock()
+            return lock
+
+    def get(self, view: str, key: Any, build: Callable[[], Optional[MaterializedListing]]) -> Optional[MaterializedListing]:
+        entry = self._entries.get(view)
+        if entry is not None and entry[0] == key:
+            if time.time() - entry[1] < self.max_age:
+                return entry[2]
+            lock = self._view_lock(view)
+            # 仅过期（key 未变）：已有线程在重建时直接返回旧结果
+            if not lock.acquire(blocking=False):
+                return entry[2]
+        else:
+            lock = self._view_lock(view)
+            lock.acquire()
+        try:
+            entry = self._entries.get(view)
+            if entry is not None and entry[0] == key and time.time() - entry[1] < self.max_age:
+                return entry[2]
+            t0 = time.time()
+            listing = build()
+            self._entries[view] = (key, time.time(), listing)
+            self.builds += 1
+            logger.info(f"📄 [listing] {view} 列表已物化 key={key}: "
+                        f"{listing.stats() if listing is not None else '不适用'}，用时 {time.time() - t0:.2f}s")
+            return listing
+        finally:
+            lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {'builds': self.builds, 'max_age_seconds': self.max_age}
+        for view, (key, _, listing) in list(self._entries.items()):
+            out[view] = {'key': list(key) if isinstance(key, tuple) else key,
+                         **(listing.stats() if listing is not None else {'items': 0})}
+        return out
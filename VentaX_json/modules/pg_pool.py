@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL 连接池（供 pwa_cart_api_server._pg_connect 使用）
+
+- 线程安全，min/max 大小可配置；max 默认按 gunicorn --threads（环境变量 GUNICORN_THREADS）加上会查库的后台线程
+  （产品目录刷新线程 + response_cache 的 stale-while-revalidate 重建线程）；
+- 借出时做健康检查（已断开 / 空闲过久时 SELECT 1），失败则丢弃重建；
+- 连接使用 N 次或存活 T 秒后回收重建，空闲超时且超过 min 的连接关闭（Neon 空闲会挂起计算节点）；
+- 借出的是代理对象，调用方照旧 conn.close() 即归还连接池，未提交事务自动回滚；未 close() 的代理被回收时同样归还；
+- stats() 输出计数供 /api/health 监控。
+
+psycopg2.pool.ThreadedConnectionPool 满时直接抛 PoolError，且无健康检查/回收/统计，因此这里自行实现。
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from response_cache import REVALIDATE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# CHANGE: 与 render.yaml 中 gunicorn --threads 保持一致
+DEFAULT_GUNICORN_THREADS = 4
+# 请求线程之外借连接的后台线程：产品目录定时刷新 1 个 + 后台重建 REVALIDATE_WORKERS 个（cursor 分页、数据库搜索视图直接查库）
+BACKGROUND_CONNECTIONS = 1 + REVALIDATE_WORKERS
+
+
+def _env_number(name: str, default, cast=int):
+    """读取数值型环境变量，非法值回退默认值"""
+    raw = (os.getenv(name) or '').strip()
+    if not raw:
+        return default
+    try:
+        return cast(raw)
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ 环境变量 {name}={raw!r} 非法，使用默认值 {default}")
+        return default
+
+
+def default_pool_max_size() -> int:
+    """连接池上限：PG_POOL_MAX，未设置时为 GUNICORN_THREADS（请求线程数）+ BACKGROUND_CONNECTIONS（后台线程），
+    后台重建与请求线程不争抢连接，请求线程不会因池满等待 PG_POOL_TIMEOUT"""
+    threads = max(1, _env_number('GUNICORN_THREADS', DEFAULT_GUNICORN_THREADS))
+    return max(1, _env_number('PG_POOL_MAX', threads + BACKGROUND_CONNECTIONS))
+
+
+class PoolTimeout(Exception):
+    """连接池已满且等待超时"""
+
+
+class _PoolEntry:
+    """连接池内部记录：原始连接及其使用次数/时间"""
+
+    __slots__ = ('raw', 'created_at', 'last_used_at', 'uses')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.uses = 0
+
+
+class PooledConnection:
+    """借出的 psycopg2 连接代理：属性/方法透传原始连接，close() 改为归还连接池。"""
+
+    def __init__(self, pool: 'PgConnectionPool', entry: _PoolEntry):
+        self._pool = pool
+        self._entry = entry
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._entry.raw, name)
+
+    def __enter__(self):
+        self._entry.raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._entry.raw.__exit__(exc_type, exc, tb)
+
+    def __del__(self):
+        # NOTE: 借出后未调用 close()（如 _pg_connect() 与 try 之间抛异常）时，代理被回收即归还，
+        # 未结束的事务回滚、已断开的连接丢弃，避免永久占用连接池名额
+        if self.__dict__.get('_returned', True):
+            return
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @property
+    def raw(self):
+        return self._entry.raw
+
+    def close(self):
+        """归还连接池（重复调用无副作用）"""
+        if self._returned:
+            return
+        self._returned = True
+        self._pool._release(self._entry)
+
+
+class PgConnectionPool:
+    """线程安全的 PostgreSQL 连接池"""
+
+    def __init__(self, connect_fn: Callable[[], Any], min_size: Optional[int] = None, max_size: Optional[int] = None,
+                 max_uses: Optional[int] = None, max_age: Optional[float] = None, idle_timeout: Optional[float] = None,
+                 health_check_idle: Optional[float] = None, checkout_timeout: Optional[float] = None, name: str = 'pg'):
+        self._connect_fn = connect_fn
+        self.max_size = max(1, max_size if max_size is not None else default_pool_max_size())
+        self.min_size = max(0, min(self.max_size, min_size if min_size is not None else _env_number('PG_POOL_MIN', 1)))
+        self.max_uses = max_uses if max_uses is not None else _env_number('PG_POOL_MAX_USES', 500)
+        self.max_age = max_age if max_age is not None else _env_number('PG_POOL_MAX_AGE', 1800.0, float)
+        self.idle_timeout = idle_timeout if idle_timeout is not None else _env_number('PG_POOL_IDLE_TIMEOUT', 240.0, float)
+        self.health_check_idle = health_check_idle if health_check_idle is not None else _env_number('PG_POOL_HEALTH_CHECK_IDLE', 5.0, float)
+        self.checkout_timeout = checkout_timeout if checkout_timeout is not None else _env_number('PG_POOL_TIMEOUT', 15.0, float)
+        self.name = name
+        self._idle: List[_PoolEntry] = []
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {
+            'created': 0, 'checkouts': 0, 'reused': 0, 'returned': 0, 'waits': 0, 'timeouts': 0,
+            'health_check_failures': 0, 'recycled': 0, 'idle_closed': 0, 'broken_discarded': 0, 'connect_errors': 0,
+        }
+
+    # ----- 借出 / 归还 -----
+    def getconn(self) -> PooledConnection:
+        """借出一条连接；池满时最多等待 checkout_timeout 秒"""
+        deadline = time.time() + self.checkout_timeout
+        entry = None
+        with self._cond:
+            self._close_idle_expired_locked()
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"PostgreSQL 连接池已满（max={self.max_size}），等待 {self.checkout_timeout:.0f}s 超时")
+                self._stats['waits'] += 1
+                self._cond.wait(remaining)
+            if self._idle:
+                entry = self._idle.pop()  # LIFO：优先用最近用过的连接，最不易被服务端断开
+            self._in_use += 1
+        if entry is not None and not self._check_entry(entry):
+            entry = None
+        if entry is None:
+            try:
+                entry = _PoolEntry(self._connect_fn())
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._stats['connect_errors'] += 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+        else:
+            with self._cond:
+                self._stats['reused'] += 1
+        entry.uses += 1
+        entry.last_used_at = time.time()
+        with self._cond:
+            self._stats['checkouts'] += 1
+        return PooledConnection(self, entry)
+
+    def _check_entry(self, entry: _PoolEntry) -> bool:
+        """借出前健康检查：已断开、超龄、超次数直接回收；空闲超过 health_check_idle 秒时执行 SELECT 1"""
+        now = time.time()
+        reason = None
+        if getattr(entry.raw, 'closed', 0):
+            reason = 'broken'
+        elif self.max_uses and entry.uses >= self.max_uses:
+            reason = 'recycled'
+        elif self.max_age and now - entry.created_at >= self.max_age:
+            reason = 'recycled'
+        elif now - entry.last_used_at >= self.health_check_idle:
+            try:
+                cur = entry.raw.cursor()
+                cur.execute('SELECT 1')
+                cur.fetchone()
+                cur.close()
+                entry.raw.rollback()
+            except Exception as e:
+                logger.info(f"🔌 [{self.name}] 连接健康检查失败，重建: {e}")
+                reason = 'health'
+        if reason is None:
+            return True
+        self._discard(entry.raw)
+        with self._cond:
+            if reason == 'broken':
+                self._stats['broken_discarded'] += 1
+            elif reason == 'health':
+                self._stats['health_check_failures'] += 1
+            else:
+                self._stats['recycled'] += 1
+        return False
+
+    def _release(self, entry: _PoolEntry) -> None:
+        """归还连接：未结束的事务回滚；已断开或需回收的连接直接关闭"""
+        raw = entry.raw
+        keep = not getattr(raw, 'closed', 0)
+        if keep:
+            try:
+                # CHANGE: 与原先 close() 语义一致，未 commit 的修改丢弃
+                if raw.get_transaction_status() != 0:  # psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                    raw.rollback()
+            except Exception:
+                keep = False
+        if keep and ((self.max_uses and entry.uses >= self.max_uses) or
+                     (self.max_age and time.time() - entry.created_at >= self.max_age)):
+            keep = False
+            with self._cond:
+                self._stats['recycled'] += 1
+        if not keep:
+            self._discard(raw)
+        entry.last_used_at = time.time()
+        with self._cond:
+            self._in_use -= 1
+            self._stats['returned'] += 1
+            if keep:
+                self._idle.append(entry)
+            self._cond.notify()
+
+    def _close_idle_expired_locked(self) -> None:
+        """关闭空闲超时的连接，至少保留 min_size 条（需持有锁）"""
+        if not self.idle_timeout or len(self._idle) <= self.min_size:
+            return
+        now = time.time()
+        keep, expired = [], []
+        remaining = len(self._idle)
+        # _idle 末尾为最近归还，从头部（最久未用）开始淘汰
+        for entry in self._idle:
+            if remaining > self.min_size and now - entry.last_used_at >= self.idle_timeout:
+                expired.append(entry)
+                remaining -= 1
+            else:
+                keep.append(entry)
+        if expired:
+            self._idle = keep
+            self._stats['idle_closed'] += len(expired)
+            for entry in expired:
+                self._discard(entry.raw)
+
+    @staticmethod
+    def _discard(raw) -> None:
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    # ----- 管理 -----
+    def closeall(self) -> None:
+        """关闭所有空闲连接（借出中的连接归还时照常处理）"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._discard(entry.raw)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            out = dict(self._stats)
+            out.update({
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max_uses': self.max_uses,
+                'max_age': self.max_age,
+            })
+        return out
+
+
+_POOLS: Dict[Any, PgConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(key: Any, connect_fn: Callable[[], Any], **kwargs) -> PgConnectionPool:
+    """按连接配置 key 取得（或创建）进程内唯一的连接池"""
+    pool = _POOLS.get(key)
+    if pool is not None:
+        return pool
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = PgConnectionPool(connect_fn, **kwargs)
+            _POOLS[key] = pool
+            logger.info(f"🔌 [{pool.name}] PostgreSQL 连接池已创建: min={pool.min_size}, max={pool.max_size}, "
+                        f"max_uses={pool.max_uses}, max_age={pool.max_age:.0f}s")
+    return pool
+
+
+def all_pool_stats() -> List[Dict[str, Any]]:
+    """所有连接池的统计（不含连接串）"""
+    return [dict(pool.stats(), name=pool.name) for pool in list(_POOLS.values())]
+
+
+def close_all_pools() -> None:
+    for pool in list(_POOLS.values()):
+        pool.closeall()
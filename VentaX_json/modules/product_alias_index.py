@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产品 ID 别名索引（ProductAliasIndex）
+
+产品 ID 到达 API 时形式很多：W7841 / W-7841 / w7841、10060_Al / 10060_A / 10060._AI、TG_JUGUETESFANG_90174 等。
+原来各处（_product_id_candidates、CartManager._find_product、DatabaseManager.get_user_cart /
+_save_to_unified_orders、checkout 补全）在查找时临时套用规则，且常对整个产品字典做线性扫描。
+
+这里按产品目录一次性建立「别名 -> 规范 key」映射：
+- 精确 key（str(key)）；
+- 折叠形式：小写、去掉连字符与空白（W-7841 == W7841 == w7841）；
+- ._AI 形式：_AI / _Al / _A / ._AI 后缀统一为 <base>._ai（10060_Al == 10060_A == 10060._AI）。
+查找时对传入 id 依次计算同样的形式（可选再按数字段回退），每一步都是一次 dict 查询；结果另有缓存，重复 id 只需一次查询。
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+# CHANGE: 查找结果缓存上限，超出后整体清空（目录版本变化时索引本身会重建）
+_MEMO_MAX = 4096
+# memo 中未命中的值（缓存的 None 与「不在缓存中」区分）
+_MISS = object()
+
+_AI_SUFFIX_RE = re.compile(r'^(.+?)[._\-]*_(?:ai|al|a)$')
+_DIGITS_RE = re.compile(r'\d+')
+
+
+def fold_product_id(value) -> str:
+    """折叠形式：去空白、小写、去掉连字符（兼容 W7841 / W-7841 / w7841）"""
+    return re.sub(r'[\s\-]+', '', str(value or '')).lower()
+
+
+def ai_product_id(value) -> str:
+    """._AI 形式：10060_Al / 10060_A / 10060._AI -> 10060._ai；无此后缀时返回空串"""
+    m = _AI_SUFFIX_RE.match(fold_product_id(value))
+    if not m:
+        return ''
+    base = m.group(1).rstrip('._')
+    return base + '._ai' if base else ''
+
+
+def digit_groups(value) -> List[str]:
+    """id 中的数字段，靠后的优先（TG_JUGUETESFANG_90174 -> ['90174']）"""
+    return list(reversed(_DIGITS_RE.findall(str(value or ''))))
+
+
+class ProductAliasIndex:
+    """不可变别名索引：resolve() 返回规范 key（即产品字典中的原始 key），找不到返回 None。
+
+    构建一次的成本为 O(产品数)；同一 key 的多种别名冲突时精确 key 优先，其次按产品字典顺序先到先得。
+    """
+
+    def __init__(self, keys: Iterable[Any]):
+        keys = [k for k in keys if k is not None and str(k).strip()]
+        aliases: Dict[str, Any] = {}
+        # 按优先级分层写入：精确 key > 折叠形式 > ._AI 形式
+        for k in keys:
+            aliases.setdefault(str(k).strip(), k)
+        for k in keys:
+            aliases.setdefault('~' + fold_product_id(k), k)
+        for k in keys:
+            ai = ai_product_id(k)
+            if ai:
+                aliases.setdefault('~ai:' + ai, k)
+        self._aliases = aliases
+        self._key_count = len(keys)
+        self._memo: Dict[Any, Any] = {}
+
+    def __len__(self):
+        return self._key_count
+
+    def _probe(self, product_id: str):
+        """精确 -> 折叠 -> ._AI，各一次 dict 查询"""
+        aliases = self._aliases
+        key = aliases.get(product_id)
+        if key is None:
+            key = aliases.get('~' + fold_product_id(product_id))
+        if key is None:
+            ai = ai_product_id(product_id)
+            if ai:
+                key = aliases.get('~ai:' + ai)
+        return key
+
+    def resolve(self, product_id, digits: bool = False) -> Optional[Any]:
+        """把任意形式的 product_id 解析为规范 key。
+        digits=True 时，别名均未命中再按数字段查（靠后的优先，TG_JUGUETESFANG_90174 -> 90174）。"""
+        if product_id is None:
+            return None
+        pid = str(product_id).strip()
+        if not pid:
+            return None
+        memo_key = (pid, digits)
+        memo = self._memo
+        # NOTE: 单次 get：memo 由所有请求线程共享，先 in 再取值会与其他线程的 memo.clear() 竞争（KeyError）
+        hit = memo.get(memo_key, _MISS)
+        if hit is not _MISS:
+            return hit
+        key = self._probe(pid)
+        if key is None and digits:
+            for n in digit_groups(pid):
+                if n != pid:
+                    key = self._aliases.get(n)
+                    if key is not None:
+                        break
+        if len(memo) >= _MEMO_MAX:
+            memo.clear()
+        memo[memo_key] = key
+        return key
+
+    def lookup(self, products: Dict, product_id, digits: bool = False) -> Optional[Any]:
+        """在 products（构建本索引所用的字典）中按别名查找产品，找不到返回 None"""
+        key = self.resolve(product_id, digits=digits)
+        return products.get(key) if key is not None else None
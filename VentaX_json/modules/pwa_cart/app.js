@@ -87,13 +87,15 @@ function _resolveImageSrc(imagePath, productOrSupplier) {
     }
     if (raw.startsWith('/api/images/')) {
         var filename = raw.replace('/api/images/', '').split('?')[0].trim();
+        // CHANGE: 保留 API 返回的 ?v=<版本>（图片文件变化时版本变化），配合 immutable 长期缓存
+        var versionQuery = raw.indexOf('?') !== -1 ? raw.slice(raw.indexOf('?')) : '';
         if (!filename) return _getImageBase() + (raw.startsWith('/') ? raw : '/' + raw);
         try { filename = decodeURIComponent(filename); } catch (e) {}
         var origin = (typeof window !== 'undefined' && window.location && window.location.origin) ? window.location.origin : '';
         var isLocal = origin.indexOf('127.0.0.1') !== -1 || origin.indexOf('localhost') !== -1;
         if (isLocal && CONFIG && CONFIG.API_BASE_URL) {
             var apiBase = (CONFIG.API_BASE_URL || '').replace(/\/api\/?$/, '');
-            if (apiBase) return apiBase + '/api/images/' + encodeURIComponent(filename);
+            if (apiBase) return apiBase + '/api/images/' + encodeURIComponent(filename) + versionQuery;
         }
         // 云端用 Pages 地址；部署结构固定为 /pwa_cart/Ya Subio/，Pages 域名强制 basePath=/pwa_cart（修复 Android pathname 异常）
         var host = (window.location.hostname || '').toLowerCase();
@@ -106,11 +108,22 @@ function _resolveImageSrc(imagePath, productOrSupplier) {
         var base = window.location.origin + basePath;
         var isCristy = (productOrSupplier && (productOrSupplier === 'Cristy' || (typeof productOrSupplier === 'object' && String((productOrSupplier.codigo_proveedor || '')).trim() === 'Cristy')));
         var subDir = isCristy ? 'Cristy/' : '';
-        return base + (base.slice(-1) === '/' ? '' : '/') + 'Ya%20Subio/' + subDir + encodeURIComponent(filename);
+        return base + (base.slice(-1) === '/' ? '' : '/') + 'Ya%20Subio/' + subDir + encodeURIComponent(filename) + versionQuery;
     }
     return _getImageBase() + (raw.startsWith('/') ? raw : '/' + raw);
 }
 
+// CHANGE: 后端 image_srcset 为相对 /api/images/ 地址，按已解析的 src 所在 API origin 补全
+function _resolveImageSrcset(srcset, imageSrc) {
+    if (!srcset || typeof srcset !== 'string') return '';
+    var idx = (imageSrc || '').indexOf('/api/images/');
+    var base = idx > 0 ? imageSrc.slice(0, idx) : _getImageBase();
+    return srcset.split(',').map(function(part) {
+        var s = part.trim();
+        return s.startsWith('/api/images/') ? base + s : s;
+    }).join(', ');
+}
+
 // CHANGE: PWA 安装提示（Chrome/Edge 会触发 beforeinstallprompt，保存后供「添加到主屏幕」按钮使用）
 let deferredInstallPrompt = null;
 
@@ -178,6 +191,7 @@ async function apiRequest(endpoint, options = {}) {
         if (options.signal) opts.signal = options.signal;
         if (options.mode) opts.mode = options.mode;
         if (options.credentials) opts.credentials = options.credentials;
+        if (options.cache) opts.cache = options.cache;
         var response = await fetch(url, opts);
         console.log('📥 [API] 响应状态: ' + response.status + ' ' + (response.statusText || ''));
         var responseText = await response.text();
@@ -261,11 +275,12 @@ async function fetchProducts(supplier = null, retryCount = 0) {
         if (effectiveSupplier) {
             url += `&supplier=${encodeURIComponent(effectiveSupplier)}`;
         }
-        url += '&_=' + (Date.now ? Date.now() : 0);  // 避免缓存导致产品代码/价格全部相同
         const timeoutPromise = new Promise((_, reject) => {
             setTimeout(() => reject(new Error('Tiempo de espera agotado. Compruebe la conexión o intente más tarde.')), LOAD_TIMEOUT_MS);
         });
-        const result = await Promise.race([apiRequest(url), timeoutPromise]);
+        // CHANGE: 不再附加 _= 时间戳防缓存；cache: 'no-cache' 让浏览器每次带 If-None-Match 协商，
+        // ETag 含目录版本（X-Catalog-Version），目录未变时后端只回 304，浏览器复用已缓存的 JSON
+        const result = await Promise.race([apiRequest(url, { cache: 'no-cache' }), timeoutPromise]);
         console.log('📦 [fetchProducts] API响应:', result);
 
         // CHANGE: 兼容仅返回 result.data 数组的后端（无 result.success）
@@ -1707,10 +1722,13 @@ function renderProducts() {
         const imageSrc = hasImage ? _resolveImageSrc(rawPath, p) : (placeholderSvg || '');
         const safeImagePath = (rawPath || '').replace(/'/g, "\\'").replace(/"/g, '&quot;');
         const safeImageSrc = (imageSrc || '').replace(/"/g, '&quot;').replace(/'/g, "\\'");
+        // CHANGE: 图片走 API（/api/images/）时用后端返回的 image_srcset 加载 WebP 缩略图，Pages 静态图无变体
+        const imageSrcset = (hasImage && p.image_srcset && imageSrc.indexOf('/api/images/') !== -1) ? _resolveImageSrcset(p.image_srcset, imageSrc) : '';
+        const srcsetAttr = imageSrcset ? ` srcset="${imageSrcset.replace(/"/g, '&quot;')}" sizes="(max-width: 600px) 50vw, 240px"` : '';
         return `
         <div class="product-card${highlightClass}" data-product-id="${safeProductId}" data-product-code="${safeProductCode}" data-image-path="${safeImagePath || ''}">
             <div class="product-image-wrapper">
-                <img src="${safeImageSrc}" 
+                <img src="${safeImageSrc}"${srcsetAttr}
                      alt="${(p.name || '').replace(/"/g, '&quot;')}" 
                      class="product-image"
                      data-image-src="${safeImageSrc}"
@@ -1806,7 +1824,7 @@ function applyProductHashAnchor() {
 async function fetchSingleProductForHash(segment) {
     if (!segment) return;
     try {
-        var result = await apiRequest('/products/' + encodeURIComponent(segment));
+        var result = await apiRequest('/products/' + encodeURIComponent(segment), { cache: 'no-cache' });
         if (result && result.success && result.data) {
             var p = result.data;
             var prov = (p.codigo_proveedor || '').trim().toLowerCase();
@@ -1884,7 +1902,7 @@ async function ensureCartProductsInState() {
     }
     for (const productId of idsToLoad) {
         try {
-            const result = await apiRequest('/products/' + encodeURIComponent(productId));
+            const result = await apiRequest('/products/' + encodeURIComponent(productId), { cache: 'no-cache' });
             if (result && result.success && result.data) {
                 const existing = AppState.products.find(px => String(px.id) === String(result.data.id));
                 if (!existing) {
@@ -2147,8 +2165,8 @@ async function searchProducts(query) {
         return;
     }
     grid.innerHTML = '<div class="loading">Buscando...</div>';
-    // CHANGE: 搜索时不传 supplier，让 API 在 ULTIMO+PRODUCTOS 两页并集中搜索
-    var url = '/products?limit=500&search=' + encodeURIComponent(q);
+    // CHANGE: 搜索时不传 supplier，让 API 在 ULTIMO+PRODUCTOS 两页并集中搜索；按相关度排序（代码精确命中在最前）
+    var url = '/products?limit=500&sort=relevance&search=' + encodeURIComponent(q);
     try {
         var result = await apiRequest(url);
         // CHANGE: 仅当当前输入仍为该关键词时更新列表，避免旧响应覆盖
@@ -2528,10 +2546,39 @@ document.addEventListener('DOMContentLoaded', async () => {
     // 搜索功能：防抖 + 支持 Enter 触发，确保有反应
     var searchDebounceTimer = null;
     var searchInput = document.getElementById('searchInput');
+    // CHANGE: 边输入边提示：/api/products/suggest 前缀匹配（很轻），结果填进 <datalist id="searchSuggestions">
+    var suggestTimer = null;
+    var suggestController = null;
+    function updateSearchSuggestions(val) {
+        var list = document.getElementById('searchSuggestions');
+        if (!list) return;
+        if (suggestTimer) clearTimeout(suggestTimer);
+        if (suggestController) { suggestController.abort(); suggestController = null; }
+        if (!val) { list.innerHTML = ''; return; }
+        suggestTimer = setTimeout(function() {
+            suggestTimer = null;
+            suggestController = typeof AbortController !== 'undefined' ? new AbortController() : null;
+            fetch(CONFIG.API_BASE_URL + '/products/suggest?q=' + encodeURIComponent(val) + '&limit=8',
+                  suggestController ? { signal: suggestController.signal } : {})
+                .then(function(r) { return r.ok ? r.json() : null; })
+                .then(function(res) {
+                    if (!res || !res.data) return;
+                    list.innerHTML = '';
+                    res.data.forEach(function(item) {
+                        var opt = document.createElement('option');
+                        opt.value = item.name || item.product_code || '';
+                        if (item.product_code && item.product_code !== opt.value) opt.label = item.product_code;
+                        list.appendChild(opt);
+                    });
+                })
+                .catch(function() { /* 提示失败不影响搜索 */ });
+        }, 120);
+    }
     if (searchInput) {
         searchInput.addEventListener('input', function(e) {
             var val = (e.target.value || '').trim();
             if (searchDebounceTimer) clearTimeout(searchDebounceTimer);
+            updateSearchSuggestions(val);
             if (!val) {
                 renderProducts();
                 return;
@@ -2984,6 +3031,12 @@ function logout() {
 var PRODUCT_PLACEHOLDER_SVG = 'data:image/svg+xml,' + encodeURIComponent('<svg xmlns="http://www.w3.org/2000/svg" width="200" height="200" viewBox="0 0 200 200"><rect fill="#f0f0f0" width="200" height="200"/><text x="50%" y="50%" dominant-baseline="middle" text-anchor="middle" fill="#999" font-size="14" font-family="sans-serif">Sin imagen</text></svg>');
 function handleImageError(imgElement) {
     imgElement.onerror = null;
+    // CHANGE: 缩略变体(srcset)加载失败时去掉 srcset，回退到 src 原图
+    if (imgElement.getAttribute('srcset')) {
+        imgElement.removeAttribute('srcset');
+        imgElement.onerror = function() { handleImageError(imgElement); };
+        return;
+    }
     if (imgElement.src && imgElement.src.includes('data:image/svg+xml')) {
         return;
     }
@@ -12,24 +12,34 @@ PWA购物车API服务器
 - 详见：MD/product_background_processor_pwa_unified_system_逻辑关系.md
 """
 
-import difflib
+import base64
+import functools
 import os
 import re
 import subprocess
 import sys
 import json
 import logging
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
 import sqlite3
 import hashlib  # CHANGE: hashlib是标准库，应该始终可用，移到外面
+import heapq
+import threading
 import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Any
 
-# CHANGE: API 响应缓存，减少重复请求对 DB 的压力
-_API_CACHE = {}
+# CHANGE: API 响应缓存，减少重复请求对 DB 的压力（缓存实例 _API_CACHE 见下方 response_cache 导入处）
 _API_CACHE_TTL_PRODUCTS = 60   # 产品列表缓存 60 秒
 _API_CACHE_TTL_BANK = 300     # 银行信息缓存 5 分钟
+# CHANGE: 产品列表/详情 stale-while-revalidate 宽限秒数：过期后此时间内先返回旧响应、后台重建（0 关闭）
+_API_CACHE_SWR_SECONDS = int(os.getenv('API_CACHE_SWR_SECONDS') or 300)
+# CHANGE: ?cursor= 分页每批读取的行数（跳过图片不在目录的产品后不足一页时继续取下一批）
+KEYSET_SCAN_BATCH = 100
+
+# CHANGE: 产品图片 HTTP 缓存：带 ?v=<版本> 的 URL 内容随版本变化，可长期缓存（immutable）；不带 v 的短期缓存后用 ETag 协商
+IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE') or 3600)
+IMAGE_IMMUTABLE_MAX_AGE = int(os.getenv('IMAGE_IMMUTABLE_MAX_AGE') or 31536000)
 
 # CHANGE: 暂时註销 SQLite 产品数据，产品列表/详情仅用 PostgreSQL（购物车/订单/登录仍用 CartManager 内 db）
 USE_SQLITE_FOR_PRODUCTS = False
@@ -91,6 +101,41 @@ except ImportError as e:
     DatabaseManager = None
     CartManager = None
 
+# CHANGE: 产品目录快照（列表/详情读内存快照，后台定时刷新）
+from catalog_snapshot import CatalogSnapshotManager, merge_product_rows
+# CHANGE: 多 worker 共享目录快照（CATALOG_SHARED_STORE 指向本机 SQLite 文件时启用）
+from shared_catalog_store import SharedCatalogStore
+# CHANGE: PostgreSQL 连接池，_pg_connect 从池中借出连接，conn.close() 即归还
+from pg_pool import get_pool, all_pool_stats, close_all_pools
+# CHANGE: 图片文件名索引（一次扫描 + 按目录 mtime 增量更新），列表/详情/调试不再每次递归 listdir
+from image_index import ImageIndex
+# CHANGE: 图片文件名 -> 产品匹配索引（get_products 通用分支，随图片索引 revision 重建）；文件名规范化函数也移至该模块
+# 数据库 ruta_imagen 可能带方括号，实际文件在 pwa_cart/Ya Subio 无括号；统一去掉方括号便于匹配
+from image_match_index import (ImageMatchIndex, normalize_base_ai_al as _normalize_base_ai_al,
+                               normalize_image_filename as _normalize_image_filename)
+# CHANGE: /api/images/?w=&fmt= 缩略变体（Pillow 可选）及磁盘 LRU 缓存
+from image_variants import ImageVariantCache, ImageVariantManifest, PIL_AVAILABLE, image_srcset
+# CHANGE: 产品 ID 别名索引（W-7841 / 10060_Al / TG_..._90174 等一次 dict 查询解析）
+from product_alias_index import ProductAliasIndex
+# CHANGE: 产品搜索倒排索引（按目录快照版本构建，去重音 + AND + 代码精确短路 + 候选内模糊匹配）；前缀提示索引
+from search_index import ProductSearchIndex, ProductSuggestIndex
+# CHANGE: 分面统计（供应商 / 分类 / 价格区间）按快照预建位图，每次请求只做按位与计数
+from facet_index import FacetIndex, price_band as _price_band
+# CHANGE: 搜索可下推到数据库（PWA_SEARCH_BACKEND=db：PG pg_trgm / SQLite FTS5），只取命中的一页
+from search_backends import configured_search_backend, install_pg_search_indexes, pg_search_condition, trgm_threshold
+
+# CHANGE: API 响应缓存改为 LRU + TTL（条目数/字节数上限）+ 按 key 单飞，替代无上限、无锁的模块级 dict
+from response_cache import ResponseCache
+# CHANGE: 「以图为准」列表（ULTIMO / PRODUCTOS）按快照版本与图片 revision 预先序列化分页，请求只取字节串
+from listing_pages import ListingStore, MaterializedListing
+# CHANGE: 响应压缩（br/gzip 协商）：JSON 超过阈值即时压缩、带 ETag 的按版本缓存压缩结果，pwa_cart 静态文件预压缩
+from compression import ResponseCompressor
+# CHANGE: JSON 编码可替换为 orjson（已安装时），响应工厂可直接发送缓存中已编码的 bytes
+from fast_json import FastJSONProvider, json_response
+_API_CACHE = ResponseCache(size_of=lambda frozen: len(frozen[1]))
+# 不影响响应内容的查询参数（前端防浏览器缓存的时间戳 _=），不参与缓存 key
+_API_CACHE_IGNORED_ARGS = frozenset({'_'})
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -111,29 +156,6 @@ else:
     logger.warning("⚠️ JWT库不可用，JWT_AVAILABLE=False")
     print("⚠️ JWT库不可用，JWT_AVAILABLE=False")  # 控制台输出
 
-# CHANGE: 数据库 ruta_imagen 可能带方括号，实际文件在 pwa_cart/Ya Subio 无括号；统一去掉方括号便于匹配
-def _normalize_image_filename(name):
-    """去掉文件名两侧方括号，使 DB 路径与 pwa_cart/Ya Subio 实际文件名一致；支持全角【】"""
-    if not name or not isinstance(name, str):
-        return name
-    s = name.strip()
-    if len(s) >= 2 and s[0] == '[' and s[-1] == ']':
-        return s[1:-1].strip()
-    # CHANGE: 支持全角括号 【30568】-> 30568，便于 DB 路径与磁盘文件名匹配
-    s = re.sub(r'[【\[](\d+)[】\]]', r'\1', s)
-    return s
-
-
-def _normalize_base_ai_al(base):
-    """CHANGE: 文件名 ._AI 与 ._Al 等价（磁盘可能存为 ._Al.jpg），便于匹配"""
-    if not base or not isinstance(base, str):
-        return (base or '').strip().lower()
-    s = base.strip().lower()
-    if s.endswith('._al') and not s.endswith('._ai'):
-        return s[:-4] + '._ai'
-    return s
-
-
 def _product_id_candidates(pid):
     """CHANGE: 根据 URL 传入的 product_id（如 10060_Al、10060_A）生成候选 key，用于查 DB/PG。
     前端/Telegram 可能用 10060_Al、10060_A，DB 存 10060 或 10060._AI，需多候选匹配。"""
@@ -178,6 +200,36 @@ def _load_display_code_mapping():
         return {}
 
 
+def _encode_products_cursor(created_at, pid) -> str:
+    """CHANGE: keyset 分页游标：把上一页最后一行的 (created_at, id_producto) 编码为 URL 安全 token"""
+    raw = json.dumps([created_at or None, pid], default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_products_cursor(token) -> Optional[Tuple[Any, Any]]:
+    """解析 ?cursor= token 为 (created_at, id_producto)；空或非法返回 None"""
+    if not token or not isinstance(token, str):
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8'))
+        if isinstance(data, list) and len(data) == 2 and data[1] is not None:
+            return (data[0] or None, data[1])
+    except Exception:
+        pass
+    return None
+
+
+def _image_version(size: int, mtime_ns: int) -> str:
+    """按文件大小与 mtime 生成图片版本号（ETag 与列表 ?v= 共用）"""
+    return hashlib.sha1(f"{size}-{mtime_ns}".encode('ascii')).hexdigest()[:16]
+
+
+def _image_file_version(path: str) -> Tuple[str, os.stat_result]:
+    """当前文件的图片版本号，同时返回 stat 结果"""
+    st = os.stat(path)
+    return _image_version(st.st_size, st.st_mtime_ns), st
+
+
 def _clear_port_occupation(port: int) -> None:
     """CHANGE: 启动前自动清除占用端口的旧进程（Windows netstat+taskkill）"""
     if os.name != 'nt':
@@ -215,25 +267,97 @@ JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24 * 7  # 7天
 
 
-def _cached_api_response(cache_key_fn, ttl):
-    """CHANGE: API 响应缓存装饰器，cache_key_fn(request) 返回缓存 key"""
+def _api_cache_key(prefix: str, req) -> str:
+    """缓存 key = prefix + 路径 + 全部查询参数（按名称排序，忽略 _API_CACHE_IGNORED_ARGS）"""
+    args = sorted((k, v) for k, v in req.args.items(multi=True) if k not in _API_CACHE_IGNORED_ARGS)
+    return f"{prefix}:{req.path}?{urlencode(args)}"
+
+
+def _freeze_api_response(result) -> Tuple[int, bytes, List[Tuple[str, str]], bool]:
+    """视图返回值 -> (状态码, 正文, 响应头, 是否可缓存)；只缓存 200 且 JSON success 为真的响应"""
+    from flask import current_app
+    resp = current_app.make_response(result)
+    body = resp.get_data()
+    headers = [(k, v) for k, v in resp.headers.items() if k.lower() != 'content-length']
+    cacheable = False
+    if resp.status_code == 200 and resp.is_json:
+        data = resp.get_json(silent=True)
+        cacheable = bool(isinstance(data, dict) and data.get('success'))
+    return resp.status_code, body, headers, cacheable
+
+
+def _catalog_etag(key: str, tag: Tuple[int, int]) -> str:
+    """强 ETag：目录快照版本 + 图片索引 revision + 缓存 key（路径与查询参数）。
+    正文中的 ?v= 取自图片索引（ImageIndex.signature），原地覆盖图片也会递增 revision，因此无需读取正文"""
+    return hashlib.sha1(f"{tag[0]}.{tag[1]}|{key}".encode('utf-8')).hexdigest()[:24]
+
+
+def _cached_api_response(prefix: str, ttl, stale_while_revalidate: int = 0,
+                         catalog_tag: Optional[Callable[[], Optional[Tuple[int, int]]]] = None):
+    """CHANGE: API 响应缓存装饰器：key 由 prefix、路径与全部查询参数组成；缓存完整响应（状态码、头、正文），
+    过期时同一 key 只有一个请求重建，其余请求返回旧值或等待（ResponseCache 单飞）；响应头 X-Cache 标明 hit/stale/miss/wait。
+    stale_while_revalidate > 0 时：过期后该秒数内直接返回旧响应并在后台线程重建（复制当前请求上下文），
+    并以 Cache-Control: public, max-age, stale-while-revalidate 让 Cloudflare 等代理层同样处理
+    （视图自己设了 no-store 的响应——cursor 分页、数据库搜索，直接读库不随目录快照变化——保留 no-store，不改写）。
+    CHANGE: catalog_tag 返回（目录快照版本, 图片 revision）时，200 响应带强 ETag 与 X-Catalog-Version（按计算时的版本写入缓存）；
+    If-None-Match 与当前版本的 ETag 相同（弱比较，压缩层改写的 W/ ETag 同样命中）时不查缓存、不执行视图，直接返回 304。"""
     def decorator(f):
+        @functools.wraps(f)
         def wrapped(*a, **kw):
-            from flask import request
-            key = cache_key_fn(request)
-            if key in _API_CACHE:
-                exp, data = _API_CACHE[key]
-                if exp > time.time():
-                    return jsonify(data)
-            result = f(*a, **kw)
-            resp = result[0] if isinstance(result, tuple) else result
-            try:
-                d = resp.get_json() if hasattr(resp, 'get_json') else None
-                if d and d.get('success'):
-                    _API_CACHE[key] = (time.time() + ttl, d)
-            except Exception:
-                pass
-            return result
+            from flask import request, Response, copy_current_request_context
+            key = _api_cache_key(prefix, request)
+
+            def _cache_control(resp, status, state):
+                if 'no-store' in (resp.headers.get('Cache-Control') or ''):
+                    return
+                if stale_while_revalidate and status in (200, 304):
+                    # 旧响应 max-age=0：代理层下次即回源，拿到后台重建后的新响应
+                    max_age = 0 if state == 'stale' else int(ttl)
+                    resp.headers['Cache-Control'] = f"public, max-age={max_age}, stale-while-revalidate={int(stale_while_revalidate)}"
+                    resp.headers.pop('Pragma', None)
+                elif catalog_tag is not None and status in (200, 304):
+                    # 有 ETag 时允许客户端保存，每次用 If-None-Match 协商（目录未变只回 304）
+                    resp.headers['Cache-Control'] = 'no-cache'
+                    resp.headers.pop('Pragma', None)
+
+            def _not_modified(etag, version, state, view_cache_control=None):
+                resp = Response(status=304)
+                resp.set_etag(etag)
+                if view_cache_control:
+                    resp.headers['Cache-Control'] = view_cache_control
+                resp.headers['X-Catalog-Version'] = str(version)
+                resp.headers['X-Cache'] = state.upper()
+                _cache_control(resp, 304, state)
+                return resp
+
+            tag = catalog_tag() if catalog_tag is not None else None
+            if tag and tag[0]:
+                etag = _catalog_etag(key, tag)
+                if request.if_none_match.contains_weak(etag):
+                    return _not_modified(etag, tag[0], 'not-modified')
+
+            def _compute():
+                # 视图执行前读取版本：标注的版本不会比响应内容新，目录在计算期间切换时客户端下次仍会拿到新内容
+                tag_at = catalog_tag() if catalog_tag is not None else None
+                status, body, headers, cacheable = _freeze_api_response(f(*a, **kw))
+                if tag_at and tag_at[0] and status == 200:
+                    headers = [(k, v) for k, v in headers if k.lower() not in ('etag', 'x-catalog-version')]
+                    headers += [('ETag', f'"{_catalog_etag(key, tag_at)}"'), ('X-Catalog-Version', str(tag_at[0]))]
+                return status, body, headers, cacheable
+            frozen, state = _API_CACHE.get_or_compute(
+                key, ttl, _compute, cacheable=lambda fr: fr[3],
+                stale_grace=stale_while_revalidate or ttl,
+                revalidate=copy_current_request_context(_compute) if stale_while_revalidate else None,
+            )
+            status, body, headers, _ = frozen
+            resp = Response(body, status=status, headers=headers)
+            resp.headers['X-Cache'] = state.upper()
+            _cache_control(resp, status, state)
+            etag = resp.get_etag()[0] if status == 200 else None
+            if etag and request.if_none_match.contains_weak(etag):
+                # 缓存中的旧响应与客户端已有版本相同（目录刚切换、后台尚未重建）
+                return _not_modified(etag, resp.headers.get('X-Catalog-Version', ''), state, resp.headers.get('Cache-Control'))
+            return resp
         return wrapped
     return decorator
 
@@ -362,12 +486,48 @@ class PWACartAPIServer:
             self.product_image_dirs.append(_output_images)
             logger.info(f"📷 已加入 output_images（PRODUCTOS 其他供应商图）: {_output_images}")
         print(f"📷 [API] 图片目录: {self.product_image_dirs}")
+        # CHANGE: ULTIMO 图片目录优先 ULTIMO_IMAGE_DIR，不存在时用第一个图片目录下的 Cristy
+        self.image_index = ImageIndex(
+            self.product_image_dirs,
+            [ULTIMO_IMAGE_DIR, os.path.join(self.product_image_dirs[0], 'Cristy')],
+        )
+        self.image_index.refresh(force=True)
+        logger.info(f"📷 图片索引已建立: {self.image_index.stats()}")
+        # CHANGE: /api/images/ 查找顺序：ULTIMO 目录 -> 各图片目录的 Cristy 子文件夹 -> 图片目录本身（排除 Cristy）
+        self._image_trees = [(ULTIMO_IMAGE_DIR, ())]
+        for _d in self.product_image_dirs:
+            self._image_trees.append((os.path.join(_d, 'Cristy'), ()))
+            self._image_trees.append((_d, ('Cristy',)))
+        self.image_variants = ImageVariantCache()
+        logger.info(f"🖼️ 图片缩略变体: Pillow={'可用' if PIL_AVAILABLE else '未安装（?w= 返回原图）'}，"
+                    f"缓存目录={self.image_variants.cache_dir}，档位={list(self.image_variants.widths)}")
+        # CHANGE: image_optimizer.py 离线预生成的变体清单，?w= 请求优先使用，避免在 Web 进程内编码
+        self.image_manifest = ImageVariantManifest()
+        if self.image_manifest.load():
+            logger.info(f"🖼️ 已加载预生成图片变体清单: {self.image_manifest.stats()}")
+
+        # CHANGE: 产品目录快照：Cristy/非Cristy 各查一次 PG 组成只读快照，后台按 CATALOG_REFRESH_SECONDS 刷新，请求线程不再每次全表查询
+        self.catalog = CatalogSnapshotManager(self._load_catalog_rows, shared_store=SharedCatalogStore.from_env())
+        if self.catalog.shared_store is not None:
+            logger.info(f"📦 产品目录使用多 worker 共享存储: {self.catalog.shared_store.path}")
+        self.catalog.start()
+        self.listing_pages = ListingStore()
+        self.search_backend = configured_search_backend(USE_SQLITE_FOR_PRODUCTS)
+        logger.info(f"🔎 产品搜索后端: {self.search_backend}")
         
         # 创建Flask应用
         if FLASK_AVAILABLE:
             # 设置静态文件目录
             static_folder = os.path.join(os.path.dirname(__file__), 'pwa_cart')
             self.app = Flask(__name__, static_folder=static_folder, static_url_path='/pwa_cart')
+            self.app.json = FastJSONProvider(self.app)
+            logger.info(f"🧾 JSON 编码器: {self.app.json.backend}")
+            # CHANGE: 目录快照切换后预先物化「以图为准」列表（图片 revision 变化时由请求按需重建）
+            self.catalog.add_listener(self._warm_image_first_listings)
+            # CHANGE: 压缩须最先注册（after_request 倒序执行，压缩在 CORS/日志等处理之后进行）；静态文件后台预压缩
+            self.compressor = ResponseCompressor().init_app(self.app)
+            threading.Thread(target=self.compressor.precompress_dir, args=(static_folder,),
+                             name='static-precompress', daemon=True).start()
             # CHANGE: 明确允许云端页 ventax.pages.dev、ventaxpages.com、预览部署 *.ventax.pages.dev 与本机，避免 CORS 拦截
             _cors_origins = [
                 "https://ventax.pages.dev", "https://ventaxpages.com",
@@ -377,7 +537,8 @@ class PWACartAPIServer:
             _extra = (os.getenv('CORS_EXTRA_ORIGINS') or '').strip().split(',')
             _cors_origins.extend([o.strip() for o in _extra if o.strip()])
             _cors_origins.append("https://df6334cd.ventax.pages.dev")  # Wrangler 预览部署
-            CORS(self.app, origins=_cors_origins, supports_credentials=True)
+            # CHANGE: 暴露 ETag / X-Catalog-Version，跨域页面（Pages）的脚本可读取目录版本
+            CORS(self.app, origins=_cors_origins, supports_credentials=True, expose_headers=['ETag', 'X-Catalog-Version'])
 
             # CHANGE: 所有响应（含 4xx/5xx）都加 CORS，避免 Render 错误响应无头导致浏览器报 CORS
             _cors_origins_set = set(_cors_origins)
@@ -882,9 +1043,15 @@ class PWACartAPIServer:
         return '/api/images/' + basename
 
     def _pg_connect(self, pg_config: Dict) -> "Any":
-        """根据 pg_config 建立 PostgreSQL 连接。支持 DATABASE_URL 或 host/port/db 形式。"""
+        """CHANGE: 从连接池借出 PostgreSQL 连接（按连接配置各一个池），调用方 conn.close() 即归还，避免每次请求重新与 Neon 握手。"""
         if not pg_config or not PSYCOPG2_AVAILABLE or psycopg2 is None:
             return None
+        key = pg_config.get('_connection_string') or tuple(sorted((str(k), str(v)) for k, v in pg_config.items()))
+        pool = get_pool(key, lambda: self._pg_connect_raw(pg_config), name='neon' if pg_config.get('_connection_string') else 'pg')
+        return pool.getconn()
+
+    def _pg_connect_raw(self, pg_config: Dict) -> "Any":
+        """根据 pg_config 建立 PostgreSQL 连接。支持 DATABASE_URL 或 host/port/db 形式。"""
         conn_str = pg_config.get('_connection_string')
         if conn_str:
             return psycopg2.connect(conn_str, connect_timeout=10)
@@ -1128,102 +1295,744 @@ class PWACartAPIServer:
 
     def _get_products_dict_from_postgres(self) -> Dict[Any, Dict]:
         """当 USE_SQLITE_FOR_PRODUCTS=False 时，从 PostgreSQL 合并 Cristy + 非Cristy 得到与 get_all_products() 同结构的 dict。"""
-        out = {}
-        cristy = self._get_ultimo_products_from_postgres()
-        others = self._get_others_products_from_postgres()
-        for pid, pinfo in cristy:
-            if pid is not None:
-                out[pid] = pinfo
-                code = (pinfo.get('product_code') or '').strip() or str(pid)
-                if code:
-                    out[code] = pinfo
-        for pid, pinfo in others:
-            if pid is not None:
-                out[pid] = pinfo
-                code = (pinfo.get('product_code') or '').strip() or str(pid)
-                if code:
-                    out[code] = pinfo
+        out = merge_product_rows(self._get_ultimo_products_from_postgres(), self._get_others_products_from_postgres())
         if out:
             logger.info(f"📦 [API] PostgreSQL 产品字典: {len(out)} 条（Cristy+非Cristy，替代 SQLite）")
         return out
 
-    def _get_single_product_from_postgres_any(self, product_id: str) -> Optional[Dict]:
-        """从 PostgreSQL 按 id_producto/codigo_producto 查询单条产品（不限制 Cristy），供详情页/购物车/同步补全。
-        CHANGE: 不再过滤 esta_activo，确保其他供应商产品（可能未设或为 FALSE）也能查到 name/code。
-        CHANGE: 若完整 pid 查不到，提取数字部分（如 TG_JUGUETESFANG_90029 -> 90029）再查 id_producto，Neon 中其他供应商常用 id 当主键。"""
+    @staticmethod
+    def _catalog_alias_index(snap) -> ProductAliasIndex:
+        """按快照版本缓存的产品别名索引（products 的所有 key）"""
+        return snap.derived('alias_index', lambda s: ProductAliasIndex(s.products.keys()))
+
+    @staticmethod
+    def _catalog_search_index(snap) -> ProductSearchIndex:
+        """按快照版本缓存的搜索索引（products 与 Cristy 列表中的所有产品）"""
+        def _build(s):
+            t0 = time.time()
+            index = ProductSearchIndex(list(s.products.items()) + list(s.cristy))
+            logger.info(f"🔍 [API] 搜索索引已建立（快照 v{s.version}）: {index.stats()}，用时 {time.time() - t0:.2f}s")
+            return index
+        return snap.derived('search_index', _build)
+
+    def _catalog_visible_rows(self, snap) -> List[Tuple[Any, Dict]]:
+        """按快照版本缓存：ULTIMO + PRODUCTOS 筛选后的产品（前缀提示与分面统计共用）"""
+        def _build(s):
+            cristy_products, others, _, _ = self._filter_products_cristy_and_others(s.products, s.cristy, None, 'Cristy')
+            return list(cristy_products) + list(others)
+        return snap.derived('visible_rows', _build)
+
+    def _catalog_suggest_index(self, snap) -> ProductSuggestIndex:
+        """按快照版本缓存的前缀提示索引，范围与搜索一致（ULTIMO + PRODUCTOS 筛选后的产品）"""
+        def _build(s):
+            t0 = time.time()
+            index = ProductSuggestIndex(self._catalog_visible_rows(s))
+            logger.info(f"🔍 [API] 提示索引已建立（快照 v{s.version}）: {index.stats()}，用时 {time.time() - t0:.2f}s")
+            return index
+        return snap.derived('suggest_index', _build)
+
+    def _catalog_facet_index(self, snap) -> FacetIndex:
+        """按快照版本缓存的分面位图"""
+        def _build(s):
+            t0 = time.time()
+            index = FacetIndex(self._catalog_visible_rows(s))
+            logger.info(f"📊 [API] 分面位图已建立（快照 v{s.version}）: {index.stats()}，用时 {time.time() - t0:.2f}s")
+            return index
+        return snap.derived('facet_index', _build)
+
+    def _products_facets(self, snap, supplier_lower: str, category: Optional[str], band: Optional[str],
+                         product_ids: Optional[Iterable[Any]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """CHANGE: /api/products 的 facets：product_ids 为搜索命中（搜索不分 supplier）；否则按 supplier 取基础集合
+        （cristy / others 为分组，其余为具体供应商）。计数不含图片是否存在的过滤。"""
+        index = self._catalog_facet_index(snap)
+        selected = {'category': category, 'price_band': band}
+        if product_ids is not None:
+            base = index.mask_for(product_ids)
+        elif supplier_lower == 'others':
+            base = index.all & ~index.value_mask('supplier', 'Cristy')
+        else:
+            base = index.all
+            selected['supplier'] = 'Cristy' if supplier_lower == 'cristy' else supplier_lower
+        return index.counts(base, selected)
+
+    @staticmethod
+    def _image_first_item(pid, pinfo, created, img_path, display_code) -> Dict[str, Any]:
+        """以图为准列表的一条；price 必须为单价(precio_unidad)，供弹窗/加购按数量 1-2 单价/3-11 批发/12+ 批量 正确计算"""
+        # CHANGE: 名称必须用 DB 的 nombre_producto/name，空时才用展示码，禁止用图片文件名
+        db_name = (pinfo.get('name', '') or pinfo.get('nombre_producto', '') or '').strip()
+        return {
+            'id': pid,
+            'product_code': display_code,
+            'name': db_name if db_name else (display_code or ''),
+            'price': float(pinfo.get('price') or 0),
+            'wholesale_price': pinfo.get('wholesale_price', 0),
+            'bulk_price': pinfo.get('bulk_price', 0),
+            'description': pinfo.get('description', ''),
+            'image_path': img_path,
+            'category': pinfo.get('category_id', 'default'),
+            'created_at': created,
+            'channel_username': pinfo.get('channel_username', ''),
+            'codigo_proveedor': pinfo.get('codigo_proveedor', '')
+        }
+
+    def _image_first_items_cristy(self, cristy_products, files) -> List[Dict[str, Any]]:
+        """ULTIMO（supplier=Cristy）以图为准：遍历 Cristy 图片文件夹，用文件名解析产品再填 name/price，一图一产品数据不错位；
+        返回按 created_at 降序的完整列表"""
+        lookup = {}
+        for pid, pinfo in cristy_products:
+            key = (str(pid).strip().lower() if pid else '').strip()
+            if not key:
+                continue
+            lookup[key] = (pid, pinfo)
+            lookup[_normalize_base_ai_al(key)] = (pid, pinfo)
+            # 图片可能为 10060.jpg、10060._AI.jpg；用「去掉 ._ai 后缀」作 key 便于匹配
+            prefix = re.sub(r'[._\-]*(?:ai|al)$', '', key.strip(), flags=re.IGNORECASE).strip()
+            if prefix and prefix != key:
+                lookup[prefix] = (pid, pinfo)
+            # 纯数字段（如 10060）也登记，便于 10060.jpg 匹配 10060._AI
+            nums = re.findall(r'^\d+', key)
+            if nums:
+                lookup[nums[0]] = (pid, pinfo)
+        rows = []
+        for f in files:
+            base = os.path.splitext(f)[0].strip()
+            base_lower = base.lower()
+            pair = (lookup.get(_normalize_base_ai_al(base_lower)) or lookup.get(base_lower) or lookup.get(base) or
+                    lookup.get(re.sub(r'[._\-]*(?:ai|al)$', '', base_lower, flags=re.IGNORECASE).strip()))
+            if not pair:
+                lead_digits = re.findall(r'^\d+', base_lower)
+                if lead_digits:
+                    pair = lookup.get(lead_digits[0])
+            if pair:
+                pid, pinfo = pair
+                rows.append((pid, pinfo, pinfo.get('created_at', ''), '/api/images/' + f, base))
+            else:
+                # CHANGE: 即使库内无匹配，也按图片文件名显示一卡，避免错用其他产品数据
+                rows.append((base, {'name': base, 'product_code': base, 'price': 0, 'wholesale_price': 0, 'bulk_price': 0, 'description': '', 'created_at': '', 'category_id': 'default', 'channel_username': '', 'codigo_proveedor': 'Cristy'}, '', '/api/images/' + f, base))
+        rows.sort(key=lambda x: x[2], reverse=True)
+        items = []
+        for pid, pinfo, created, img_path, base in rows:
+            code = pinfo.get('product_code') or pinfo.get('codigo_producto') or pid
+            code = (code or '').strip() if hasattr(code, 'strip') else str(code or '').strip()
+            # CHANGE: 展示用 product_code 以图片文件名为准，保证页上代码与图片一致；id 保持库内 id 便于加购
+            items.append(self._image_first_item(pid, pinfo, created, img_path, base or code or str(pid)))
+        return items
+
+    def _image_first_items_others(self, products, files) -> List[Dict[str, Any]]:
+        """PRODUCTOS（supplier=others）以图为准：用全库 products 的 ruta_imagen 建 文件名->产品，按图片文件名查找；
+        返回按 created_at 降序的完整列表"""
+        # CHANGE: 多条产品指向同一图时「不覆盖」，保留第一个，避免名称错位漏洞
+        image_to_product = {}
+        for pid, pinfo in products.items():
+            img = (pinfo.get('image_path') or pinfo.get('ruta_imagen') or '')
+            if not img:
+                continue
+            img = (img if isinstance(img, str) else str(img)).strip()
+            if img and (os.path.sep in img or '/' in img or '\\' in img):
+                bn_raw = os.path.basename(img.replace('/', os.path.sep).replace('\\', os.path.sep))
+            else:
+                bn_raw = img
+            if not bn_raw or not bn_raw.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
+                continue
+            key_norm = _normalize_image_filename(bn_raw).lower()
+            key_raw = bn_raw.lower()
+            if key_norm not in image_to_product:
+                image_to_product[key_norm] = (pid, pinfo)
+            if key_raw not in image_to_product:
+                image_to_product[key_raw] = (pid, pinfo)
+        rows = []
+        excl_prefixes = getattr(self, 'productos_exclude_file_prefixes', None) or []
+        for f in files:
+            base = os.path.splitext(f)[0].strip()
+            # CHANGE: 跳过未完成处理的产品（如 importadoraWoni 仅OCR未白底），避免 404 影响旧产品
+            if excl_prefixes and any(base.lower().startswith(p) for p in excl_prefixes):
+                continue
+            fn_norm = _normalize_image_filename(f)
+            pair = None
+            if fn_norm or f:
+                pair = image_to_product.get((fn_norm or f).lower()) or image_to_product.get(f.lower())
+            if pair and (pair[1].get('codigo_proveedor') or '').strip().lower() == 'cristy':
+                pair = None
+            if pair:
+                pid, pinfo = pair
+                rows.append((pid, pinfo, pinfo.get('created_at', ''), '/api/images/' + f))
+            else:
+                rows.append((base, {'name': base, 'product_code': base, 'price': 0, 'wholesale_price': 0, 'bulk_price': 0, 'description': '', 'created_at': '', 'category_id': 'default', 'channel_username': '', 'codigo_proveedor': ''}, '', '/api/images/' + f))
+        rows.sort(key=lambda x: x[2], reverse=True)
+        items = []
+        for pid, pinfo, created, img_path in rows:
+            code = pinfo.get('product_code') or pinfo.get('codigo_producto') or pid
+            code = (code or '').strip() if hasattr(code, 'strip') else str(code or '').strip()
+            # CHANGE: 其他供应商展示用 codigo_producto（加密产品代码），不用图片文件名
+            items.append(self._image_first_item(pid, pinfo, created, img_path, code or str(pid)))
+        logger.info(f"📦 [API] PRODUCTOS 以图为准: 共 {len(items)} 个，DB图关联数={len(image_to_product)}")
+        return items
+
+    def _image_first_listing(self, view: str, snap) -> Optional[MaterializedListing]:
+        """CHANGE: 「以图为准」列表（view 为 cristy / others）的物化分页，按（快照版本, 图片索引 revision）建立一次；
+        该视图不适用（ULTIMO 无 Cristy 产品、或对应图片目录为空）时返回 None，由调用方走通用逻辑"""
+        image_sets = self.image_index.listing_sets()
+        key = (snap.version, self.image_index.revision)
+
+        def _build():
+            if view == 'cristy':
+                files = image_sets['cristy']
+                cristy_products = self._filter_products_cristy_and_others(snap.products, snap.cristy, None, 'Cristy')[0]
+                if not cristy_products or not files:
+                    return None
+                items = self._image_first_items_cristy(cristy_products, files)
+            else:
+                files = image_sets['ya_subio_no_cristy']
+                if not files:
+                    return None
+                # CHANGE: 合并 PostgreSQL 非Cristy 产品，避免仅存 PG 的产品无法映射（快照内已预先合并）
+                items = self._image_first_items_others(snap.products_with_others, files)
+            self._add_image_versions(items)
+            dumps = self.app.json.dumps_bytes
+            # 分面取值取自列表条目本身（含库内无匹配的图片卡），分类/价格区间筛选与计数都基于同一份列表
+            facet_rows = [{'codigo_proveedor': item.get('codigo_proveedor'), 'category_id': item.get('category'),
+                           'price': item.get('price')} for item in items]
+            return MaterializedListing(key, [dumps(item) for item in items], facet_rows=facet_rows)
+        return self.listing_pages.get(view, key, _build)
+
+    def _catalog_tag(self) -> Optional[Tuple[int, int]]:
+        """（目录快照版本, 图片索引 revision），用于列表/详情的 ETag；快照尚未加载时返回 None（不触发加载）"""
+        version = self.catalog.version
+        if not version:
+            return None
+        return version, self.image_index.refresh()
+
+    def _warm_image_first_listings(self, snap) -> None:
+        """目录快照切换后在后台线程预先物化两个视图，首个请求不必等待重建"""
+        def _run():
+            for view in ('cristy', 'others'):
+                try:
+                    self._image_first_listing(view, snap)
+                except Exception as e:
+                    logger.warning(f"⚠️ [listing] {view} 列表物化失败: {e}")
+        threading.Thread(target=_run, name='listing-warm', daemon=True).start()
+
+    def _listing_page_response(self, listing: MaterializedListing, page: int, limit: int,
+                               category: Optional[str], band: Optional[str]):
+        """物化列表的一页：data 为预先拼好的字节串，只序列化 pagination 与 facets；
+        结构与 jsonify 一致（键排序、紧凑分隔符、结尾换行）。
+        category / price_band 筛选列表本身（按选择物化的子列表），facets 由同一份列表计数，与 pagination.total 一致"""
+        selected = {'category': category, 'price_band': band}
+        view = listing.select(selected)
+        total = view.total
+        dumps = self.app.json.dumps_bytes
+        pagination = {
+            "page": page,
+            "limit": limit,
+            "total": total,
+            "total_pages": (total + limit - 1) // limit if total else 1
+        }
+        facets = listing.facets(selected)
+        body = b''.join((
+            b'{"data":', view.page(page, limit),
+            b',"facets":', dumps(facets),
+            b',"pagination":', dumps(pagination),
+            b',"success":true}\n',
+        ))
+        return json_response(body)
+
+    @staticmethod
+    def _build_cristy_code_names(snap):
+        """下单补全用：Cristy {pid: {'code', 'name'}} 及其别名索引"""
+        pg_map = {}
+        for pid, pinfo in snap.cristy:
+            k = str(pid)
+            code = (pinfo.get('product_code') or pinfo.get('id') or k).strip()
+            name = (pinfo.get('name') or '').strip()
+            if code or name:
+                pg_map[k] = {'code': code or k, 'name': name or code or k}
+        return pg_map, ProductAliasIndex(pg_map.keys())
+
+    def _send_product_image(self, path: str, mimetype: Optional[str] = None, etag: Optional[str] = None,
+                            source: Optional[str] = None):
+        """CHANGE: 发送图片并支持条件请求：强 ETag/Last-Modified（大小+mtime）命中返回 304，支持 Range；
+        URL 的 ?v= 等于文件当前版本时为内容寻址地址，Cache-Control 设为 immutable 长期缓存；
+        不带 v 或 v 已过期/不匹配（文件已被覆盖）时短期缓存后协商，避免浏览器把旧地址当作永不变化。
+        source 为缩略变体的原图路径：?v= 是原图版本，按原图比较。文件已不存在（如变体刚被淘汰）时返回 None。"""
+        from flask import send_file
+        try:
+            version, st = _image_file_version(path)
+        except OSError:
+            return None
+        v = request.args.get('v')
+        versioned = False
+        if v:
+            try:
+                versioned = v == (_image_file_version(source)[0] if source else version)
+            except OSError:
+                pass
+        resp = send_file(path, mimetype=mimetype, conditional=True, etag=etag or version, last_modified=st.st_mtime,
+                         max_age=IMAGE_IMMUTABLE_MAX_AGE if versioned else IMAGE_CACHE_MAX_AGE)
+        resp.cache_control.public = True
+        if versioned:
+            resp.cache_control.immutable = True
+        return resp
+
+    def _versioned_image_url(self, image_path):
+        """CHANGE: /api/images/<文件名> 附加 ?v=<大小+mtime 版本>，文件变化时 URL 随之变化，长期缓存仍然正确；
+        版本取自图片索引记录的 (大小, mtime)，与 ETag 中的图片 revision 同步变化"""
+        if not isinstance(image_path, str) or not image_path.startswith('/api/images/') or '?' in image_path:
+            return image_path
+        from urllib.parse import unquote
+        fname = os.path.basename(unquote(image_path[len('/api/images/'):]).strip())
+        if not fname:
+            return image_path
+        path = self.image_index.find((fname, _normalize_image_filename(fname)), self._image_trees)
+        if not path:
+            return image_path
+        sig = self.image_index.signature(path)
+        if sig is None:
+            return image_path
+        return f"{image_path}?v={_image_version(*sig)}"
+
+    def _add_image_versions(self, items) -> None:
+        """为列表/详情中的 image_path 加上版本号（原地修改每页新建的 dict）；
+        CHANGE: 本地有图且 Pillow 可用（或有预生成清单）时附带 image_srcset（WebP 缩略档位），供卡片 <img srcset> 使用"""
+        for item in items or ():
+            if isinstance(item, dict) and item.get('image_path'):
+                url = self._versioned_image_url(item['image_path'])
+                item['image_path'] = url
+                if (PIL_AVAILABLE or len(self.image_manifest)) and url.startswith('/api/images/') and '?v=' in url:
+                    item['image_srcset'] = image_srcset(url)
+
+    def _load_catalog_rows(self) -> Dict[str, Any]:
+        """CHANGE: CatalogSnapshot 的数据源：Cristy 与非 Cristy 各查询一次，合并为与 get_all_products() 同结构的 products。"""
+        cristy = self._get_ultimo_products_from_postgres()
+        others = self._get_others_products_from_postgres()
+        if USE_SQLITE_FOR_PRODUCTS and self.db:
+            return {'products': self.db.get_all_products(), 'cristy': cristy, 'others': others, 'source': 'sqlite'}
+        products = merge_product_rows(cristy, others)
+        if products:
+            logger.info(f"📦 [API] PostgreSQL 产品字典: {len(products)} 条（Cristy+非Cristy，替代 SQLite）")
+        return {'products': products, 'cristy': cristy, 'others': others, 'source': 'postgresql'}
+
+    def _pg_products_filter(self, supplier_lower: str, category: Optional[str] = None) -> Tuple[List[str], List[Any]]:
+        """products 列表的 WHERE 条件（激活、供应商、分类、排除未完成图片前缀），分页与搜索共用"""
+        whitelist = [c.lower() for c in (getattr(self, 'other_supplier_codes', None) or []) if c]
+        cristy_cond = "(codigo_proveedor = 'Cristy' AND (inventario IS NULL OR inventario >= 0))"
+        others_cond = "LOWER(COALESCE(codigo_proveedor, '')) = ANY(%s)"
+        where = ["(esta_activo IS NULL OR esta_activo = TRUE)"]
+        params: List[Any] = []
+        if supplier_lower == 'cristy':
+            where.append(cristy_cond)
+        elif supplier_lower == 'others':
+            where.append(others_cond)
+            params.append(whitelist)
+        elif supplier_lower:
+            where.append("LOWER(codigo_proveedor) = %s")
+            params.append(supplier_lower)
+        else:
+            where.append(f"({cristy_cond} OR {others_cond})")
+            params.append(whitelist)
+        if category:
+            where.append("categoria = %s")
+            params.append(category)
+        # 排除未完成处理的图片前缀（与 _filter_products_cristy_and_others 一致）
+        _excl = getattr(self, 'productos_exclude_file_prefixes', None) or []
+        if _excl and supplier_lower != 'cristy':
+            where.append("NOT (LOWER(regexp_replace(COALESCE(ruta_imagen, ''), '^.*[\\\\/]', '')) LIKE ANY(%s))")
+            params.append([p.replace('%', '').replace('_', '\\_') + '%' for p in _excl])
+        return where, params
+
+    @staticmethod
+    def _pg_page_row(r) -> Dict:
+        """PG products 分页行 -> 与 DatabaseManager.get_products_page 相同的结构"""
+        _r = {str(k).lower(): v for k, v in r.items()}
+        return {
+            'id_producto': _r.get('id_producto'),
+            'product_code': (str(_r.get('codigo_producto') or '')).strip(),
+            'name': (str(_r.get('nombre_producto') or '')).strip(),
+            'price': float(_r.get('precio_unidad') or 0),
+            'wholesale_price': float(_r.get('precio_mayor') or 0),
+            'bulk_price': float(_r.get('precio_bulto') or 0),
+            'description': (str(_r.get('descripcion') or '')).strip(),
+            'category_id': (str(_r.get('categoria') or 'default')).strip(),
+            'image_path': str(_r.get('ruta_imagen') or ''),
+            'created_at': _r.get('fecha_creacion'),
+            'codigo_proveedor': (_r.get('codigo_proveedor') or '').strip(),
+            'channel_username': '',
+            'stock': int(_r.get('inventario') or 0),
+        }
+
+    def _get_products_page_from_postgres(self, supplier_lower: str, limit: int, after: Optional[Tuple[Any, Any]] = None,
+                                         offset: int = 0, category: Optional[str] = None) -> Optional[List[Dict]]:
+        """CHANGE: 产品列表分页下推到 SQL：ORDER BY fecha_creacion DESC NULLS LAST, id_producto DESC，
+        after=(fecha_creacion, id_producto) 为 keyset 游标（无游标时用 offset 兼容 page/limit），只取 limit 行。
+        返回结构与 DatabaseManager.get_products_page 一致；PG 不可用、连接池超时或查询失败返回 None（不是空页）。"""
         pg_config = self._get_pg_config()
         if not pg_config or not PSYCOPG2_AVAILABLE or psycopg2 is None:
             return None
+        where, params = self._pg_products_filter(supplier_lower, category)
+        if after:
+            after_created, after_id = after
+            if after_created is None:
+                where.append("(fecha_creacion IS NULL AND id_producto < %s)")
+                params.append(after_id)
+            else:
+                where.append("((fecha_creacion, id_producto) < (%s, %s) OR fecha_creacion IS NULL)")
+                params.extend([after_created, after_id])
+        sql = (
+            "SELECT id_producto, codigo_producto, nombre_producto, descripcion, precio_unidad, precio_mayor, precio_bulto, "
+            "categoria, ruta_imagen, inventario, codigo_proveedor, fecha_creacion "
+            f"FROM products WHERE {' AND '.join(where)} "
+            "ORDER BY fecha_creacion DESC NULLS LAST, id_producto DESC LIMIT %s"
+        )
+        params.append(int(limit))
+        if not after and offset:
+            sql += " OFFSET %s"
+            params.append(int(offset))
         conn = None
         try:
             conn = self._pg_connect(pg_config)
             if not conn:
                 return None
             cur = conn.cursor(cursor_factory=RealDictCursor)
-            pid_str = str(product_id).strip()
-            ids_to_try = [pid_str]
-            # CHANGE: 提取数字部分（如 TG_JUGUETESFANG_90029 -> 90029），Neon 中 codigo_producto 可能为 XE02，id_producto=90029
-            nums = re.findall(r'\d+', pid_str)
-            for n in reversed(nums):
-                if n and n not in ids_to_try:
-                    ids_to_try.append(n)
-            r = None
-            for try_id in ids_to_try:
-                cur.execute(
-                    """
-                    SELECT id_producto, codigo_producto, nombre_producto, descripcion,
-                           precio_unidad, precio_mayor, precio_bulto, categoria, ruta_imagen,
-                           inventario, codigo_proveedor, fecha_creacion, esta_activo
-                    FROM products
-                    WHERE codigo_producto = %s OR id_producto::text = %s
-                    LIMIT 1
-                    """,
-                    (try_id, try_id),
-                )
-                r = cur.fetchone()
-                if r:
-                    if try_id != pid_str:
-                        logger.info("📋 [PG any] 用数字 id=%s 匹配到 product_id=%s", try_id, pid_str)
-                    break
+            if not getattr(self, '_pg_keyset_index_ready', False):
+                # 一次性建 (fecha_creacion, id_producto) 复合索引，keyset 翻页只扫 limit 行
+                try:
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_products_fecha_id ON products (fecha_creacion DESC NULLS LAST, id_producto DESC)")
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logger.debug(f"创建分页索引失败（忽略）: {e}")
+                self._pg_keyset_index_ready = True
+            cur.execute(sql, params)
+            rows = cur.fetchall()
             cur.close()
-            if not r:
-                logger.debug("📋 [PG any] 未找到 product_id=%s（已尝试 %s）", pid_str, ids_to_try)
+            return [self._pg_page_row(r) for r in rows]
+        except Exception as e:
+            logger.warning(f"⚠️ PostgreSQL 产品分页查询失败: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def _search_products_page_from_postgres(self, search: str, supplier_lower: str, limit: int, offset: int = 0,
+                                            category: Optional[str] = None) -> Optional[Tuple[List[Dict], int]]:
+        """CHANGE: 搜索下推到 PostgreSQL：pg_trgm GIN 索引筛选，只返回本页行，COUNT(*) OVER() 带回总数。
+        返回 (rows, total)；PG 不可用或查询失败时返回 None（调用方回退进程内搜索）。"""
+        pg_config = self._get_pg_config()
+        if not pg_config or not PSYCOPG2_AVAILABLE or psycopg2 is None:
+            return None
+        where, params = self._pg_products_filter(supplier_lower, category)
+        search_sql, search_params = pg_search_condition(search)
+        where.append(search_sql)
+        params.extend(search_params)
+        sql = (
+            "SELECT id_producto, codigo_producto, nombre_producto, descripcion, precio_unidad, precio_mayor, precio_bulto, "
+            "categoria, ruta_imagen, inventario, codigo_proveedor, fecha_creacion, COUNT(*) OVER () AS _total "
+            f"FROM products WHERE {' AND '.join(where)} "
+            "ORDER BY fecha_creacion DESC NULLS LAST, id_producto DESC LIMIT %s OFFSET %s"
+        )
+        params.extend([int(limit), int(offset)])
+        conn = None
+        try:
+            conn = self._pg_connect(pg_config)
+            if not conn:
                 return None
-            try:
-                _r = {str(k).lower(): v for k, v in r.items()}
-            except Exception:
-                _r = dict(r)
-            created_at = _r.get('fecha_creacion')
+            if not getattr(self, '_pg_search_index_ready', False):
+                # 一次性建 pg_trgm 扩展与表达式 GIN 索引（失败也只尝试一次，无索引时查询仍正确但需顺序扫描）
+                install_pg_search_indexes(conn)
+                self._pg_search_index_ready = True
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("SET LOCAL pg_trgm.word_similarity_threshold = %s", (trgm_threshold(),))
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cur.close()
+            conn.rollback()  # 结束只读事务，SET LOCAL 随之失效
+            total = int(rows[0].get('_total') or 0) if rows else 0
+            return [self._pg_page_row(r) for r in rows], total
+        except Exception as e:
+            logger.warning(f"⚠️ PostgreSQL 产品搜索失败，回退进程内搜索: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def _search_products_db_page(self, search: str, page: int, limit: int,
+                                 category: Optional[str] = None) -> Optional[Tuple[List[Dict], int]]:
+        """CHANGE: 按 PWA_SEARCH_BACKEND 在数据库里搜索（与进程内一致：搜索时为 ULTIMO + PRODUCTOS 并集，不按 supplier 分）。
+        返回 (本页列表项, 总数)；不可用时返回 None。"""
+        offset = max(0, (page - 1) * limit)
+        if self.search_backend == 'postgres' and not USE_SQLITE_FOR_PRODUCTS:
+            result = self._search_products_page_from_postgres(search, '', limit, offset, category)
+        elif self.search_backend == 'sqlite' and self.db and USE_SQLITE_FOR_PRODUCTS:
+            result = self.db.search_products_page(search, limit, offset=offset, supplier='', category=category,
+                                                  whitelist=self.other_supplier_codes,
+                                                  exclude_prefixes=getattr(self, 'productos_exclude_file_prefixes', None))
+        else:
+            return None
+        if result is None or (not result[0] and offset):
+            return None  # 越界页拿不到 COUNT(*) OVER() 总数，交给进程内路径
+        rows, total = result
+        return self._page_rows_to_items(rows), total
+
+    def _page_rows_to_items(self, rows: List[Dict]) -> List[Dict]:
+        """get_products_page 结构的行 -> /api/products 列表项（keyset 分页与数据库搜索共用）"""
+        items = []
+        for r in rows:
+            cp = (r.get('codigo_proveedor') or '').strip()
+            code = (r.get('product_code') or '').strip()
+            pid = r.get('id_producto')
+            created_at = r.get('created_at')
             if created_at is not None and hasattr(created_at, 'isoformat'):
                 created_at = created_at.isoformat()
-            ruta = self._format_image_path(str(_r.get('ruta_imagen') or ''), (_r.get('codigo_proveedor') or '').strip())
-            code = (str(_r.get('codigo_producto') or '')).strip()
-            name = (str(_r.get('nombre_producto') or '')).strip()
-            logger.info("📋 [PG any] 找到 product_id=%s -> codigo=%s, nombre=%s", pid_str, code, (name or "")[:50])
-            return {
-                'id': _r.get('id_producto'),
-                'name': name,
-                'product_code': code,
-                'price': float(_r.get('precio_unidad') or 0),
-                'wholesale_price': float(_r.get('precio_mayor') or 0),
-                'bulk_price': float(_r.get('precio_bulto') or 0),
-                'description': (str(_r.get('descripcion') or _r.get('description') or '')).strip(),
-                'category_id': (str(_r.get('categoria') or 'default')).strip(),
-                'image_path': ruta,
-                'stock': int(_r.get('inventario') or 0),
-                'codigo_proveedor': (_r.get('codigo_proveedor') or '').strip(),
+            items.append({
+                # 与以图为准的列表一致：Cristy 用 codigo_producto 作 id，其他供应商用 id_producto
+                'id': (code or pid) if cp.lower() == 'cristy' else pid,
+                'product_code': code or str(pid),
+                'name': r.get('name') or code or str(pid),
+                'price': r.get('price', 0),
+                'wholesale_price': r.get('wholesale_price', 0),
+                'bulk_price': r.get('bulk_price', 0),
+                'description': r.get('description', ''),
+                'image_path': self._format_image_path(str(r.get('image_path') or ''), cp),
+                'category': r.get('category_id', 'default'),
                 'created_at': created_at or '',
-                'is_active': 1,
-            }
+                'channel_username': r.get('channel_username', ''),
+                'codigo_proveedor': cp,
+            })
+        return items
+
+    def _resolve_listing_image(self, product_id, product_info: Dict, resolve_image_for_product,
+                               files_for_resolve) -> Optional[str]:
+        """列表中产品的图片地址（page/limit 与 ?cursor= 共用同一可见性规则）；返回 None 表示图片不在可配置目录内，不显示该产品。
+        resolve_image_for_product 为 ImageMatchIndex.resolve，files_for_resolve 为参与匹配的图片文件名（为空表示云端无本地图）"""
+        image_path = product_info.get('image_path', '')
+        # CHANGE: 已是云端 URL（PAGES_IMAGE_BASE_URL/R2）时直接使用，不覆盖为 /api/images/，也不走本地 resolve
+        if image_path and (image_path.startswith('http://') or image_path.startswith('https://')):
+            return image_path
+        if image_path:
+            if image_path.startswith('/api/images/'):
+                fname = image_path.replace('/api/images/', '').split('?')[0].strip()
+                image_path = f'/api/images/{_normalize_image_filename(fname)}'
+            elif '/pwa_cart/static/img/' in image_path or image_path.startswith('/pwa_cart/static/img/'):
+                filename = _normalize_image_filename(os.path.basename(image_path))
+                image_path = f'/api/images/{filename}'
+            elif image_path.startswith('/img/') or '/img/' in image_path:
+                filename = _normalize_image_filename(os.path.basename(image_path))
+                image_path = f'/api/images/{filename}'
+        elif os.path.isabs(image_path) or (image_path and ('D:' in image_path or 'C:' in image_path)):
+            normalized_path = image_path.replace('/', os.sep).replace('\\', os.sep)
+            filename = _normalize_image_filename(os.path.basename(normalized_path))
+            image_path = f'/api/images/{filename}'
+        elif image_path and ('\\' in image_path or '/' in image_path):
+            normalized_path = image_path.replace('/', os.sep).replace('\\', os.sep)
+            filename = _normalize_image_filename(os.path.basename(normalized_path))
+            image_path = f'/api/images/{filename}'
+        elif image_path and not image_path.startswith('http'):
+            image_path = f'/api/images/{_normalize_image_filename(image_path)}'
+        resolved = resolve_image_for_product(product_id, image_path)
+        if not resolved and image_path and (image_path.startswith('/api/images/') or image_path.startswith('http')):
+            # CHANGE: 搜索时若 resolve 失败但已有有效路径（云端图或 /api/images/），仍保留产品，避免按代码搜索无结果
+            resolved = image_path if image_path.startswith('http') else image_path
+        # CHANGE: 云端 Render 无本地图片目录时，以 DB 为主：用 PAGES_IMAGE_BASE_URL 构造图片 URL，避免产品被过滤
+        if not resolved and not files_for_resolve:
+            pages_base = getattr(self, 'pages_image_base_url', None) or (os.getenv('PAGES_IMAGE_BASE_URL', '') or '').strip().rstrip('/')
+            if pages_base:
+                _img = product_info.get('ruta_imagen_raw') or product_info.get('image_path') or product_info.get('ruta_imagen') or image_path or ''
+                if _img and isinstance(_img, str):
+                    _norm = _img.replace('\\', '/').strip()
+                    if _img.startswith('/api/images/'):
+                        _rel = _normalize_image_filename(_img.replace('/api/images/', '').split('?')[0].strip())
+                    elif 'output_images' in _norm.lower() or 'product_images' in _norm.lower():
+                        # 保留相对路径，如 .../output_images/Importadora_Chinito/xxx.jpg -> Importadora_Chinito/xxx.jpg
+                        _lower = _norm.lower()
+                        for _key in ('output_images/', 'product_images/'):
+                            if _key in _lower:
+                                _rel = _norm[_lower.index(_key) + len(_key):].replace(' ', '%20')
+                                _rel = _normalize_image_filename(_rel)
+                                break
+                        else:
+                            _rel = _normalize_image_filename(os.path.basename(_norm))
+                    else:
+                        _rel = _normalize_image_filename(os.path.basename(_norm))
+                    if _rel and _rel.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
+                        _sub = 'Cristy/' if (product_info.get('codigo_proveedor') or '').strip().lower() == 'cristy' else ''
+                        resolved = pages_base + '/Ya%20Subio/' + _sub + _rel
+        # CHANGE: 云端无本地图时，即使 resolve 失败也保留产品（传 image_path 或空），前端会显示 Sin imagen，避免 180 产品只显示 4 个
+        if not resolved and not files_for_resolve and image_path:
+            resolved = image_path  # 保留 /api/images/xxx 供前端尝试加载
+        # 图片不在 D:\Ya Subio 内时为 None，不显示该产品
+        return resolved or None
+
+    def _listing_match_index(self, supplier_lower: str) -> ImageMatchIndex:
+        """列表图片匹配索引：supplier=others 用非 Cristy 图片，其余用（非 Cristy + Cristy）并集；每个图片 revision 只建一次"""
+        match_key = 'others' if supplier_lower == 'others' else 'merged'
+
+        def _build():
+            sets = self.image_index.listing_sets()
+            if match_key == 'others':
+                return ImageMatchIndex(sets['ya_subio_no_cristy'])
+            seen = set(sets['ya_subio_no_cristy'])
+            return ImageMatchIndex(list(sets['ya_subio_no_cristy']) + [f for f in sets['cristy'] if f not in seen])
+        return self.image_index.derived(('image_match', match_key), _build)
+
+    def _keyset_cursor_supported(self, supplier_lower: str) -> bool:
+        """?cursor= 只用于按产品行分页的视图；ULTIMO / PRODUCTOS 的「以图为准」列表按图片文件逐张列出（含库内无匹配的图），
+        无法按 (创建时间, id) 翻页，这两个视图有物化列表时只支持 page/limit"""
+        if supplier_lower not in ('cristy', 'others'):
+            return True
+        return self._image_first_listing(supplier_lower, self.catalog.get()) is None
+
+    def _get_products_keyset_page(self, supplier_lower: str, limit: int, cursor_token: Optional[str], page: int = 1,
+                                  category: Optional[str] = None) -> Optional[Tuple[List[Dict], Optional[str]]]:
+        """CHANGE: ?cursor= 分页：按 (创建时间, id) 分批查询，返回 (本页产品, next_cursor)。产品结构与 /api/products 列表一致。
+        可见性与 page/limit 相同：供应商白名单（other_supplier_codes）在 SQL 中过滤，图片不在可配置目录的产品
+        （_resolve_listing_image）跳过后继续取下一批，直到凑满 limit+1 个可见产品或没有更多行。
+        任一批查询失败返回 None：不能返回空页 + next_cursor=None，否则会被当作目录结束缓存下来。"""
+        after = _decode_products_cursor(cursor_token)
+        skip = 0 if after else max(0, (page - 1) * limit)
+        batch = max(limit + 1, KEYSET_SCAN_BATCH)
+        match_index = self._listing_match_index(supplier_lower)
+        files_for_resolve = match_index.files
+        visible: List[Tuple[Dict, Dict]] = []
+        while len(visible) <= limit:
+            if USE_SQLITE_FOR_PRODUCTS and self.db:
+                rows = self.db.get_products_page(batch, after=after, supplier=supplier_lower, category=category,
+                                                 whitelist=self.other_supplier_codes,
+                                                 exclude_prefixes=getattr(self, 'productos_exclude_file_prefixes', None))
+            else:
+                rows = self._get_products_page_from_postgres(supplier_lower, batch, after=after, category=category)
+            if rows is None:
+                return None
+            for row, item in zip(rows, self._page_rows_to_items(rows)):
+                info = {'image_path': item['image_path'], 'ruta_imagen_raw': row.get('image_path'),
+                        'codigo_proveedor': item['codigo_proveedor']}
+                resolved = self._resolve_listing_image(item['id'], info, match_index.resolve, files_for_resolve)
+                if not resolved:
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                item['image_path'] = resolved
+                visible.append((row, item))
+                if len(visible) > limit:
+                    break
+            if len(rows) < batch or not rows:
+                break
+            after = (rows[-1].get('created_at'), rows[-1].get('id_producto'))
+        has_more = len(visible) > limit
+        visible = visible[:limit]
+        items = [item for _, item in visible]
+        next_cursor = None
+        if has_more and visible:
+            last = visible[-1][0]
+            last_created = last.get('created_at')
+            if last_created is not None and hasattr(last_created, 'isoformat'):
+                last_created = last_created.isoformat()
+            next_cursor = _encode_products_cursor(last_created, last.get('id_producto'))
+        return items, next_cursor
+
+    @staticmethod
+    def _pg_any_id_candidates(product_id) -> List[str]:
+        """product_id 及其数字段（倒序，如 TG_JUGUETESFANG_90029 -> 90029），用于按 codigo_producto / id_producto 查询"""
+        pid_str = str(product_id).strip()
+        ids_to_try = [pid_str]
+        for n in reversed(re.findall(r'\d+', pid_str)):
+            if n and n not in ids_to_try:
+                ids_to_try.append(n)
+        return ids_to_try
+
+    def _pg_any_row_to_product(self, r) -> Dict:
+        """PG products 行 -> 详情/购物车补全用的产品 dict"""
+        try:
+            _r = {str(k).lower(): v for k, v in r.items()}
+        except Exception:
+            _r = dict(r)
+        created_at = _r.get('fecha_creacion')
+        if created_at is not None and hasattr(created_at, 'isoformat'):
+            created_at = created_at.isoformat()
+        ruta = self._format_image_path(str(_r.get('ruta_imagen') or ''), (_r.get('codigo_proveedor') or '').strip())
+        return {
+            'id': _r.get('id_producto'),
+            'name': (str(_r.get('nombre_producto') or '')).strip(),
+            'product_code': (str(_r.get('codigo_producto') or '')).strip(),
+            'price': float(_r.get('precio_unidad') or 0),
+            'wholesale_price': float(_r.get('precio_mayor') or 0),
+            'bulk_price': float(_r.get('precio_bulto') or 0),
+            'description': (str(_r.get('descripcion') or _r.get('description') or '')).strip(),
+            'category_id': (str(_r.get('categoria') or 'default')).strip(),
+            'image_path': ruta,
+            'stock': int(_r.get('inventario') or 0),
+            'codigo_proveedor': (_r.get('codigo_proveedor') or '').strip(),
+            'created_at': created_at or '',
+            'is_active': 1,
+        }
+
+    def _get_single_product_from_postgres_any(self, product_id: str) -> Optional[Dict]:
+        """从 PostgreSQL 按 id_producto/codigo_producto 查询单条产品（不限制 Cristy），供详情页/购物车/同步补全。
+        CHANGE: 不再过滤 esta_activo，确保其他供应商产品（可能未设或为 FALSE）也能查到 name/code。
+        CHANGE: 若完整 pid 查不到，提取数字部分（如 TG_JUGUETESFANG_90029 -> 90029）再查 id_producto，Neon 中其他供应商常用 id 当主键。"""
+        return self._get_products_from_postgres_any_bulk([product_id]).get(str(product_id).strip())
+
+    def _get_products_from_postgres_any_bulk(self, product_ids) -> Dict[str, Dict]:
+        """CHANGE: 批量版 _get_single_product_from_postgres_any：所有 product_id 及其数字回退候选合并为一次
+        WHERE codigo_producto = ANY(%s) OR id_producto::text = ANY(%s) 查询，避免购物车/下单/同步逐项查询（N+1）。
+        返回 {product_id(str): 产品 dict}，未找到的 id 不在结果中；每个 id 按候选顺序取第一个命中（codigo 优先于 id）。"""
+        # dict.fromkeys：按首次出现顺序去重，O(n)
+        pids = list(dict.fromkeys(p for p in (str(p or '').strip() for p in product_ids or []) if p))
+        if not pids:
+            return {}
+        pg_config = self._get_pg_config()
+        if not pg_config or not PSYCOPG2_AVAILABLE or psycopg2 is None:
+            return {}
+        candidates = {pid: self._pg_any_id_candidates(pid) for pid in pids}
+        all_ids = sorted({c for cands in candidates.values() for c in cands})
+        conn = None
+        try:
+            conn = self._pg_connect(pg_config)
+            if not conn:
+                return {}
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(
+                """
+                SELECT id_producto, codigo_producto, nombre_producto, descripcion,
+                       precio_unidad, precio_mayor, precio_bulto, categoria, ruta_imagen,
+                       inventario, codigo_proveedor, fecha_creacion, esta_activo
+                FROM products
+                WHERE codigo_producto = ANY(%s) OR id_producto::text = ANY(%s)
+                ORDER BY id_producto
+                """,
+                (all_ids, all_ids),
+            )
+            rows = cur.fetchall()
+            cur.close()
         except Exception as e:
-            logger.warning(f"⚠️ PostgreSQL 单产品(any)查询失败 product_id={product_id}: {e}")
-            return None
+            logger.warning(f"⚠️ PostgreSQL 产品批量(any)查询失败 product_ids={pids[:10]}: {e}")
+            return {}
         finally:
             if conn:
-                try:
-                    conn.close()
-                except Exception:
-                    pass
+                conn.close()
+        by_code, by_id = {}, {}
+        for r in rows:
+            _r = {str(k).lower(): v for k, v in r.items()}
+            _code = (str(_r.get('codigo_producto') or '')).strip()
+            if _code and _code not in by_code:
+                by_code[_code] = r
+            _iid = str(_r.get('id_producto')) if _r.get('id_producto') is not None else ''
+            if _iid and _iid not in by_id:
+                by_id[_iid] = r
+        out = {}
+        for pid in pids:
+            for try_id in candidates[pid]:
+                r = by_code.get(try_id) or by_id.get(try_id)
+                if r is None:
+                    continue
+                product = self._pg_any_row_to_product(r)
+                if try_id != pid:
+                    logger.info("📋 [PG any] 用数字 id=%s 匹配到 product_id=%s", try_id, pid)
+                logger.info("📋 [PG any] 找到 product_id=%s -> codigo=%s, nombre=%s", pid, product['product_code'], (product['name'] or "")[:50])
+                out[pid] = product
+                break
+            else:
+                logger.debug("📋 [PG any] 未找到 product_id=%s（已尝试 %s）", pid, candidates[pid])
+        return out
 
     def _sync_products_to_web(self, clear_cache=False):
         """将 Telegram/主程序 数据库同步到网页文件夹（与 pwa_cart/同步数据库.py 逻辑一致）。
@@ -1436,7 +2245,7 @@ class PWACartAPIServer:
             index_path = os.path.join(self.app.static_folder, 'index.html') if (self.app and self.app.static_folder) else ''
             if not self.app or not self.app.static_folder or not (os.path.exists(index_path) and os.path.isfile(index_path)):
                 return redirect(os.getenv('PAGES_IMAGE_BASE_URL', 'https://ventax.pages.dev/pwa_cart').rstrip('/') + '/', code=302)
-            return send_from_directory(self.app.static_folder, 'index.html')
+            return self.compressor.send_static(self.app.static_folder, 'index.html')
         
         @self.app.route('/favicon.ico')
         def favicon():
@@ -1510,7 +2319,8 @@ class PWACartAPIServer:
                     response = send_from_directory(self.app.static_folder, filename)
                     response.headers['Content-Type'] = 'image/svg+xml; charset=utf-8'
                     return response
-                return send_from_directory(self.app.static_folder, filename)
+                # CHANGE: app.js / styles.css 等按 mtime 预压缩缓存（br/gzip 协商）
+                return self.compressor.send_static(self.app.static_folder, filename)
             else:
                 abort(404)
         
@@ -1546,77 +2356,27 @@ class PWACartAPIServer:
                 if _base_no_ext and any(_base_no_ext.startswith(p) for p in _excl):
                     return jsonify({"error": "excluded", "hint": "productos_exclude_file_prefixes"}), 404
             
-            def _find_file_recursive(root_dir, target_name, max_depth=10, _depth=0, exclude_subdirs=None):
-                if _depth >= max_depth:
-                    return None
-                exclude_subdirs = exclude_subdirs or []
-                try:
-                    for item in os.listdir(root_dir):
-                        item_path = os.path.join(root_dir, item)
-                        if os.path.isfile(item_path):
-                            if item.lower() == target_name.lower():
-                                return item_path
-                            if os.path.splitext(item)[0].lower() == os.path.splitext(target_name)[0].lower():
-                                return item_path
-                        elif os.path.isdir(item_path) and item not in exclude_subdirs:
-                            r = _find_file_recursive(item_path, target_name, max_depth, _depth + 1, exclude_subdirs)
-                            if r:
-                                return r
-                except (PermissionError, OSError, Exception):
-                    pass
-                return None
-            
-            # CHANGE: ULTIMO 产品图片固定从 pwa_cart/Ya Subio/Cristy 读取，优先在该目录查找
-            if os.path.isdir(ULTIMO_IMAGE_DIR):
-                for try_name in (base_filename, base_filename_clean):
-                    if not try_name:
-                        continue
-                    p = os.path.join(ULTIMO_IMAGE_DIR, try_name)
-                    if os.path.isfile(p):
-                        return send_from_directory(ULTIMO_IMAGE_DIR, try_name)
-                found_ultimo = _find_file_recursive(ULTIMO_IMAGE_DIR, base_filename)
-                if not found_ultimo and base_filename_clean != base_filename:
-                    found_ultimo = _find_file_recursive(ULTIMO_IMAGE_DIR, base_filename_clean)
-                if found_ultimo:
-                    return send_from_directory(os.path.dirname(found_ultimo), os.path.basename(found_ultimo))
-            # CHANGE: 遍历所有 product_image_dirs（含 output_images），使 PRODUCTOS 能提供其他供应商图
-            _all_dirs = getattr(self, 'product_image_dirs', None) or [PWA_YA_SUBIO_BASE]
-            image_dirs = list(_all_dirs) if _all_dirs else [PWA_YA_SUBIO_BASE]
-            for images_dir in image_dirs:
-                if not os.path.isdir(images_dir):
-                    continue
-                # 1) 优先在 Cristy 子文件夹内查找，确保 ULTIMO 页只显示 Cristy 内图片
-                cristy_sub = os.path.join(images_dir, 'Cristy')
-                if os.path.isdir(cristy_sub):
-                    for try_name in (base_filename, base_filename_clean):
-                        if not try_name:
-                            continue
-                        p = os.path.join(cristy_sub, try_name)
-                        if os.path.isfile(p):
-                            logger.info(f"✅ 图片（Cristy 子文件夹）: {p}")
-                            return send_from_directory(cristy_sub, try_name)
-                    found_in_cristy = _find_file_recursive(cristy_sub, base_filename)
-                    if not found_in_cristy and base_filename_clean != base_filename:
-                        found_in_cristy = _find_file_recursive(cristy_sub, base_filename_clean)
-                    if found_in_cristy:
-                        logger.info(f"✅ 图片（Cristy 子文件夹）: {found_in_cristy}")
-                        return send_from_directory(os.path.dirname(found_in_cristy), os.path.basename(found_in_cristy))
-                # 2) 根目录及非 Cristy 子文件夹（排除 Cristy，避免同名时用到根目录图）
-                for try_name in (base_filename, base_filename_clean):
-                    if not try_name:
-                        continue
-                    p = os.path.join(images_dir, try_name)
-                    if os.path.isfile(p):
-                        logger.info(f"✅ 图片（可配置目录根）: {p}")
-                        return send_from_directory(images_dir, try_name)
-                found_path = _find_file_recursive(images_dir, base_filename, exclude_subdirs=['Cristy'])
-                if not found_path and base_filename_clean != base_filename:
-                    found_path = _find_file_recursive(images_dir, base_filename_clean, exclude_subdirs=['Cristy'])
-                if found_path:
-                    found_dir = os.path.dirname(found_path)
-                    found_file = os.path.basename(found_path)
-                    logger.info(f"✅ 图片（可配置目录子文件夹）: {found_path}")
-                    return send_from_directory(found_dir, found_file)
+            # CHANGE: 查找顺序与原递归查找一致，但读自 ImageIndex（主名大小写/扩展名不敏感映射 + 未命中负缓存），
+            # 不再对每个目录递归 listdir；缺图请求最多一次 dict 查询即落到 R2 重定向或 404
+            # 1) ULTIMO 产品图片固定从 pwa_cart/Ya Subio/Cristy 读取，优先在该目录查找
+            # 2) 遍历所有 product_image_dirs（含 output_images）：先 Cristy 子文件夹，再根目录及非 Cristy 子文件夹（避免同名时用到根目录图）
+            image_dirs = getattr(self, 'product_image_dirs', None) or [PWA_YA_SUBIO_BASE]
+            found_path = self.image_index.find((base_filename, base_filename_clean), self._image_trees)
+            if found_path:
+                logger.debug(f"✅ 图片: {found_path}")
+                # CHANGE: ?w=320&fmt=webp 时返回缩放重编码的变体：先查预生成清单，再在线生成（Pillow 不可用或生成失败时返回原图）
+                if request.args.get('w'):
+                    _w = self.image_variants.normalize_width(request.args.get('w'))
+                    _fmt = self.image_variants.normalize_format(request.args.get('fmt'))
+                    variant = (self.image_manifest.get(found_path, _w, _fmt) or
+                               self.image_variants.get(found_path, _w, _fmt))
+                    if variant:
+                        resp = self._send_product_image(variant[0], mimetype=variant[1], etag=variant[2][:20], source=found_path)
+                        if resp is not None:
+                            return resp
+                resp = self._send_product_image(found_path)
+                if resp is not None:
+                    return resp
             
             # 未在可配置目录中找到；若配置了 R2_IMAGE_BASE_URL 则重定向到 R2（Render 上无本地 Ya Subio 时用）
             r2_base = getattr(self, 'r2_image_base_url', None) or (os.getenv('R2_IMAGE_BASE_URL', '') or '').strip().rstrip('/')
@@ -1667,7 +2427,14 @@ class PWACartAPIServer:
                 "status": "healthy",
                 "service": "API del carrito PWA",
                 "timestamp": datetime.now().isoformat(),
-                "database": "connected" if self.db else "disconnected"
+                "database": "connected" if self.db else "disconnected",
+                "catalog": self.catalog.stats(),
+                "pg_pool": all_pool_stats(),
+                "sqlite_connections": self.db.connection_stats() if hasattr(self.db, 'connection_stats') else None,
+                "api_cache": _API_CACHE.stats(),
+                "listing_pages": self.listing_pages.stats(),
+                "compression": self.compressor.stats(),
+                "json_encoder": self.app.json.backend,
             })
 
         @self.app.route('/api/debug-images')
@@ -1682,37 +2449,23 @@ class PWACartAPIServer:
                 "first_product_image_paths": [],
                 "sample_image_url": None,
             }
-            def _list_image_files_recursive(root_dir, max_depth=10, _depth=0):
-                if _depth >= max_depth:
-                    return []
-                out_list = []
-                try:
-                    for name in os.listdir(root_dir):
-                        try:
-                            p = os.path.join(root_dir, name)
-                            if os.path.isfile(p) and name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                                out_list.append(name)
-                            elif os.path.isdir(p):
-                                out_list.extend(_list_image_files_recursive(p, max_depth, _depth + 1))
-                        except OSError:
-                            continue
-                except (OSError, Exception):
-                    pass
-                return out_list
+            # CHANGE: 文件名读自 ImageIndex，不再递归 listdir
             for _d in image_dirs:
                 exists = os.path.isdir(_d)
-                count = len(_list_image_files_recursive(_d)) if exists else 0
+                count = len(self.image_index.files(_d)) if exists else 0
                 out["dirs_status"].append({"path": _d, "exists": exists, "image_count": count})
                 out["total_image_file_count"] += count
             files = []
             for _d in image_dirs:
                 if os.path.isdir(_d):
-                    files.extend(_list_image_files_recursive(_d))
+                    files.extend(self.image_index.files(_d))
+            out["image_index"] = self.image_index.stats()
+            out["image_variants"] = {"cache": self.image_variants.stats(), "manifest": self.image_manifest.stats()}
             # 去重保留首次出现（与 get_products 中 _files_ya_subio 一致）
             seen = set()
             files = [f for f in files if f not in seen and not seen.add(f)]
             if self.db or not USE_SQLITE_FOR_PRODUCTS:
-                products = self.db.get_all_products() if (USE_SQLITE_FOR_PRODUCTS and self.db) else self._get_products_dict_from_postgres()
+                products = self.catalog.get().products
                 products_to_list = list(products.items())[:5]
                 import re
                 def _resolve(pid, img_path):
@@ -1788,6 +2541,8 @@ class PWACartAPIServer:
                 clear_cache = True
             ok, msg = self._sync_products_to_web(clear_cache=clear_cache)
             if ok:
+                # CHANGE: 同步后立即刷新产品目录快照，刷新网页即可看到最新内容
+                self.catalog.refresh(force=True)
                 base_dir = os.path.dirname(os.path.abspath(__file__))
                 source_db = os.path.abspath(os.path.join(base_dir, '..', 'database', 'spanish_product_database.db'))
                 target_db = os.path.abspath(os.path.join(base_dir, 'pwa_cart', 'spanish_product_database.db'))
@@ -1814,6 +2569,7 @@ class PWACartAPIServer:
             pg_ok = self._use_pg_for_users()
             user_count = 0
             if pg_ok:
+                conn = None
                 try:
                     pg_cfg = self._get_pg_config()
                     if pg_cfg and PSYCOPG2_AVAILABLE:
@@ -1823,9 +2579,12 @@ class PWACartAPIServer:
                             cur.execute("SELECT COUNT(*) FROM pwa_users")
                             user_count = cur.fetchone()[0] or 0
                             cur.close()
-                            conn.close()
                 except Exception as e:
                     logger.warning(f"db-status 查询失败: {e}")
+                finally:
+                    # CHANGE: 连接来自连接池，异常时也要归还
+                    if conn:
+                        conn.close()
             return jsonify({
                 "postgresql_configured": pg_ok,
                 "pwa_users_count": user_count,
@@ -2159,14 +2918,14 @@ class PWACartAPIServer:
                 return jsonify({"success": False, "error": str(e)}), 500
         
         @self.app.route('/api/products', methods=['GET'])
-        @_cached_api_response(
-            lambda r: f"products_{r.args.get('supplier') or ''}_{r.args.get('search') or ''}_{r.args.get('page',1)}_{r.args.get('limit',30)}",
-            _API_CACHE_TTL_PRODUCTS
-        )
+        # CHANGE: ETag 由目录快照版本 + 图片 revision + 查询参数得出，未变化时 304
+        @_cached_api_response('products', _API_CACHE_TTL_PRODUCTS, _API_CACHE_SWR_SECONDS, catalog_tag=self._catalog_tag)
         def get_products():
             """获取产品列表 - 按新到旧排序，只显示激活的产品"""
             category = request.args.get('category', None)
             search = request.args.get('search', None)
+            band = (request.args.get('price_band') or '').strip() or None  # CHANGE: 价格区间筛选（取值见 facets.price_band）
+            sort_mode = (request.args.get('sort') or '').strip().lower()  # CHANGE: sort=relevance 时搜索结果按相关度排序
             supplier = request.args.get('supplier', None)  # CHANGE: 支持 supplier 参数筛选
             logger.info(f"📥 [API] 收到 /api/products 请求 supplier={supplier!r}, search={search!r}")
             print(f"📥 [API] 收到 /api/products 请求 supplier={supplier!r}, search={search!r}")
@@ -2178,20 +2937,91 @@ class PWACartAPIServer:
                 supplier_lower = (supplier or '').strip().lower()  # 统一小写比较，避免 Others/others 等导致走错分支
                 page = int(request.args.get('page', 1))
                 limit = int(request.args.get('limit', 30))  # 默认返回30个产品
+                # CHANGE: 带 ?cursor= 时走 SQL keyset 分页（cursor 为空表示第一页），每页只查 limit 行，不加载整个目录
+                if 'cursor' in request.args and not (search and str(search).strip()):
+                    limit = max(1, min(limit, 500))
+                    if not self._keyset_cursor_supported(supplier_lower):
+                        return jsonify({
+                            "success": False,
+                            "error": "La paginación con cursor no está disponible para esta vista; use page y limit",
+                        }), 400
+                    keyset_page = self._get_products_keyset_page(
+                        supplier_lower, limit, request.args.get('cursor') or None, page, category
+                    )
+                    if keyset_page is None:
+                        # 数据库暂时不可用：返回 503（success=False 不会进入响应缓存），客户端稍后重试同一 cursor
+                        resp = jsonify({
+                            "success": False,
+                            "error": "No se pudo cargar la página de productos, intente de nuevo",
+                        })
+                        resp.status_code = 503
+                        resp.headers['Retry-After'] = '5'
+                        return resp
+                    items, next_cursor = keyset_page
+                    logger.info(f"📦 [API] keyset 分页: supplier={supplier!r}, 本页 {len(items)} 个, next_cursor={'有' if next_cursor else '无'}")
+                    self._add_image_versions(items)
+                    resp = jsonify({
+                        "success": True,
+                        "data": items,
+                        "pagination": {
+                            "page": page,
+                            "limit": limit,
+                            "cursor": request.args.get('cursor') or None,
+                            "next_cursor": next_cursor,
+                            "has_more": bool(next_cursor),
+                        }
+                    })
+                    # 直接读库、不随目录快照版本变化：不让代理层缓存（_cached_api_response 保留视图的 no-store）
+                    resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate'
+                    resp.headers['Pragma'] = 'no-cache'
+                    resp.headers['X-Image-Logic'] = 'db-keyset'
+                    return resp
+                # CHANGE: PWA_SEARCH_BACKEND=db 时搜索在数据库执行，只取本页；失败/不可用时继续走下方进程内搜索
+                if search and str(search).strip() and self.search_backend != 'memory' and sort_mode != 'relevance':
+                    limit = max(1, min(limit, 500))
+                    db_page = self._search_products_db_page(str(search), max(1, page), limit, category)
+                    if db_page is not None:
+                        items, total = db_page
+                        logger.info(f"🔎 [API] 数据库搜索({self.search_backend}): search={search!r}, 共 {total} 个, 本页 {len(items)} 个")
+                        self._add_image_versions(items)
+                        resp = jsonify({
+                            "success": True,
+                            "data": items,
+                            "pagination": {
+                                "page": page,
+                                "limit": limit,
+                                "total": total,
+                                "total_pages": (total + limit - 1) // limit if total else 1
+                            }
+                        })
+                        # 同 cursor 分页：直接读库，保留 no-store
+                        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate'
+                        resp.headers['Pragma'] = 'no-cache'
+                        resp.headers['X-Image-Logic'] = 'db-search'
+                        resp.headers['X-Search-Backend'] = self.search_backend
+                        return resp
                 # CHANGE: 移除 supplier=others 早期返回空，让 PRODUCTOS 按「DB 为主 + 图片在 D:\Ya Subio 匹配」正常显示
-                # 获取所有产品（暂时註销 SQLite 时仅用 PostgreSQL）
-                if USE_SQLITE_FOR_PRODUCTS and self.db:
-                    products = self.db.get_all_products()
-                else:
-                    products = self._get_products_dict_from_postgres()
-                logger.info(f"📦 [API] 已从 PG 加载产品数: {len(products)}")
-                print(f"📦 [API] 已从 PG 加载产品数: {len(products)}")
-                
+                # CHANGE: 产品读自内存目录快照（后台定时从 PG 刷新），不再每次请求全表查询
+                _snap = self.catalog.get()
+                products = _snap.products
+                logger.info(f"📦 [API] 产品目录快照 v{_snap.version} 产品数: {len(products)}")
+                print(f"📦 [API] 产品目录快照 v{_snap.version} 产品数: {len(products)}")
+
+                # CHANGE: supplier=Cristy / others 且无搜索时以图为准：整份有序列表已按（快照版本, 图片 revision）物化为分页字节串，
+                # 本次请求只做下标查找 + 拼接 pagination/facets（category / price_band 时取同样物化的子列表）；有 search 时跳过，强制走 filtered_with_meta 确保搜索过滤
+                if supplier_lower in ('cristy', 'others') and not (search and str(search).strip()) and page >= 1 and limit >= 1:
+                    _listing = self._image_first_listing(supplier_lower, _snap)
+                    if _listing is not None:
+                        logger.info(f"📄 [API] {'ULTIMO' if supplier_lower == 'cristy' else 'PRODUCTOS'} 以图为准（物化分页）: 共 {_listing.total} 个，第 {page} 页")
+                        resp = self._listing_page_response(_listing, page, limit, category, band)
+                        resp.headers['X-Image-Logic'] = 'cristy-image-first' if supplier_lower == 'cristy' else 'productos-image-first'
+                        return resp
+
                 # CHANGE: 自家产品标识 - 使用 codigo_proveedor = 'Cristy'
                 OWN_SUPPLIER_CODE = 'Cristy'
                 
                 # CHANGE: 已移除 PRODUCTOS 日期过滤（日期应以图片上传之时起计，DB created_at 非图传时间）
-                cristy_from_pg = self._get_ultimo_products_from_postgres()
+                cristy_from_pg = _snap.cristy
                 cristy_products, all_filtered_products, skipped_by_date, skipped_cristy_by_stock = self._filter_products_cristy_and_others(
                     products, cristy_from_pg, None, OWN_SUPPLIER_CODE
                 )
@@ -2255,90 +3085,19 @@ class PWACartAPIServer:
                     logger.info(f"🔍 [API] 搜索模式：使用全量产品并集共 {len(products_to_process)} 个产品进行搜索（含被日期过滤的）")
                     print(f"🔍 [API] 搜索模式：使用全量产品并集共 {len(products_to_process)} 个产品进行搜索")
                 
-                # CHANGE: 图片文件名从可配置目录（port_config.json pwa_cart.product_image_dirs）递归收集，与 serve_product_image 一致
-                # NOTE: re 已在文件顶部 import，此处不再 import 避免 _norm_code 等闭包在 import 前被调用时报错
-                def _list_image_files_recursive(root_dir, max_depth=10, _depth=0):
-                    """递归收集 root_dir 及其子文件夹内的图片文件名（仅 basename）"""
-                    if _depth >= max_depth:
-                        return []
-                    out = []
-                    try:
-                        for name in os.listdir(root_dir):
-                            try:
-                                p = os.path.join(root_dir, name)
-                                if os.path.isfile(p):
-                                    if name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                                        out.append(name)
-                                elif os.path.isdir(p):
-                                    out.extend(_list_image_files_recursive(p, max_depth, _depth + 1))
-                            except OSError:
-                                continue
-                    except (OSError, Exception):
-                        pass
-                    return out
-                # CHANGE: PRODUCTOS 用 D:\Ya Subio（排除 Cristy 子文件夹）；ULTIMO 固定从 D:\Ya Subio\Cristy 读取
-                _all_dirs = getattr(self, 'product_image_dirs', None) or [PWA_YA_SUBIO_BASE]
-                _processed_dir = _all_dirs[0] if _all_dirs else PWA_YA_SUBIO_BASE
-                _cristy_subdir = ULTIMO_IMAGE_DIR if os.path.isdir(ULTIMO_IMAGE_DIR) else os.path.join(_processed_dir, 'Cristy')
-
-                def _list_image_files_recursive_exclude(root_dir, exclude_subdirs, max_depth=10, _depth=0):
-                    """递归收集图片文件名，跳过 exclude_subdirs 中的子文件夹名"""
-                    if _depth >= max_depth:
-                        return []
-                    out = []
-                    try:
-                        for name in os.listdir(root_dir):
-                            try:
-                                p = os.path.join(root_dir, name)
-                                if os.path.isfile(p):
-                                    if name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                                        out.append(name)
-                                elif os.path.isdir(p) and name not in exclude_subdirs:
-                                    out.extend(_list_image_files_recursive_exclude(p, exclude_subdirs, max_depth, _depth + 1))
-                            except OSError:
-                                continue
-                    except (OSError, Exception):
-                        pass
-                    return out
-
-                _files_ya_subio_no_cristy = []
-                _files_ya_subio_only = []  # CHANGE: 仅 pwa_cart/Ya Subio（排除 Cristy），供 PRODUCTOS 严格「以 DB 为主 + 图在 Ya Subio 匹配」
-                _files_cristy = []
-                try:
-                    _seen_basenames = set()
-                    for _d in _all_dirs:
-                        if not os.path.isdir(_d):
-                            continue
-                        _is_ya_subio = 'Ya Subio' in _d or os.path.basename(_d.rstrip(os.sep)) == 'Ya Subio'
-                        if _is_ya_subio:
-                            _lst = _list_image_files_recursive_exclude(_d, ['Cristy'])
-                            for _f in _lst:
-                                if _f not in _seen_basenames:
-                                    _seen_basenames.add(_f)
-                                    _files_ya_subio_no_cristy.append(_f)
-                                    _files_ya_subio_only.append(_f)
-                        else:
-                            # product_images、output_images 等：只加入 _files_ya_subio_no_cristy（供 serve_product_image 等），不加入 _files_ya_subio_only
-                            _lst = _list_image_files_recursive(_d)
-                            for _f in _lst:
-                                if _f not in _seen_basenames:
-                                    _seen_basenames.add(_f)
-                                    _files_ya_subio_no_cristy.append(_f)
-                    if os.path.isdir(_cristy_subdir):
-                        _files_cristy = _list_image_files_recursive(_cristy_subdir)
-                except (OSError, Exception):
-                    pass
-                # CHANGE: ULTIMO 时若 _files_cristy 为空，尝试回退到固定路径 ULTIMO_IMAGE_DIR
+                # CHANGE: 图片文件名读自 ImageIndex（可配置目录 port_config.json pwa_cart.product_image_dirs，与 serve_product_image 一致），
+                # 不再每次请求递归 listdir；PRODUCTOS 用 D:\Ya Subio（排除 Cristy 子文件夹）；ULTIMO 固定从 D:\Ya Subio\Cristy 读取
+                _image_sets = self.image_index.listing_sets()
+                # CHANGE: _files_ya_subio_only 仅 pwa_cart/Ya Subio（排除 Cristy），供 PRODUCTOS 严格「以 DB 为主 + 图在 Ya Subio 匹配」
+                _files_ya_subio_no_cristy = list(_image_sets['ya_subio_no_cristy'])
+                _files_ya_subio_only = list(_image_sets['ya_subio_only'])
+                _files_cristy = list(_image_sets['cristy'])
+                _processed_dir = self.image_index.roots[0] if self.image_index.roots else PWA_YA_SUBIO_BASE
+                _cristy_subdir = self.image_index.cristy_dir() or os.path.join(_processed_dir, 'Cristy')
                 _is_cristy_request = supplier and (supplier == OWN_SUPPLIER_CODE or (isinstance(supplier, str) and supplier.strip().lower() == OWN_SUPPLIER_CODE.lower()))
-                if _is_cristy_request and not _files_cristy and os.path.isdir(ULTIMO_IMAGE_DIR):
-                    try:
-                        _files_cristy = _list_image_files_recursive(ULTIMO_IMAGE_DIR)
-                        logger.info(f"📷 [API] ULTIMO 使用回退路径 Cristy: 共 {len(_files_cristy)} 张图")
-                        print(f"📷 [API] ULTIMO 使用回退路径 Cristy: 共 {len(_files_cristy)} 张图")
-                    except (OSError, Exception):
-                        pass
                 # 按 supplier 选择图片列表（仅影响日志）；CHANGE: 过滤与解析统一用「D:\Ya Subio + D:\Ya Subio\Cristy」并集，只显示两目录任一有对应图的产品
-                _files_ya_subio_merged = _files_ya_subio_no_cristy + [f for f in _files_cristy if f not in _files_ya_subio_no_cristy]
+                _no_cristy_set = set(_files_ya_subio_no_cristy)
+                _files_ya_subio_merged = _files_ya_subio_no_cristy + [f for f in _files_cristy if f not in _no_cristy_set]
                 if _is_cristy_request:
                     logger.info(f"📷 [API] ULTIMO 使用 D:\\Ya Subio\\Cristy: 共 {len(_files_cristy)} 张图")
                     print(f"📷 [API] ULTIMO 使用 Cristy 目录: 共 {len(_files_cristy)} 张图")
@@ -2358,433 +3117,58 @@ class PWACartAPIServer:
                 elif _files_ya_subio:
                     print(f"📷 [API] 图片文件名样本(前15): {_files_ya_subio[:15]}")
 
-                # CHANGE: supplier=Cristy 时以图为准：先遍历图片文件夹，用文件名解析 product_id，再查库填 name/price，保证一图一产品数据不错位
-                # CHANGE: 有 search 时强制走 filtered_with_meta 逻辑，确保搜索过滤生效
-                _skip_image_first = bool(search and str(search).strip())
-                print(f"📷 [API] Cristy 检查: _is_cristy_request={_is_cristy_request}, len(cristy_products)={len(cristy_products)}, len(_files_cristy)={len(_files_cristy)}, _cristy_subdir={_cristy_subdir!r}, _skip_image_first={_skip_image_first}")
-                if not _skip_image_first and _is_cristy_request and len(cristy_products) > 0 and len(_files_cristy) > 0:
-                    _lookup = {}
-                    for _pid, _pinfo in cristy_products:
-                        _key = (str(_pid).strip().lower() if _pid else '').strip()
-                        if not _key:
-                            continue
-                        _lookup[_key] = (_pid, _pinfo)
-                        _lookup[_normalize_base_ai_al(_key)] = (_pid, _pinfo)
-                        # 图片可能为 10060.jpg、10060._AI.jpg；用「去掉 ._ai 后缀」作 key 便于匹配
-                        _prefix = re.sub(r'[._\-]*(?:ai|al)$', '', _key.strip(), flags=re.IGNORECASE).strip()
-                        if _prefix and _prefix != _key:
-                            _lookup[_prefix] = (_pid, _pinfo)
-                        # 纯数字段（如 10060）也登记，便于 10060.jpg 匹配 10060._AI
-                        _nums = re.findall(r'^\d+', _key)
-                        if _nums:
-                            _lookup[_nums[0]] = (_pid, _pinfo)
-                    _image_first_list = []
-                    for _f in _files_cristy:
-                        _base = os.path.splitext(_f)[0].strip()
-                        _base_lower = _base.lower()
-                        _base_norm = _normalize_base_ai_al(_base_lower)
-                        _pair = (_lookup.get(_base_norm) or _lookup.get(_base_lower) or _lookup.get(_base) or
-                                 _lookup.get(re.sub(r'[._\-]*(?:ai|al)$', '', _base_lower, flags=re.IGNORECASE).strip()))
-                        if not _pair:
-                            _lead_digits = re.findall(r'^\d+', _base_lower)
-                            if _lead_digits:
-                                _pair = _lookup.get(_lead_digits[0])
-                        if _pair:
-                            _pid, _pinfo = _pair
-                            _created = _pinfo.get('created_at', '')
-                            _image_first_list.append((_pid, _pinfo, _created, '/api/images/' + _f, _base))
-                        else:
-                            # CHANGE: 即使库内无匹配，也按图片文件名显示一卡，避免错用其他产品数据
-                            _image_first_list.append((_base, {'name': _base, 'product_code': _base, 'price': 0, 'wholesale_price': 0, 'bulk_price': 0, 'description': '', 'created_at': '', 'category_id': 'default', 'channel_username': '', 'codigo_proveedor': 'Cristy'}, '', '/api/images/' + _f, _base))
-                    _image_first_list.sort(key=lambda x: x[2], reverse=True)
-                    _total_cristy = len(_image_first_list)
-                    _start = (page - 1) * limit
-                    _end = _start + limit
-                    _slice = _image_first_list[_start:_end]
-                    paginated_products = []
-                    for _row in _slice:
-                        _pid, _pinfo, _created, _img_path = _row[0], _row[1], _row[2], _row[3]
-                        _base_from_image = _row[4] if len(_row) > 4 else (os.path.splitext(_img_path.split('/')[-1])[0] if _img_path else '')
-                        # CHANGE: 展示用 product_code 以图片文件名为准，保证页上代码与图片一致；id 保持库内 id 便于加购
-                        _code = (_pinfo.get('product_code') or _pinfo.get('codigo_producto') or _pid)
-                        if hasattr(_code, 'strip'):
-                            _code = (_code or '').strip()
-                        else:
-                            _code = str(_code or '').strip()
-                        _display_code = (_base_from_image.strip() if (_base_from_image and getattr(_base_from_image, 'strip')) else _base_from_image) or _code or str(_pid)
-                        # CHANGE: 名称优先用 DB，空时才用展示码
-                        _db_name = (_pinfo.get('name', '') or '').strip()
-                        _display_name = _db_name if _db_name else (_display_code or '')
-                        _pu = float(_pinfo.get('price') or 0)
-                        _pm = float(_pinfo.get('wholesale_price') or 0)
-                        _pb = float(_pinfo.get('bulk_price') or 0)
-                        _display_price = _pm if _pm > 0 else (_pu if _pu > 0 else _pb)
-                        # CHANGE: price 必须为单价(precio_unidad)，供弹窗/加购按数量 1-2 单价/3-11 批发/12+ 批量 正确计算
-                        paginated_products.append({
-                            'id': _pid,
-                            'product_code': _display_code,
-                            'name': _display_name,
-                            'price': _pu,
-                            'wholesale_price': _pinfo.get('wholesale_price', 0),
-                            'bulk_price': _pinfo.get('bulk_price', 0),
-                            'description': _pinfo.get('description', ''),
-                            'image_path': _img_path,
-                            'category': _pinfo.get('category_id', 'default'),
-                            'created_at': _created,
-                            'channel_username': _pinfo.get('channel_username', ''),
-                            'codigo_proveedor': _pinfo.get('codigo_proveedor', '')
-                        })
-                    for i, p in enumerate(paginated_products[:3]):
-                        print(f"   [Cristy图为准] 产品[{i}] id={p.get('id')} name={p.get('name')[:40] if p.get('name') else ''} price={p.get('price')} image={p.get('image_path', '')[:60]}")
-                    total_filtered = _total_cristy
-                    resp = jsonify({
-                        "success": True,
-                        "data": paginated_products,
-                        "pagination": {
-                            "page": page,
-                            "limit": limit,
-                            "total": total_filtered,
-                            "total_pages": (total_filtered + limit - 1) // limit if total_filtered else 1
-                        }
-                    })
-                    resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate'
-                    resp.headers['Pragma'] = 'no-cache'
-                    resp.headers['X-Image-Logic'] = 'cristy-image-first'
-                    return resp
-                # CHANGE: PRODUCTOS(supplier=others) 按「产品图片名称」查找映射：用全库 products 的 ruta_imagen 建 文件名->产品
-                # 使用 _files_ya_subio_no_cristy（含 Ya Subio + product_images + output_images），使新上传产品图能显示
-                # CHANGE: 有 search 时跳过「以图为准」分支，强制走 filtered_with_meta 确保搜索过滤
-                if not _skip_image_first and supplier_lower == 'others' and len(_files_ya_subio_no_cristy) > 0:
-                    # CHANGE: 合并 PostgreSQL 非Cristy 产品，避免仅存 PG 的产品（如 id_producto 1677/1678）无法映射
-                    _pg_others = self._get_others_products_from_postgres()
-                    for _pid, _pinfo in _pg_others:
-                        if _pid is None:
-                            continue
-                        products[_pid] = _pinfo
-                        _code = (_pinfo.get('product_code') or '').strip() or str(_pid)
-                        if _code:
-                            products[_code] = _pinfo
-                    # 用全库 products（含 PG 合并）按图片文件名建映射（仅按产品图片名称查找）
-                    # CHANGE: 多条产品指向同一图时「不覆盖」，保留第一个，避免名称错位漏洞
-                    _image_to_product = {}
-                    for _pid, _pinfo in products.items():
-                        _img = (_pinfo.get('image_path') or _pinfo.get('ruta_imagen') or '')
-                        if not _img:
-                            continue
-                        _img = (_img if isinstance(_img, str) else str(_img)).strip()
-                        if _img and (os.path.sep in _img or '/' in _img or '\\' in _img):
-                            _bn_raw = os.path.basename(_img.replace('/', os.path.sep).replace('\\', os.path.sep))
-                        else:
-                            _bn_raw = _img
-                        if not _bn_raw or not _bn_raw.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                            continue
-                        _bn_norm = _normalize_image_filename(_bn_raw)
-                        _key_norm = _bn_norm.lower()
-                        _key_raw = _bn_raw.lower()
-                        if _key_norm not in _image_to_product:
-                            _image_to_product[_key_norm] = (_pid, _pinfo)
-                        if _key_raw not in _image_to_product:
-                            _image_to_product[_key_raw] = (_pid, _pinfo)
-                    _image_first_others = []
-                    _excl_prefixes = getattr(self, 'productos_exclude_file_prefixes', None) or []
-                    for _f in _files_ya_subio_no_cristy:
-                        _base = os.path.splitext(_f)[0].strip()
-                        # CHANGE: 跳过未完成处理的产品（如 importadoraWoni 仅OCR未白底），避免 404 影响旧产品
-                        if _excl_prefixes and any(_base.lower().startswith(p) for p in _excl_prefixes):
-                            continue
-                        _fn_norm = _normalize_image_filename(_f)
-                        _pair = None
-                        if _fn_norm or _f:
-                            _pair = _image_to_product.get((_fn_norm or _f).lower()) or _image_to_product.get(_f.lower())
-                        if _pair:
-                            _pid, _pinfo = _pair
-                            if (_pinfo.get('codigo_proveedor') or '').strip().lower() == 'cristy':
-                                _pair = None
-                        if _pair:
-                            _pid, _pinfo = _pair
-                            _created = _pinfo.get('created_at', '')
-                            _image_first_others.append((_pid, _pinfo, _created, '/api/images/' + _f, _base))
-                        else:
-                            _image_first_others.append((_base, {'name': _base, 'product_code': _base, 'price': 0, 'wholesale_price': 0, 'bulk_price': 0, 'description': '', 'created_at': '', 'category_id': 'default', 'channel_username': '', 'codigo_proveedor': ''}, '', '/api/images/' + _f, _base))
-                    _image_first_others.sort(key=lambda x: x[2], reverse=True)
-                    _total_others = len(_image_first_others)
-                    _start = (page - 1) * limit
-                    _end = _start + limit
-                    _slice = _image_first_others[_start:_end]
-                    paginated_products = []
-                    for _row in _slice:
-                        _pid, _pinfo, _created, _img_path = _row[0], _row[1], _row[2], _row[3]
-                        _base_from_image = _row[4] if len(_row) > 4 else (os.path.splitext(_img_path.split('/')[-1])[0] if _img_path else '')
-                        _code = (_pinfo.get('product_code') or _pinfo.get('codigo_producto') or _pid)
-                        if hasattr(_code, 'strip'):
-                            _code = (_code or '').strip()
-                        else:
-                            _code = str(_code or '').strip()
-                        # CHANGE: 其他供应商展示用 codigo_producto（加密产品代码），不用图片文件名
-                        _display_code = _code or str(_pid)
-                        # CHANGE: 名称必须用 DB 的 nombre_producto/name，禁止用图片文件名
-                        _db_name = (_pinfo.get('name', '') or _pinfo.get('nombre_producto', '') or '').strip()
-                        _display_name = _db_name if _db_name else (_display_code or '')
-                        _pu = float(_pinfo.get('price') or 0)
-                        _pm = float(_pinfo.get('wholesale_price') or 0)
-                        _pb = float(_pinfo.get('bulk_price') or 0)
-                        paginated_products.append({
-                            'id': _pid,
-                            'product_code': _display_code,
-                            'name': _display_name,
-                            'price': _pu,
-                            'wholesale_price': _pinfo.get('wholesale_price', 0),
-                            'bulk_price': _pinfo.get('bulk_price', 0),
-                            'description': _pinfo.get('description', ''),
-                            'image_path': _img_path,
-                            'category': _pinfo.get('category_id', 'default'),
-                            'created_at': _created,
-                            'channel_username': _pinfo.get('channel_username', ''),
-                            'codigo_proveedor': _pinfo.get('codigo_proveedor', '')
-                        })
-                    logger.info(f"📦 [API] PRODUCTOS 以图为准: 共 {_total_others} 个，本页 {len(paginated_products)} 个，DB图关联数={len(_image_to_product)}")
-                    print(f"📦 [API] PRODUCTOS 以图为准: 共 {_total_others} 个，本页 {len(paginated_products)} 个，DB图关联数={len(_image_to_product)}")
-                    resp = jsonify({
-                        "success": True,
-                        "data": paginated_products,
-                        "pagination": {
-                            "page": page,
-                            "limit": limit,
-                            "total": _total_others,
-                            "total_pages": (_total_others + limit - 1) // limit if _total_others else 1
-                        }
-                    })
-                    resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate'
-                    resp.headers['Pragma'] = 'no-cache'
-                    resp.headers['X-Image-Logic'] = 'productos-image-first'
-                    return resp
-                else:
-                    paginated_products = None  # 走下方原有逻辑
-
-                def _file_base_matches_product(base_f, pid):
-                    """CHANGE: 仅当图片文件名（base）与产品标识一致时才算匹配，通过图片名字匹配不可能出错。"""
-                    if not pid:
-                        return False
-                    pid_str = (str(pid).strip().lower()).strip()
-                    base_s = (base_f if isinstance(base_f, str) else str(base_f)).strip().lower()
-                    if not pid_str or not base_s:
-                        return False
-                    norm_pid = _normalize_base_ai_al(pid_str)
-                    norm_base = _normalize_base_ai_al(base_s)
-                    return (norm_base == norm_pid or norm_pid in norm_base or norm_base in norm_pid)
-
-                def _message_id_from_name(name):
-                    """从 DB 文件名或 product_id 提取 message_id 数字，如 Importadora_Chinito_26820 -> 26820"""
-                    if not name:
-                        return None
-                    s = (name if isinstance(name, str) else str(name)).replace('-', '_').strip().lower()
-                    parts = s.split('_')
-                    # 原图片文件名格式 msg_{message_id}_{codigo}：取第二段为 message_id
-                    if len(parts) >= 2 and parts[0] == 'msg' and parts[1].isdigit() and len(parts[1]) >= 2:
-                        return parts[1]
-                    for p in reversed(parts):
-                        if p.isdigit() and len(p) >= 2:
-                            return p
-                    return None
+                # CHANGE: supplier=Cristy / others 的「以图为准」列表已在上方由物化分页（_image_first_listing）直接返回；
+                # 到这里说明有搜索关键词或该视图不适用（无产品/无图片），走下方通用逻辑
+
+                # CHANGE: 原 resolve_image_for_product 每个产品最多六次遍历整份图片列表；改为查 ImageMatchIndex
+                # （精确名/规范化主名/数字段/telegram、msg_ 前缀表 + 子串倒排），每个图片 revision 只建一次，结果与原规则一致
+                _match_index = self._listing_match_index(supplier_lower)
+                if _match_index.files != tuple(_files_for_resolve):
+                    # 图片索引在本请求中途刷新：以本次列出的文件为准临时建索引
+                    _match_index = ImageMatchIndex(_files_for_resolve)
+                resolve_image_for_product = _match_index.resolve
 
-                def resolve_image_for_product(pid, img_path):
-                    """CHANGE: 只通过图片名字与 product_id 匹配才返回，通过图片名字进行匹配不可能出错。supplier=others 时用 _files_for_resolve（非Cristy图）"""
-                    files = _files_for_resolve
-                    if not files:
-                        return ''
-                    mid = None  # 仅按图片名匹配，不再用 message_id 等
-                    # 1) 有 DB 路径：先精确匹配文件名，再尝试「从文件名抽 message_id -> telegram_<id>.jpg」
-                    if img_path:
-                        if img_path.startswith('/api/images/'):
-                            fname = _normalize_image_filename(img_path.replace('/api/images/', '').split('?')[0].strip())
-                        else:
-                            fname = _normalize_image_filename(os.path.basename(img_path.replace('/', os.sep).replace('\\', os.sep).strip()))
-                        if fname:
-                            base_db = os.path.splitext(fname)[0]
-                            for f in files:
-                                base_f = os.path.splitext(f)[0]
-                                # 匹配：product_id 与文件名一致，或 product 的 image_path 文件名与 file 一致（PRODUCTOS 产品用）
-                                if f.lower() == fname.lower():
-                                    if _file_base_matches_product(base_f, pid):
-                                        return f'/api/images/{f}'
-                                    if base_f.lower() == base_db.lower():
-                                        return f'/api/images/{f}'
-                            for f in files:
-                                base_f = os.path.splitext(f)[0]
-                                if (base_f.lower() == base_db.lower() or _normalize_base_ai_al(base_f) == _normalize_base_ai_al(base_db)) and _file_base_matches_product(base_f, pid):
-                                    return f'/api/images/{f}'
-                            for f in files:
-                                base_f = os.path.splitext(f)[0]
-                                if base_f.lower() == base_db.lower():
-                                    return f'/api/images/{f}'
-                    # 2) 只通过图片名字与 product_id 匹配：遍历文件，仅当文件名与产品一致才返回（不可能错配）
-                    if not mid and img_path:
-                        fname = _normalize_image_filename(os.path.basename(img_path.replace('/', os.path.sep).replace('\\', os.sep).strip())) if img_path.startswith('/api/images/') else _normalize_image_filename(os.path.basename(img_path.replace('/', os.path.sep).replace('\\', os.sep).strip()))
-                        base_db = os.path.splitext(fname)[0] if fname else ''
-                        mid = _message_id_from_name(base_db)
-                    if mid:
-                        tg_name = 'telegram_' + mid
-                        for f in files:
-                            base_f = os.path.splitext(f)[0]
-                            if base_f.lower() == tg_name and _file_base_matches_product(base_f, pid):
-                                return f'/api/images/{f}'
-                        for f in files:
-                            base_f = os.path.splitext(f)[0]
-                            if base_f.lower() == mid and _file_base_matches_product(base_f, pid):
-                                return f'/api/images/{f}'
-                        msg_prefix = 'msg_' + mid + '_'
-                        for f in files:
-                            base_f = os.path.splitext(f)[0]
-                            if base_f.lower().startswith(msg_prefix) and _file_base_matches_product(base_f, pid):
-                                return f'/api/images/{f}'
-                    # 3) D:\Ya Subio 内多为 importadoraWoni_115_no_white.jpg：用「数字段」匹配（文件名分段含该数字），优先前缀一致
-                    base_db = ''
-                    if img_path:
-                        fname = _normalize_image_filename(img_path.replace('/api/images/', '').split('?')[0].strip()) if img_path.startswith('/api/images/') else _normalize_image_filename(os.path.basename(img_path.replace('/', os.path.sep).replace('\\', os.sep).strip()))
-                        base_db = os.path.splitext(fname)[0] if fname else ''
-                    if not base_db and pid:
-                        base_db = str(pid).strip()
-                    num_to_try = mid
-                    if not num_to_try and base_db:
-                        parts_db = re.split(r'[_\-.\s]+', base_db.lower())
-                        for p in reversed(parts_db):
-                            if p.isdigit() and len(p) >= 2:
-                                num_to_try = p
-                                break
-                    if num_to_try:
-                        candidates = [f for f in files if num_to_try in re.split(r'[_\-.\s]+', os.path.splitext(f)[0].lower())]
-                        if candidates:
-                            if base_db:
-                                for f in candidates:
-                                    base_f = os.path.splitext(f)[0]
-                                    if (base_db.lower() in base_f.lower() or base_f.lower() in base_db.lower() or _normalize_base_ai_al(base_f) == _normalize_base_ai_al(base_db)) and _file_base_matches_product(base_f, pid):
-                                        return f'/api/images/{f}'
-                            for f in candidates:
-                                base_f = os.path.splitext(f)[0]
-                                if _file_base_matches_product(base_f, pid):
-                                    return f'/api/images/{f}'
-                    # 仅当图片文件名与 product_id 一致才返回（通过图片名字匹配不可能出错）
-                    for f in files:
-                        base_f = os.path.splitext(f)[0]
-                        if _file_base_matches_product(base_f, pid):
-                            return f'/api/images/{f}'
-                    return ''
-                
                 # CHANGE: 方案 A - 只显示「在 D:\Ya Subio 有图」的产品；要显示更多产品就把更多已处理图放入 D:\Ya Subio（且文件名能被现有匹配规则识别）
+                # CHANGE: 搜索改查目录快照上的倒排索引：每个查询一次求出命中集合（结果按查询缓存），循环内只做成员判断；
+                # 规则不变（只搜 nombre_producto、descripcion、product_code/id，多关键词 AND，代码精确相等直接命中，模糊相似度 >= 0.85），另外忽略重音
+                _search_index = None
+                _search_hits = frozenset()
+                if search:
+                    _search_index = self._catalog_search_index(_snap)
+                    _search_hits = _search_index.search(search)
                 filtered_with_meta = []
+                _search_matched_ids = [] if search else None
                 for product_id, product_info in products_to_process:
-                    if category and product_info.get('category_id') != category:
+                    if search and not _search_index.contains(_search_hits, search, product_id, product_info):
                         continue
-                    # CHANGE: 只搜索 nombre_producto、descripcion、product_code，大小写不敏感，模糊匹配收紧
                     if search:
-                        q_raw = str(search).strip().lower()
-                        keywords = [k.strip() for k in q_raw.split() if k.strip()]
-                        if not keywords:
-                            continue
-                        # 大小写不敏感：统一转小写；CHANGE: 增加 product_code、codigo、product_id 支持产品代码搜索
-                        name_s = (product_info.get('name') or product_info.get('nombre_producto') or '').lower()
-                        desc_s = (product_info.get('description') or product_info.get('descripcion') or '').lower()
-                        code_s = (product_info.get('product_code') or product_info.get('codigo_producto') or product_info.get('codigo') or product_info.get('id') or product_id)
-                        code_s = (str(code_s) if code_s is not None else '').strip().lower()
-                        pid_s = (str(product_id) if product_id is not None else '').strip().lower()
-                        # NOTE: 产品代码精确匹配（忽略大小写）- 搜索词与 product_code 或 product_id 完全一致时直接命中
-                        if q_raw == code_s or q_raw == pid_s:
-                            all_match = True
-                        else:
-                            searchable_parts = [name_s, desc_s, code_s, pid_s]
-                            searchable_text = ' '.join(p for p in searchable_parts if p)
-                            all_match = True
-                            for kw in keywords:
-                                if kw in searchable_text:
-                                    continue
-                                # 模糊匹配收紧：相似度 >= 0.85，避免 RADIO 匹配到 ROSADO 等无关词
-                                fuzzy_ok = False
-                                for part in searchable_parts:
-                                    if not part:
-                                        continue
-                                    for word in re.split(r'[\s\-_.,;:]+', part):
-                                        if len(word) < 2:
-                                            continue
-                                        if difflib.SequenceMatcher(None, kw, word).ratio() >= 0.85:
-                                            fuzzy_ok = True
-                                            break
-                                    if fuzzy_ok:
-                                        break
-                                if not fuzzy_ok:
-                                    all_match = False
-                                    break
-                        if not all_match:
-                            continue
+                        _search_matched_ids.append(product_id)
+                    if category and product_info.get('category_id') != category:
+                        continue
+                    if band and _price_band(product_info.get('price')) != band:
+                        continue
                     created_at = product_info.get('created_at', '')
                     filtered_with_meta.append((product_id, product_info, created_at))
                 # 以 DB 产品为主解析图片（与 Telegram 同步方案一致）：只显示「图片在 D:\Ya Subio 内存在」的产品，不按文件夹文件生成占位
                 # ULTIMO=Cristy 产品+解析 Cristy 目录图；PRODUCTOS=其他供应商+解析非 Cristy 目录图
                 filtered_with_image = []
                 for product_id, product_info, created_at in filtered_with_meta:
-                    image_path = product_info.get('image_path', '')
-                    # CHANGE: 已是云端 URL（PAGES_IMAGE_BASE_URL/R2）时直接使用，不覆盖为 /api/images/，也不走本地 resolve
-                    if image_path and (image_path.startswith('http://') or image_path.startswith('https://')):
-                        filtered_with_image.append((product_id, product_info, created_at, image_path))
-                        continue
-                    if image_path:
-                        if image_path.startswith('/api/images/'):
-                            fname = image_path.replace('/api/images/', '').split('?')[0].strip()
-                            image_path = f'/api/images/{_normalize_image_filename(fname)}'
-                        elif '/pwa_cart/static/img/' in image_path or image_path.startswith('/pwa_cart/static/img/'):
-                            filename = _normalize_image_filename(os.path.basename(image_path))
-                            image_path = f'/api/images/{filename}'
-                        elif image_path.startswith('/img/') or '/img/' in image_path:
-                            filename = _normalize_image_filename(os.path.basename(image_path))
-                            image_path = f'/api/images/{filename}'
-                    elif os.path.isabs(image_path) or (image_path and ('D:' in image_path or 'C:' in image_path)):
-                        normalized_path = image_path.replace('/', os.sep).replace('\\', os.sep)
-                        filename = _normalize_image_filename(os.path.basename(normalized_path))
-                        image_path = f'/api/images/{filename}'
-                    elif image_path and ('\\' in image_path or '/' in image_path):
-                        normalized_path = image_path.replace('/', os.sep).replace('\\', os.sep)
-                        filename = _normalize_image_filename(os.path.basename(normalized_path))
-                        image_path = f'/api/images/{filename}'
-                    elif image_path and not image_path.startswith('http'):
-                        image_path = f'/api/images/{_normalize_image_filename(image_path)}'
-                    resolved = resolve_image_for_product(product_id, image_path)
-                    if not resolved and image_path and (image_path.startswith('/api/images/') or image_path.startswith('http')):
-                        # CHANGE: 搜索时若 resolve 失败但已有有效路径（云端图或 /api/images/），仍保留产品，避免按代码搜索无结果
-                        resolved = image_path if image_path.startswith('http') else image_path
-                    # CHANGE: 云端 Render 无本地图片目录时，以 DB 为主：用 PAGES_IMAGE_BASE_URL 构造图片 URL，避免产品被过滤
-                    if not resolved and not _files_for_resolve:
-                        pages_base = getattr(self, 'pages_image_base_url', None) or (os.getenv('PAGES_IMAGE_BASE_URL', '') or '').strip().rstrip('/')
-                        if pages_base:
-                            _img = product_info.get('ruta_imagen_raw') or product_info.get('image_path') or product_info.get('ruta_imagen') or image_path or ''
-                            if _img and isinstance(_img, str):
-                                _norm = _img.replace('\\', '/').strip()
-                                if _img.startswith('/api/images/'):
-                                    _rel = _normalize_image_filename(_img.replace('/api/images/', '').split('?')[0].strip())
-                                elif 'output_images' in _norm.lower() or 'product_images' in _norm.lower():
-                                    # 保留相对路径，如 .../output_images/Importadora_Chinito/xxx.jpg -> Importadora_Chinito/xxx.jpg
-                                    _lower = _norm.lower()
-                                    for _key in ('output_images/', 'product_images/'):
-                                        if _key in _lower:
-                                            _rel = _norm[_lower.index(_key) + len(_key):].replace(' ', '%20')
-                                            _rel = _normalize_image_filename(_rel)
-                                            break
-                                    else:
-                                        _rel = _normalize_image_filename(os.path.basename(_norm))
-                                else:
-                                    _rel = _normalize_image_filename(os.path.basename(_norm))
-                                if _rel and _rel.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                                    _sub = 'Cristy/' if (product_info.get('codigo_proveedor') or '').strip().lower() == 'cristy' else ''
-                                    resolved = pages_base + '/Ya%20Subio/' + _sub + _rel
-                    # CHANGE: 云端无本地图时，即使 resolve 失败也保留产品（传 image_path 或空），前端会显示 Sin imagen，避免 180 产品只显示 4 个
-                    if not resolved and not _files_for_resolve and image_path:
-                        resolved = image_path  # 保留 /api/images/xxx 供前端尝试加载
+                    resolved = self._resolve_listing_image(product_id, product_info, resolve_image_for_product, _files_for_resolve)
                     if not resolved:
                         continue  # 图片不在 D:\Ya Subio 内，不显示该产品
                     filtered_with_image.append((product_id, product_info, created_at, resolved))
-                filtered_with_image.sort(key=lambda x: x[2], reverse=True)
                 total_filtered = len(filtered_with_image)
                 start = (page - 1) * limit
                 end = start + limit
-                page_slice = filtered_with_image[start:end]
+                if search and sort_mode == 'relevance':
+                    # CHANGE: 相关度排序：BM25F 分数 + 创建时间作次序，heapq.nlargest 只取到本页末尾，不对全部命中排序
+                    _score = _search_index.scorer(search)
+                    page_slice = heapq.nlargest(
+                        end, filtered_with_image, key=lambda x: (_score(x[0], x[1]), str(x[2] or ''))
+                    )[start:end]
+                else:
+                    filtered_with_image.sort(key=lambda x: x[2], reverse=True)
+                    page_slice = filtered_with_image[start:end]
                 product_list = []
                 for product_id, product_info, created_at, image_path in page_slice:
                     # CHANGE: 始终优先用 product_code/codigo_producto，搜索时禁止用图片文件名作为展示码或名称
@@ -2839,6 +3223,7 @@ class PWACartAPIServer:
                     logger.info(f"🔍 [API] 搜索无结果: 关键词={search!r}, 扫描产品={len(products_to_process)}, 文本匹配={len(filtered_with_meta)}, 有图产品=0")
                     print(f"🔍 [API] 搜索无结果: 关键词={search!r}, 扫描产品={len(products_to_process)}, 文本匹配={len(filtered_with_meta)}, 有图产品=0")
                 
+                self._add_image_versions(paginated_products)
                 resp = jsonify({
                     "success": True,
                     "data": paginated_products,
@@ -2847,11 +3232,9 @@ class PWACartAPIServer:
                         "limit": limit,
                         "total": total_filtered,
                         "total_pages": (total_filtered + limit - 1) // limit if total_filtered else 1
-                    }
+                    },
+                    "facets": self._products_facets(_snap, supplier_lower, category, band, _search_matched_ids),
                 })
-                # NOTE: 同步后刷新网页需拿到最新产品列表，禁止缓存
-                resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate'
-                resp.headers['Pragma'] = 'no-cache'
                 # CHANGE: 方案 A - 仅显示图片在 D:\Ya Subio 内存在的产品
                 resp.headers['X-Image-Logic'] = 'only-products-with-image-in-dir'
                 resp.headers['X-Image-Match-Count'] = str(sum(1 for p in paginated_products if p.get('image_path')))
@@ -2863,7 +3246,26 @@ class PWACartAPIServer:
                 print(f"❌ [API] 获取产品列表失败: {e}")
                 return jsonify({"error": str(e)}), 500
         
+        @self.app.route('/api/products/suggest', methods=['GET'])
+        def suggest_products():
+            """CHANGE: 搜索框边输入边提示：?q= 前缀匹配名称/名称中的词/产品代码，返回最新的 limit 个（默认 8，最多 20）"""
+            q = (request.args.get('q') or '').strip()
+            try:
+                limit = int(request.args.get('limit', 8))
+            except ValueError:
+                limit = 8
+            try:
+                items = self._catalog_suggest_index(self.catalog.get()).suggest(q, limit) if q else []
+                resp = jsonify({"success": True, "query": q, "data": items})
+                resp.headers['Cache-Control'] = 'public, max-age=60'
+                return resp
+            except Exception as e:
+                logger.error(f"❌ 获取搜索提示失败: {e}")
+                return jsonify({"success": False, "error": str(e)}), 500
+
         @self.app.route('/api/products/<product_id>', methods=['GET'])
+        # CHANGE: 产品详情与列表同样缓存（stale-while-revalidate），并按目录版本带 ETag（If-None-Match 命中返回 304）
+        @_cached_api_response('product', _API_CACHE_TTL_PRODUCTS, _API_CACHE_SWR_SECONDS, catalog_tag=self._catalog_tag)
         def get_product(product_id):
             """获取产品详情（SQLite + PostgreSQL Cristy 回退）。CHANGE: 支持 10060_Al/10060_A 等 URL 与 DB 10060/10060._AI 多候选匹配；支持 Telegram 展示码 18bf4405 通过映射解析。"""
             try:
@@ -2875,30 +3277,28 @@ class PWACartAPIServer:
                 if mapping.get(requested_id):
                     product_id = mapping[requested_id]
                 
-                # 暂时註销 SQLite 时产品仅从 PG 取
-                if USE_SQLITE_FOR_PRODUCTS and self.db:
-                    products = self.db.get_all_products()
-                else:
-                    products = self._get_products_dict_from_postgres()
+                # CHANGE: 产品读自内存目录快照（暂时註销 SQLite 时快照来自 PG）
+                _snap = self.catalog.get()
+                products = _snap.products
                 product = products.get(product_id)
                 resolved_id = product_id
+                # CHANGE: URL 可能为 10060_Al/10060_A/W-7841，DB 存 10060、10060._AI 或 W7841，用快照别名索引一次解析
+                if not product:
+                    _key = self._catalog_alias_index(_snap).resolve(product_id, digits=True)
+                    if _key is not None:
+                        product = products.get(_key)
+                        resolved_id = str(_key)
                 # CHANGE: Cristy 产品可能在 PostgreSQL，列表有但详情仅查了 SQLite，此处回退到 PG 查询
                 if not product:
                     product = self._get_single_product_from_postgres(product_id)
-                # CHANGE: URL 可能为 10060_Al/10060_A，DB 存 10060 或 10060._AI，用候选 key 再查
                 if not product:
                     for cand in _product_id_candidates(product_id):
                         if cand == product_id:
                             continue
-                        product = products.get(cand)
+                        product = self._get_single_product_from_postgres(cand)
                         if product:
                             resolved_id = cand
                             break
-                        if not product:
-                            product = self._get_single_product_from_postgres(cand)
-                            if product:
-                                resolved_id = cand
-                                break
                 # CHANGE: 仍未找到则从 PostgreSQL 按 id/codigo 查任意供应商（含 1677/1678 等仅存 PG 的产品）
                 if not product:
                     product = self._get_single_product_from_postgres_any(product_id)
@@ -2914,12 +3314,9 @@ class PWACartAPIServer:
                 if not product and self.db:
                     try:
                         sqlite_products = self.db.get_all_products()
-                        product = sqlite_products.get(requested_id) or sqlite_products.get(product_id)
-                        if not product and requested_id:
-                            for k, v in sqlite_products.items():
-                                if str(k) == str(requested_id) or str(k) == str(product_id):
-                                    product = v
-                                    break
+                        _sqlite_index = self.db.get_product_alias_index(sqlite_products)
+                        product = _sqlite_index.lookup(sqlite_products, requested_id) or \
+                            _sqlite_index.lookup(sqlite_products, product_id)
                         if product:
                             resolved_id = requested_id
                             # 转为与 PG 一致的结构（id/name/price/image_path 等）
@@ -2971,13 +3368,8 @@ class PWACartAPIServer:
                 if not (image_path and (image_path.startswith('http://') or image_path.startswith('https://'))) and os.path.isdir(_ya):
                     try:
                         import re
-                        files = []
-                        for _f in os.listdir(_ya):
-                            try:
-                                if os.path.isfile(os.path.join(_ya, _f)):
-                                    files.append(_f)
-                            except OSError:
-                                continue
+                        # CHANGE: Ya Subio 根目录文件名读自 ImageIndex（按目录 mtime 增量更新），不再每次 listdir
+                        files = self.image_index.dir_files(_ya)
                         fname = (image_path.replace('/api/images/', '').split('?')[0].strip() if (image_path and image_path.startswith('/api/images/'))
                                 else (os.path.basename(image_path.replace('/', os.sep).replace('\\', os.sep).strip()) if image_path else ''))
                         # 1) 精确文件名 2) 同主名不同扩展名
@@ -3032,6 +3424,7 @@ class PWACartAPIServer:
                     except Exception:
                         pass
                 
+                image_path = self._versioned_image_url(image_path)
                 # CHANGE: 返回 requested_id 与 codigo_proveedor，供前端判断是否供应商（显示在 PRODUCTOS 而非 ULTIMO）
                 return jsonify({
                     "success": True,
@@ -3123,15 +3516,24 @@ class PWACartAPIServer:
                         if not pg_ok:
                             logger.warning("⚠️ [GET /api/cart] DATABASE_URL 未配置，无法从 Neon 补全 name/code，请到 Render 环境变量设置 DATABASE_URL（Neon 连接串）")
                         filled = 0
-                        for it in cart:
+                        # CHANGE: 先收集需补全的 product_id，一次批量查询 PG，避免逐项查询（N+1）
+                        def _cart_item_needs_fill(it):
                             pid = str(it.get('product_id') or it.get('code') or '').strip()
                             if not pid:
-                                continue
+                                return None
                             name = str(it.get('name') or '').strip()
                             code = str(it.get('code') or pid).strip()
                             if not _is_placeholder_name(name) and code != pid:
+                                return None
+                            return pid
+                        pg_map = self._get_products_from_postgres_any_bulk(
+                            [p for p in (_cart_item_needs_fill(it) for it in cart) if p]
+                        ) if pg_ok else {}
+                        for it in cart:
+                            pid = _cart_item_needs_fill(it)
+                            if not pid:
                                 continue
-                            pg_prod = self._get_single_product_from_postgres_any(pid)
+                            pg_prod = pg_map.get(pid)
                             if not pg_prod:
                                 continue
                             pg_name = (pg_prod.get('name') or '').strip()
@@ -3499,29 +3901,16 @@ class PWACartAPIServer:
                 
                 # CHANGE: 用与前端一致的数据源补全 code/name——前端 ULTIMO 来自 PostgreSQL，订单保存若只用 SQLite 会得到过期的「Producto nuevo」
                 try:
-                    pg_list = self._get_ultimo_products_from_postgres()
-                    if pg_list:
-                        pg_map = {}
-                        for pid, pinfo in pg_list:
-                            k = str(pid)
-                            code = (pinfo.get('product_code') or pinfo.get('id') or k).strip()
-                            name = (pinfo.get('name') or '').strip()
-                            if code or name:
-                                pg_map[k] = {'code': code or k, 'name': name or code or k}
-                        if pg_map:
-                            for item in cart:
-                                pid = str(item.get('product_id', '')).strip()
-                                res = pg_map.get(pid)
-                                if not res and pid:
-                                    nums = re.findall(r'\d+', pid)
-                                    for n in reversed(nums):
-                                        if pg_map.get(n):
-                                            res = pg_map[n]
-                                            break
-                                if res:
-                                    item['code'] = res['code']
-                                    item['name'] = res['name']
-                                    logger.debug(f"  📦 订单商品补全自 PG: product_id={pid} -> code={res['code']}, name={res['name'][:40]}")
+                    # CHANGE: code/name 映射与别名索引按快照版本缓存，不再每次下单重建
+                    pg_map, pg_index = self.catalog.get().derived('cristy_code_names', self._build_cristy_code_names)
+                    if pg_map:
+                        for item in cart:
+                            pid = str(item.get('product_id', '')).strip()
+                            res = pg_index.lookup(pg_map, pid, digits=True)
+                            if res:
+                                item['code'] = res['code']
+                                item['name'] = res['name']
+                                logger.debug(f"  📦 订单商品补全自 PG: product_id={pid} -> code={res['code']}, name={res['name'][:40]}")
                 except Exception as e:
                     logger.warning(f"⚠️ 用 PG 补全订单商品名失败（继续用现有数据）: {e}")
                 
@@ -3534,14 +3923,22 @@ class PWACartAPIServer:
                         return True
                     return False
                 try:
-                    for item in cart:
+                    # CHANGE: 需补全的商品一次批量查询 PG（原来逐项查询，N+1）
+                    def _checkout_item_needs_fill(item):
                         pid = str(item.get('product_id', '')).strip()
+                        if not pid:
+                            return None
+                        if not (_is_placeholder_name(item.get('name') or '') or float(item.get('price') or 0) <= 0):
+                            return None
+                        return pid
+                    pg_any_map = self._get_products_from_postgres_any_bulk(
+                        [p for p in (_checkout_item_needs_fill(item) for item in cart) if p]
+                    )
+                    for item in cart:
+                        pid = _checkout_item_needs_fill(item)
                         if not pid:
                             continue
-                        need_fill = _is_placeholder_name(item.get('name') or '') or float(item.get('price') or 0) <= 0
-                        if not need_fill:
-                            continue
-                        pg_prod = self._get_single_product_from_postgres_any(pid)
+                        pg_prod = pg_any_map.get(pid)
                         if not pg_prod:
                             continue
                         name = (pg_prod.get('name') or '').strip()
@@ -3794,17 +4191,26 @@ class PWACartAPIServer:
                         return True
                     return False
                 try:
+                    # CHANGE: 所有订单中需补全的 product_id 合并为一次批量查询 PG（原来逐项查询，N+1）
+                    def _sync_item_needs_fill(it):
+                        pid = str(it.get('product_id') or it.get('code') or '').strip()
+                        if not pid:
+                            return None
+                        name = str(it.get('name') or '').strip()
+                        code = str(it.get('code') or pid).strip()
+                        if not _is_placeholder(name) and code != pid:
+                            return None
+                        return pid
+                    pg_map = self._get_products_from_postgres_any_bulk(
+                        [p for order_data in orders for p in (_sync_item_needs_fill(it) for it in (order_data.get('cart_items') or [])) if p]
+                    )
                     for order_data in orders:
                         items = order_data.get('cart_items') or []
                         for it in items:
-                            pid = str(it.get('product_id') or it.get('code') or '').strip()
+                            pid = _sync_item_needs_fill(it)
                             if not pid:
                                 continue
-                            name = str(it.get('name') or '').strip()
-                            code = str(it.get('code') or pid).strip()
-                            if not _is_placeholder(name) and code != pid:
-                                continue
-                            pg_prod = self._get_single_product_from_postgres_any(pid)
+                            pg_prod = pg_map.get(pid)
                             if not pg_prod:
                                 continue
                             pg_name = (pg_prod.get('name') or '').strip()
@@ -3826,14 +4232,10 @@ class PWACartAPIServer:
                 return jsonify({"error": str(e), "detail": tb.splitlines()[-2] if tb else ""}), 500
         
         @self.app.route('/api/payment/bank-info', methods=['GET'])
+        # CHANGE: 银行信息缓存 5 分钟，减少重复请求
+        @_cached_api_response('bank_info', _API_CACHE_TTL_BANK)
         def get_bank_info():
             """获取转账信息"""
-            # CHANGE: 银行信息缓存 5 分钟，减少重复请求
-            cache_key = 'bank_info'
-            if cache_key in _API_CACHE:
-                exp, data = _API_CACHE[cache_key]
-                if exp > time.time():
-                    return jsonify(data)
             try:
                 # CHANGE: 使用全局常量，确保链接正确
                 TELEGRAM_LINK = TELEGRAM_CUSTOMER_SERVICE_LINK
@@ -3913,7 +4315,6 @@ class PWACartAPIServer:
                 response = jsonify(final_data)
                 # 在响应头中添加验证信息
                 response.headers['X-Telegram-Link'] = TELEGRAM_LINK
-                _API_CACHE[cache_key] = (time.time() + _API_CACHE_TTL_BANK, final_data)
                 return response
                 
             except Exception as e:
@@ -3923,6 +4324,12 @@ class PWACartAPIServer:
     def cleanup(self):
         """清理资源"""
         logger.info("🧹 正在清理资源...")
+        # CHANGE: 停止产品目录后台刷新并关闭连接池空闲连接
+        try:
+            self.catalog.stop()
+            close_all_pools()
+        except Exception as e:
+            logger.warning(f"⚠️ 关闭连接池时出错: {e}")
         try:
             if hasattr(self, 'db') and self.db:
                 # 关闭数据库连接（如果支持）
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 响应缓存（ResponseCache）：LRU + TTL，条目数与字节数双上限，线程安全，按 key 单飞（single-flight）
+
+替代原模块级 dict `_API_CACHE`（无上限、过期条目不清理、无锁，过期瞬间所有并发请求同时重建产品列表）：
+- 过期后同一 key 只有一个线程调用 compute 重建；其他线程在有旧值时直接返回旧值，没有旧值时等待重建结果；
+- 过期条目保留 stale_grace 秒供上述情况使用，超过后视为不存在；
+- 超过 max_entries / max_bytes 时按最久未使用淘汰；
+- stale-while-revalidate：get_or_compute 传入 revalidate 时，宽限期内的过期条目立即返回旧值，由后台线程重建，
+  没有任何请求需要等待重建；
+- stats() 返回命中、未命中、旧值命中、等待、后台重建、淘汰等计数。
+
+环境变量：API_CACHE_MAX_ENTRIES（默认 512）、API_CACHE_MAX_MB（默认 64）。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = int(os.getenv('API_CACHE_MAX_ENTRIES') or 512)
+DEFAULT_MAX_BYTES = int(float(os.getenv('API_CACHE_MAX_MB') or 64) * 1024 * 1024)
+# 等待其他线程重建的最长秒数，超时后自行计算（不写缓存竞争）
+SINGLE_FLIGHT_WAIT_SECONDS = 30.0
+# 后台重建（stale-while-revalidate）线程数
+REVALIDATE_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ('value', 'expires', 'stale_until', 'size')
+
+    def __init__(self, value: Any, expires: float, stale_until: float, size: int):
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+        self.size = size
+
+
+class ResponseCache:
+    """线程安全的 LRU + TTL 缓存；get_or_compute() 在 key 过期时保证只有一个线程重建"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 size_of: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self._size_of = size_of or (lambda v: len(v) if hasattr(v, '__len__') else 1)
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stale_hits': 0, 'waits': 0, 'evictions': 0, 'expired': 0,
+                          'sets': 0, 'uncacheable': 0, 'revalidations': 0, 'revalidate_errors': 0}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # ----- 内部（调用方持有 _lock） -----
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _lookup(self, key: str, now: float) -> Tuple[Optional[_Entry], bool]:
+        """返回 (条目, 是否新鲜)；超过 stale_until 的条目删除并返回 (None, False)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        if entry.stale_until <= now:
+            self._drop(key)
+            self._counters['expired'] += 1
+            return None, False
+        self._entries.move_to_end(key)
+        return entry, entry.expires > now
+
+    def _store(self, key: str, value: Any, ttl: float, stale_grace: float) -> None:
+        size = max(1, int(self._size_of(value)))
+        if size > self.max_bytes:
+            self._counters['uncacheable'] += 1
+            return
+        now = time.time()
+        self._drop(key)
+        self._entries[key] = _Entry(value, now + ttl, now + ttl + max(0.0, stale_grace), size)
+        self._bytes += size
+        self._counters['sets'] += 1
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            old_key, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            self._counters['evictions'] += 1
+
+    # ----- 公共接口 -----
+    def get(self, key: str) -> Optional[Any]:
+        """仅返回未过期的值"""
+        with self._lock:
+            entry, fresh = self._lookup(key, time.time())
+            if fresh:
+                self._counters['hits'] += 1
+                return entry.value
+            self._counters['misses'] += 1
+            return None
+
+    def set(self, key: str, value: Any, ttl: float, stale_grace: Optional[float] = None) -> None:
+        with self._lock:
+            self._store(key, value, ttl, ttl if stale_grace is None else stale_grace)
+
+    def _revalidate(self, key: str, ttl: float, grace: float, revalidate: Callable[[], Any],
+                    cacheable: Callable[[Any], bool], event: threading.Event) -> None:
+        try:
+            value = revalidate()
+            with self._lock:
+                if cacheable(value):
+                    self._store(key, value, ttl, grace)
+                else:
+                    self._counters['uncacheable'] += 1
+        except Exception as e:
+            with self._lock:
+                self._counters['revalidate_errors'] += 1
+            logger.warning(f"⚠️ 缓存后台重建失败 {key}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def get_or_compute(self, key: str, ttl: float, compute: Callable[[], Any],
+                       cacheable: Callable[[Any], bool] = lambda v: True,
+                       stale_grace: Optional[float] = None,
+                       revalidate: Optional[Callable[[], Any]] = None) -> Tuple[Any, str]:
+        """返回 (值, 状态)，状态为 hit / stale / miss / wait。
+        key 未过期直接返回；否则只有一个线程执行 compute()，cacheable(值) 为真时写入缓存；
+        其他线程有旧值则返回旧值，没有则等待该线程完成后读取（仍无结果时自行计算）。
+        传入 revalidate（可在后台线程调用的 compute）时，宽限期内的旧值直接返回，由后台线程执行 revalidate 重建。"""
+        grace = ttl if stale_grace is None else stale_grace
+        with self._lock:
+            entry, fresh = self._lookup(key, time.time())
+            if fresh:
+                self._counters['hits'] += 1
+                return entry.value, 'hit'
+            event = self._inflight.get(key)
+            if event is None:
+                event = self._inflight[key] = threading.Event()
+                if entry is not None and revalidate is not None:
+                    self._counters['stale_hits'] += 1
+                    self._counters['revalidations'] += 1
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(max_workers=REVALIDATE_WORKERS,
+                                                            thread_name_prefix='api-cache-revalidate')
+                    self._executor.submit(self._revalidate, key, ttl, grace, revalidate, cacheable, event)
+                    return entry.value, 'stale'
+                leader = True
+                self._counters['misses'] += 1
+            else:
+                leader = False
+                if entry is not None:
+                    self._counters['stale_hits'] += 1
+                    return entry.value, 'stale'
+                self._counters['waits'] += 1
+        if not leader:
+            event.wait(SINGLE_FLIGHT_WAIT_SECONDS)
+            with self._lock:
+                entry, fresh = self._lookup(key, time.time())
+            if entry is not None:
+                return entry.value, 'wait'
+            return compute(), 'miss'
+        try:
+            value = compute()
+            if cacheable(value):
+                with self._lock:
+                    self._store(key, value, ttl, grace)
+            else:
+                with self._lock:
+                    self._counters['uncacheable'] += 1
+            return value, 'miss'
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def invalidate(self, prefix: str = '') -> int:
+        """删除以 prefix 开头的 key（空串为全部），返回删除数"""
+        with self._lock:
+            keys = [k for k in self._entries if k.startswith(prefix)]
+            for k in keys:
+                self._drop(k)
+            return len(keys)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            out.update(entries=len(self._entries), bytes=self._bytes, max_entries=self.max_entries,
+                       max_bytes=self.max_bytes, inflight=len(self._inflight))
+        lookups = out['hits'] + out['misses'] + out['stale_hits'] + out['waits']
+        out['hit_ratio'] = round((out['hits'] + out['stale_hits'] + out['waits']) / lookups, 3) if lookups else 0.0
+        return out
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产品搜索下推到数据库（/api/products?search=）
+
+PWA_SEARCH_BACKEND 选择搜索在哪里执行：
+- memory（默认）：进程内 ProductSearchIndex（search_index.py），规则最完整（含 SequenceMatcher 拼写容错）；
+- db：产品在 PostgreSQL（Neon）时用 pg_trgm GIN 索引，USE_SQLITE_FOR_PRODUCTS 时用 SQLite FTS5（trigram 分词）虚表；
+  只有命中的那一页行（LIMIT/OFFSET，附 COUNT(*) OVER() 总数）经网络返回。数据库搜索失败或不可用时回退 memory。
+  也可直接写 postgres / sqlite 强制指定。
+
+匹配规则尽量与进程内一致：整个搜索串等于产品代码 / id 直接命中；否则每个关键词（AND）须是
+「名称 描述 代码 id」拼接文本的子串（小写、去常见西语重音），PostgreSQL 另以 pg_trgm word_similarity 容错拼写。
+
+索引安装（应用首次搜索时也会自动执行，需要建扩展/建表权限）：
+  python search_backends.py --postgres                # 使用 DATABASE_URL
+  python search_backends.py --postgres --dsn "postgresql://..."
+  python search_backends.py --sqlite "VentaX_json/database/spanish_product_database.db"
+"""
+
+import logging
+import os
+from typing import Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEARCH_BACKENDS = ('memory', 'db', 'postgres', 'sqlite')
+DEFAULT_TRGM_THRESHOLD = 0.6
+# 关键词至少这么长才做 pg_trgm 拼写容错（更短的词 SequenceMatcher 0.85 也几乎只能精确命中）
+PG_FUZZY_MIN_LENGTH = 3
+
+# 与 search_index.fold_search_text 对应的 SQL 去重音（translate 为 IMMUTABLE，可用于表达式索引）
+_ACCENTED = 'áéíóúüñàèìòùâêîôûäëïöç'
+_PLAIN = 'aeiouunaeiouaeiouaeioc'
+
+# CHANGE: 搜索文档表达式；查询必须与索引使用完全相同的表达式才能命中 GIN 索引
+PG_SEARCH_DOCUMENT = (
+    "translate(lower(coalesce(nombre_producto, '') || ' ' || coalesce(descripcion, '') || ' ' || "
+    f"coalesce(codigo_producto, '') || ' ' || coalesce(id_producto::text, '')), '{_ACCENTED}', '{_PLAIN}')"
+)
+
+PG_SEARCH_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS idx_products_search_trgm ON products USING gin (({PG_SEARCH_DOCUMENT}) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_products_codigo_lower ON products (lower(codigo_producto))",
+)
+
+SQLITE_FTS_TABLE = 'products_fts'
+
+
+def configured_search_backend(use_sqlite_for_products: bool = False) -> str:
+    """读取 PWA_SEARCH_BACKEND，返回 memory / postgres / sqlite"""
+    value = (os.getenv('PWA_SEARCH_BACKEND') or 'memory').strip().lower()
+    if value not in SEARCH_BACKENDS:
+        logger.warning(f"⚠️ PWA_SEARCH_BACKEND={value!r} 无效，使用 memory")
+        return 'memory'
+    if value == 'db':
+        return 'sqlite' if use_sqlite_for_products else 'postgres'
+    return value
+
+
+def trgm_threshold() -> float:
+    try:
+        return float(os.getenv('PWA_SEARCH_TRGM_THRESHOLD') or DEFAULT_TRGM_THRESHOLD)
+    except ValueError:
+        return DEFAULT_TRGM_THRESHOLD
+
+
+def fold_query(search) -> Tuple[str, List[str]]:
+    """(整个搜索串, 关键词)：小写 + 与 SQL translate 相同的去重音"""
+    q = str(search or '').strip().lower().translate(str.maketrans(_ACCENTED, _PLAIN))
+    return q, [k for k in q.split() if k]
+
+
+def _like_pattern(kw: str) -> str:
+    return '%' + kw.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+# ----- PostgreSQL -----
+def install_pg_search_indexes(conn) -> bool:
+    """创建 pg_trgm 扩展与搜索索引（幂等）；失败时回滚并返回 False"""
+    cur = conn.cursor()
+    try:
+        for ddl in PG_SEARCH_DDL:
+            cur.execute(ddl)
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"⚠️ 创建 PostgreSQL 搜索索引失败: {e}")
+        return False
+    finally:
+        cur.close()
+
+
+def pg_search_condition(search) -> Tuple[str, List[Any]]:
+    """返回 (WHERE 片段, 参数)：代码/id 精确相等，或每个关键词子串（LIKE）/拼写容错（<%）命中。
+    关键词为空时返回 ('FALSE', [])。"""
+    q, keywords = fold_query(search)
+    if not keywords:
+        return 'FALSE', []
+    parts, params = [], []
+    for kw in keywords:
+        if len(kw) >= PG_FUZZY_MIN_LENGTH:
+            parts.append(f"({PG_SEARCH_DOCUMENT} LIKE %s OR %s <%% {PG_SEARCH_DOCUMENT})")
+            params.extend([_like_pattern(kw), kw])
+        else:
+            parts.append(f"{PG_SEARCH_DOCUMENT} LIKE %s")
+            params.append(_like_pattern(kw))
+    sql = f"(lower(codigo_producto) = %s OR id_producto::text = %s OR ({' AND '.join(parts)}))"
+    return sql, [q, q] + params
+
+
+# ----- SQLite FTS5 -----
+def _sqlite_columns(spanish: bool) -> Tuple[str, ...]:
+    if spanish:
+        return ('nombre_producto', 'texto_procesado', 'texto_original', 'codigo_producto')
+    return ('product_name', 'processed_text', 'original_text', 'product_code')
+
+
+def install_sqlite_fts(conn, spanish: bool = True) -> bool:
+    """创建 FTS5 外部内容虚表（trigram 分词，支持子串 MATCH）及同步触发器，并重建一次（幂等）"""
+    cols = _sqlite_columns(spanish)
+    col_list = ', '.join(cols)
+    new_vals = ', '.join(f'new.{c}' for c in cols)
+    old_vals = ', '.join(f'old.{c}' for c in cols)
+    t = SQLITE_FTS_TABLE
+    cur = conn.cursor()
+    try:
+        exists = cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (t,)).fetchone()
+        if not exists:
+            # remove_diacritics 需 SQLite 3.45+，旧版本退回普通 trigram
+            last_error = None
+            for tokenize in ("trigram remove_diacritics 1", "trigram"):
+                try:
+                    cur.execute(f"CREATE VIRTUAL TABLE {t} USING fts5({col_list}, content='products', "
+                                f"content_rowid='rowid', tokenize='{tokenize}')")
+                    break
+                except Exception as e:
+                    last_error = e
+            else:
+                raise last_error
+        cur.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS {t}_ai AFTER INSERT ON products BEGIN
+                INSERT INTO {t}(rowid, {col_list}) VALUES (new.rowid, {new_vals});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {t}_ad AFTER DELETE ON products BEGIN
+                INSERT INTO {t}({t}, rowid, {col_list}) VALUES ('delete', old.rowid, {old_vals});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {t}_au AFTER UPDATE ON products BEGIN
+                INSERT INTO {t}({t}, rowid, {col_list}) VALUES ('delete', old.rowid, {old_vals});
+                INSERT INTO {t}(rowid, {col_list}) VALUES (new.rowid, {new_vals});
+            END;
+        """)
+        if not exists:
+            cur.execute(f"INSERT INTO {t}({t}) VALUES ('rebuild')")
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"⚠️ 创建 SQLite FTS5 搜索表失败: {e}")
+        return False
+
+
+def sqlite_search_condition(search, spanish: bool = True, id_col: str = 'id_producto') -> Tuple[str, List[Any]]:
+    """返回 (WHERE 片段, 参数)：3 字符以上的关键词走 FTS5 trigram MATCH（子串语义），更短的用 LIKE；
+    另含代码/id 精确相等。关键词为空时返回 ('0', [])。"""
+    q, keywords = fold_query(search)
+    if not keywords:
+        return '0', []
+    cols = _sqlite_columns(spanish)
+    # MATCH 用未去重音的关键词：remove_diacritics 分词器会同样处理查询串；旧版 trigram 则按原文匹配
+    raw_keywords = str(search or '').strip().lower().split()
+    match_terms = ['"' + kw.replace('"', '""') + '"' for kw in raw_keywords if len(kw) >= 3]
+    parts, params = [], []
+    if match_terms:
+        parts.append(f"rowid IN (SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH ?)")
+        params.append(' AND '.join(match_terms))
+    doc = " || ' ' || ".join(f"COALESCE({c}, '')" for c in cols) + f" || ' ' || COALESCE(CAST({id_col} AS TEXT), '')"
+    for kw in raw_keywords:
+        if len(kw) < 3:
+            parts.append(f"LOWER({doc}) LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(kw))
+    code_col = cols[3]
+    sql = f"(LOWER({code_col}) = ? OR CAST({id_col} AS TEXT) = ? OR ({' AND '.join(parts)}))"
+    return sql, [q, q] + params
+
+
+def main():
+    import argparse
+    import sqlite3
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="安装产品搜索数据库索引（pg_trgm / SQLite FTS5）")
+    parser.add_argument("--postgres", action="store_true", help="在 PostgreSQL products 表上创建 pg_trgm 索引")
+    parser.add_argument("--dsn", default=None, help="PostgreSQL 连接串（默认 DATABASE_URL）")
+    parser.add_argument("--sqlite", default=None, help="SQLite 产品库路径，创建 FTS5 虚表与触发器")
+    args = parser.parse_args()
+    if not args.postgres and not args.sqlite:
+        parser.print_help()
+        return 1
+    ok = True
+    if args.postgres:
+        dsn = args.dsn or os.getenv('DATABASE_URL', '').strip()
+        if not dsn:
+            logger.error("未提供 --dsn 且未设置 DATABASE_URL")
+            return 1
+        import psycopg2
+        conn = psycopg2.connect(dsn)
+        try:
+            ok = install_pg_search_indexes(conn) and ok
+        finally:
+            conn.close()
+        logger.info("PostgreSQL 搜索索引: %s", "完成" if ok else "失败")
+    if args.sqlite:
+        conn = sqlite3.connect(args.sqlite)
+        try:
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(products)")}
+            sqlite_ok = install_sqlite_fts(conn, spanish='nombre_producto' in cols)
+        finally:
+            conn.close()
+        logger.info("SQLite FTS5 搜索表: %s", "完成" if sqlite_ok else "失败")
+        ok = ok and sqlite_ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
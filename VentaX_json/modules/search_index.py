@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产品搜索倒排索引（ProductSearchIndex），用于 /api/products?search=
+
+原实现对 products_to_process 逐个产品拼接 searchable_text，关键词未命中时再对名称/描述/代码的每个词跑
+difflib.SequenceMatcher，每次查询为 O(产品数 × 词数 × 关键词数) 的纯 Python 运算。
+
+这里按目录快照版本（CatalogSnapshot.derived）一次性建立：
+- 文档 = (名称, 描述, 产品代码, product_id) 四段文本，小写并去重音（西语 á/é/í/ó/ú/ü/ñ 与无重音写法等价）；
+- 三字母组倒排表：关键词子串匹配先取倒排链交集，再逐个验证 `kw in 文本`；
+- 词表（按原分词规则切分、长度 >= 2）+ FuzzyTermIndex：模糊匹配先在词表上找出相似词（长度与二字母组计数过滤后
+  才跑 SequenceMatcher），再经词 -> 文档倒排展开，成本随词表大小而非「产品数 × 描述长度」增长；
+- 代码 / product_id 精确表：整个搜索串等于代码或 id 时直接命中（短路）。
+匹配语义与原逐个扫描一致（多个关键词为 AND，每个关键词子串命中或相似度 >= 0.85 的词），唯一差别是两侧都先去重音；
+match_product_linear 保留原逐个判断逻辑，供索引外的产品回退及 --selfcheck 对照。
+
+ProductSuggestIndex 用于 /api/products/suggest?q=（边输入边提示）：名称、名称中的每个词与产品代码去重音后放进一个
+有序数组，前缀查询为两次 bisect 得到的连续区间；产品按 fecha_creacion 从新到旧编号，区间内取编号最小的 k 个即为
+最新的 k 个产品。1～2 个字符的短前缀区间很大，建索引时预先算好各自的前 k 个。
+
+scorer()（?sort=relevance）：BM25F 相关度。各关键词在名称 / 代码 / 描述中的出现次数按字段加权、按字段词数归一后合并，
+IDF 取自索引内的命中文档数；整个搜索串等于产品代码时固定排在最前，只靠拼写容错命中的关键词给较低的固定权重。
+"""
+
+import bisect
+import difflib
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Set, Tuple
+
+# 与原搜索一致：模糊匹配阈值与分词规则
+FUZZY_RATIO = 0.85
+_WORD_SPLIT_RE = re.compile(r'[\s\-_.,;:]+')
+# 查询结果缓存条数（同一搜索翻页时复用）
+_QUERY_CACHE_MAX = 256
+# 模糊词查询结果缓存条数
+_FUZZY_CACHE_MAX = 2048
+# BM25F：字段权重（名称、描述、代码）、参数与代码精确命中加分
+BM25_FIELD_BOOSTS = (2.0, 1.0, 3.0)
+BM25_K1 = 1.2
+BM25_B = 0.75
+EXACT_CODE_BONUS = 1000.0
+# 关键词仅靠拼写容错命中时的加权词频
+FUZZY_TF = 0.3
+# 提示最多返回条数；不超过该长度的前缀在建索引时预先算好结果
+SUGGEST_MAX_LIMIT = 20
+_SUGGEST_PRECOMPUTED_PREFIX = 2
+
+
+def fold_search_text(value) -> str:
+    """小写 + 去重音（NFKD 后去掉组合符号）：Pañuelo / PANUELO、Canción / cancion 等价"""
+    s = str(value or '').lower()
+    if s.isascii():
+        return s
+    return ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
+
+
+def product_search_key(product_id, product_info: Dict) -> Tuple[str, str, str, str]:
+    """原搜索使用的四段文本（仅小写，未去重音）：名称、描述、产品代码、product_id"""
+    name_s = str(product_info.get('name') or product_info.get('nombre_producto') or '').lower()
+    desc_s = str(product_info.get('description') or product_info.get('descripcion') or '').lower()
+    code_s = (product_info.get('product_code') or product_info.get('codigo_producto') or product_info.get('codigo')
+              or product_info.get('id') or product_id)
+    code_s = (str(code_s) if code_s is not None else '').strip().lower()
+    pid_s = (str(product_id) if product_id is not None else '').strip().lower()
+    return name_s, desc_s, code_s, pid_s
+
+
+def _words(parts: Iterable[str]) -> List[str]:
+    out = []
+    for part in parts:
+        if not part:
+            continue
+        for word in _WORD_SPLIT_RE.split(part):
+            if len(word) >= 2:
+                out.append(word)
+    return out
+
+
+def _fuzzy(kw: str, word: str) -> bool:
+    return difflib.SequenceMatcher(None, kw, word).ratio() >= FUZZY_RATIO
+
+
+def parse_query(search) -> Tuple[str, List[str]]:
+    """(整个搜索串, 关键词列表)，均已小写去重音"""
+    q = fold_search_text(str(search or '').strip())
+    return q, [k.strip() for k in q.split() if k.strip()]
+
+
+def match_product_linear(search, product_id, product_info: Dict) -> bool:
+    """原逐个产品判断逻辑（两侧去重音）：代码/id 精确相等直接命中，否则每个关键词须子串命中或模糊命中"""
+    q, keywords = parse_query(search)
+    if not keywords:
+        return False
+    name_s, desc_s, code_s, pid_s = (fold_search_text(p) for p in product_search_key(product_id, product_info))
+    if q == code_s or q == pid_s:
+        return True
+    searchable_parts = [name_s, desc_s, code_s, pid_s]
+    searchable_text = ' '.join(p for p in searchable_parts if p)
+    for kw in keywords:
+        if kw in searchable_text:
+            continue
+        if not any(_fuzzy(kw, word) for word in _words(searchable_parts)):
+            return False
+    return True
+
+
+def _bigrams(word: str) -> Counter:
+    return Counter(word[i:i + 2] for i in range(len(word) - 1))
+
+
+class FuzzyTermIndex:
+    """词表上的模糊词索引：similar(kw) 返回与 kw 的 SequenceMatcher 相似度 >= FUZZY_RATIO 的全部词。
+
+    只做「必要条件」过滤，结果与逐词跑 SequenceMatcher 完全一致：
+    - 相似度 r = 2M / (la + lb)，M <= min(la, lb)，故 2·min(la, lb) >= r·(la + lb)（长度过滤）；
+    - SequenceMatcher 的匹配块是公共子序列，故插入/删除距离 d <= (1 - r)·(la + lb)，编辑距离 k <= d；
+      由 q-gram 引理，两词共有的二字母组（多重集）>= max(la, lb) - 1 - 2k（计数过滤，下界 <= 0 的长度不过滤）；
+    - 通过过滤的词再依次用 real_quick_ratio / quick_ratio / ratio 判断。
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words: List[str] = list(dict.fromkeys(w for w in words if w))
+        by_length: Dict[int, List[int]] = {}
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for i, word in enumerate(self.words):
+            by_length.setdefault(len(word), []).append(i)
+            for gram, count in _bigrams(word).items():
+                postings.setdefault(gram, []).append((i, count))
+        self._by_length = by_length
+        self._postings = postings
+        self._cache: 'OrderedDict[str, Tuple[str, ...]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {'queries': 0, 'cached': 0, 'ratio_calls': 0}
+
+    def __len__(self):
+        return len(self.words)
+
+    @staticmethod
+    def _length_ok(la: int, lb: int) -> bool:
+        return 2 * min(la, lb) >= FUZZY_RATIO * (la + lb) - 1e-9
+
+    @staticmethod
+    def _min_common_bigrams(la: int, lb: int) -> int:
+        max_edits = int((1 - FUZZY_RATIO) * (la + lb) + 1e-9)
+        return max(la, lb) - 1 - 2 * max_edits
+
+    def similar(self, kw: str) -> Tuple[str, ...]:
+        with self._lock:
+            self.stats_counters['queries'] += 1
+            hit = self._cache.get(kw)
+            if hit is not None:
+                self._cache.move_to_end(kw)
+                self.stats_counters['cached'] += 1
+                return hit
+        la = len(kw)
+        lengths = [lb for lb in self._by_length if self._length_ok(la, lb)]
+        candidates: List[int] = []
+        filtered_lengths = set()
+        for lb in lengths:
+            if self._min_common_bigrams(la, lb) <= 0:
+                candidates.extend(self._by_length[lb])
+            else:
+                filtered_lengths.add(lb)
+        if filtered_lengths:
+            common: Dict[int, int] = {}
+            for gram, count in _bigrams(kw).items():
+                for i, c in self._postings.get(gram, ()):
+                    common[i] = common.get(i, 0) + min(count, c)
+            words = self.words
+            for i, n in common.items():
+                lb = len(words[i])
+                if lb in filtered_lengths and n >= self._min_common_bigrams(la, lb):
+                    candidates.append(i)
+        matcher = difflib.SequenceMatcher(None, kw, '')
+        out = []
+        ratio_calls = 0
+        for i in sorted(candidates):
+            word = self.words[i]
+            # set_seq2 会缓存 b 的信息，这里 b 逐个变化；a（kw）固定，与 SequenceMatcher(None, kw, word) 等价
+            matcher.set_seq2(word)
+            if matcher.real_quick_ratio() < FUZZY_RATIO or matcher.quick_ratio() < FUZZY_RATIO:
+                continue
+            ratio_calls += 1
+            if matcher.ratio() >= FUZZY_RATIO:
+                out.append(word)
+        result = tuple(out)
+        with self._lock:
+            self.stats_counters['ratio_calls'] += ratio_calls
+            self._cache[kw] = result
+            if len(self._cache) > _FUZZY_CACHE_MAX:
+                self._cache.popitem(last=False)
+        return result
+
+
+class ProductSearchIndex:
+    """目录快照上的只读搜索索引；search() 返回命中文档集合，contains() 判断某个产品是否命中"""
+
+    def __init__(self, rows: Iterable[Tuple[Any, Dict]]):
+        docs: List[Tuple[str, str, str, str]] = []
+        doc_ids: Dict[Tuple[str, str, str, str], int] = {}
+        key_to_doc: Dict[Tuple[str, str, str, str], int] = {}
+        for product_id, product_info in rows:
+            if not isinstance(product_info, dict):
+                continue
+            raw = product_search_key(product_id, product_info)
+            if raw in key_to_doc:
+                continue
+            folded = tuple(fold_search_text(p) for p in raw)
+            doc = doc_ids.get(folded)
+            if doc is None:
+                doc = doc_ids[folded] = len(docs)
+                docs.append(folded)
+            key_to_doc[raw] = doc
+        trigrams: Dict[str, Set[int]] = {}
+        vocab: Dict[str, Set[int]] = {}
+        exact: Dict[str, Set[int]] = {}
+        for doc, parts in enumerate(docs):
+            for part in parts:
+                for k in range(len(part) - 2):
+                    trigrams.setdefault(part[k:k + 3], set()).add(doc)
+            for word in _words(parts):
+                vocab.setdefault(word, set()).add(doc)
+            for value in (parts[2], parts[3]):
+                if value:
+                    exact.setdefault(value, set()).add(doc)
+        self._docs = docs
+        self._key_to_doc = key_to_doc
+        self._trigrams = trigrams
+        self._vocab = vocab
+        self._exact = exact
+        self._fuzzy_terms = FuzzyTermIndex(vocab)
+        self._all_docs = frozenset(range(len(docs)))
+        # 各文档名称 / 描述 / 代码的词数及全库平均值（BM25 长度归一）
+        self._field_lengths = [tuple(max(1, len(_words((part,)))) for part in parts[:3]) for parts in docs]
+        n = max(1, len(docs))
+        self._avg_field_lengths = tuple(sum(lens[i] for lens in self._field_lengths) / n or 1.0 for i in range(3))
+        self._idf_cache: Dict[str, float] = {}
+        self._query_cache: 'OrderedDict[str, FrozenSet[int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def stats(self) -> Dict[str, int]:
+        return {'docs': len(self._docs), 'keys': len(self._key_to_doc), 'trigrams': len(self._trigrams),
+                'vocab': len(self._vocab), 'fuzzy': dict(self._fuzzy_terms.stats_counters)}
+
+    # ----- 单个关键词 -----
+    def _substring_docs(self, kw: str, candidates: FrozenSet[int]) -> Set[int]:
+        """candidates 中某段文本包含 kw 的文档"""
+        docs = self._docs
+        if len(kw) >= 3:
+            postings = []
+            for k in range(len(kw) - 2):
+                lst = self._trigrams.get(kw[k:k + 3])
+                if not lst:
+                    return set()
+                postings.append(lst)
+            postings.sort(key=len)
+            pool = postings[0] & candidates
+            for lst in postings[1:]:
+                pool.intersection_update(lst)
+                if not pool:
+                    return pool
+        else:
+            pool = candidates
+        return {d for d in pool if any(kw in part for part in docs[d])}
+
+    def _fuzzy_docs(self, kw: str, candidates: Set[int]) -> Set[int]:
+        """candidates 中含有与 kw 相似度 >= FUZZY_RATIO 的词的文档：词表上找相似词，再按倒排展开"""
+        if not candidates:
+            return set()
+        out = set()
+        vocab = self._vocab
+        for word in self._fuzzy_terms.similar(kw):
+            out.update(vocab[word])
+        return out & candidates
+
+    # ----- 查询 -----
+    def search(self, search) -> FrozenSet[int]:
+        """返回命中的文档编号集合（AND 语义 + 代码/id 精确短路），结果按查询串缓存"""
+        q, keywords = parse_query(search)
+        if not keywords:
+            return frozenset()
+        with self._lock:
+            hit = self._query_cache.get(q)
+            if hit is not None:
+                self._query_cache.move_to_end(q)
+                return hit
+        candidates: FrozenSet[int] = self._all_docs
+        # 先处理更长（通常更有区分度）的关键词，尽早缩小候选集；AND 语义与顺序无关
+        for kw in sorted(set(keywords), key=len, reverse=True):
+            matched = self._substring_docs(kw, candidates)
+            rest = set(candidates) - matched if len(matched) < len(candidates) else set()
+            if rest:
+                matched |= self._fuzzy_docs(kw, rest)
+            candidates = frozenset(matched)
+            if not candidates:
+                break
+        result = candidates | self._exact.get(q, frozenset())
+        with self._lock:
+            self._query_cache[q] = result
+            if len(self._query_cache) > _QUERY_CACHE_MAX:
+                self._query_cache.popitem(last=False)
+        return result
+
+    def _idf(self, kw: str) -> float:
+        idf = self._idf_cache.get(kw)
+        if idf is None:
+            df = len(self._substring_docs(kw, self._all_docs)) or len(self._fuzzy_docs(kw, set(self._all_docs)))
+            n = len(self._docs)
+            idf = self._idf_cache[kw] = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        return idf
+
+    def scorer(self, search) -> Callable[[Any, Dict], float]:
+        """返回 score(product_id, product_info) -> BM25F 相关度（越大越相关），用于对 search() 命中结果排序"""
+        q, keywords = parse_query(search)
+        keywords = list(dict.fromkeys(keywords))
+        idfs = [self._idf(kw) for kw in keywords]
+        avg = self._avg_field_lengths
+        boosts = BM25_FIELD_BOOSTS
+
+        def score(product_id, product_info: Dict) -> float:
+            doc = self._key_to_doc.get(product_search_key(product_id, product_info))
+            if doc is None:
+                parts = tuple(fold_search_text(p) for p in product_search_key(product_id, product_info))
+                lengths = tuple(max(1, len(_words((part,)))) for part in parts[:3])
+            else:
+                parts, lengths = self._docs[doc], self._field_lengths[doc]
+            code = parts[2] or parts[3]
+            total = EXACT_CODE_BONUS if q and q in (parts[2], parts[3]) else 0.0
+            for kw, idf in zip(keywords, idfs):
+                tf = 0.0
+                for i, field in enumerate((parts[0], parts[1], code)):
+                    occurrences = field.count(kw) if field else 0
+                    if occurrences:
+                        tf += boosts[i] * occurrences / (1.0 - BM25_B + BM25_B * lengths[i] / avg[i])
+                if not tf:
+                    tf = FUZZY_TF
+                total += idf * tf * (BM25_K1 + 1.0) / (tf + BM25_K1)
+            return total
+        return score
+
+    def contains(self, hits: FrozenSet[int], search, product_id, product_info: Dict) -> bool:
+        """产品是否在 search() 的命中集合中；建索引后新出现的产品按原逐个逻辑判断"""
+        doc = self._key_to_doc.get(product_search_key(product_id, product_info))
+        if doc is None:
+            return match_product_linear(search, product_id, product_info)
+        return doc in hits
+
+
+def _recency_key(product_info: Dict) -> str:
+    created = product_info.get('created_at') or product_info.get('fecha_creacion') or ''
+    if hasattr(created, 'isoformat'):
+        created = created.isoformat()
+    return str(created)
+
+
+class ProductSuggestIndex:
+    """目录快照上的前缀提示索引：suggest(q, k) 返回前缀命中、按创建时间从新到旧的前 k 个产品"""
+
+    def __init__(self, rows: Iterable[Tuple[Any, Dict]]):
+        products: List[Dict[str, Any]] = []
+        seen: Set[str] = set()
+        for product_id, product_info in rows:
+            if not isinstance(product_info, dict):
+                continue
+            name = str(product_info.get('name') or product_info.get('nombre_producto') or '').strip()
+            code = str(product_info.get('product_code') or product_info.get('codigo_producto') or '').strip()
+            key = fold_search_text(code or product_id)
+            if key in seen:
+                continue
+            seen.add(key)
+            products.append({'id': product_id, 'name': name or code or str(product_id),
+                             'product_code': code or str(product_id), '_recency': _recency_key(product_info)})
+        # 编号即新旧排名：0 为最新
+        products.sort(key=lambda p: p['_recency'], reverse=True)
+        entries: Set[Tuple[str, int]] = set()
+        for rank, product in enumerate(products):
+            del product['_recency']
+            name = fold_search_text(product['name'])
+            terms = {name, fold_search_text(product['product_code'])}
+            terms.update(_WORD_SPLIT_RE.split(name))
+            entries.update((term, rank) for term in terms if term)
+        ordered = sorted(entries)
+        self._terms = [term for term, _ in ordered]
+        self._ranks = [rank for _, rank in ordered]
+        self._products = products
+        # 短前缀（区间可能覆盖大半个目录）直接查表
+        short: Dict[str, Set[int]] = {}
+        for term, rank in ordered:
+            for n in range(1, min(len(term), _SUGGEST_PRECOMPUTED_PREFIX) + 1):
+                short.setdefault(term[:n], set()).add(rank)
+        self._short = {prefix: tuple(heapq.nsmallest(SUGGEST_MAX_LIMIT, ranks)) for prefix, ranks in short.items()}
+
+    def __len__(self):
+        return len(self._products)
+
+    def stats(self) -> Dict[str, int]:
+        return {'products': len(self._products), 'terms': len(self._terms), 'short_prefixes': len(self._short)}
+
+    def suggest(self, q, limit: int = 8) -> List[Dict[str, Any]]:
+        prefix = fold_search_text(q).strip()
+        limit = max(1, min(int(limit), SUGGEST_MAX_LIMIT))
+        if not prefix:
+            return []
+        if len(prefix) <= _SUGGEST_PRECOMPUTED_PREFIX:
+            ranks = self._short.get(prefix, ())[:limit]
+        else:
+            lo = bisect.bisect_left(self._terms, prefix)
+            hi = bisect.bisect_left(self._terms, prefix + '\U0010ffff', lo)
+            ranks = heapq.nsmallest(limit, set(self._ranks[lo:hi]))
+        return [dict(self._products[r]) for r in ranks]
+
+
+def _selfcheck(rounds: int = 400, seed: int = 11) -> int:
+    """内置样例 + 随机语料对照 match_product_linear，返回不一致数"""
+    import random
+    rows = [
+        ('W7841', {'name': 'Pañuelo de Seda', 'description': 'Canción infantil, color rojo', 'product_code': 'W-7841'}),
+        ('10060._AI', {'nombre_producto': 'RADIO portátil', 'descripcion': 'Radio AM/FM', 'codigo_producto': '10060._AI'}),
+        ('TG_JUGUETESFANG_90174', {'name': 'Muñeca bebé', 'description': '', 'product_code': ''}),
+        ('x1', {'name': 'Rosado', 'description': 'vestido rosado talla m'}),
+        ('x2', {'name': 'Camión de juguete', 'description': 'juguete_para-niños;camion.grande', 'codigo': 'CAM-01'}),
+        (90174, {'name': 'Lámpara LED', 'id': 90174}),
+        ('ab', {'name': 'a', 'description': None}),
+    ]
+    queries = ['pañuelo', 'panuelo', 'PANUELO seda', 'cancion', 'radio', 'radoi', 'ROSADO', 'rosa', 'w-7841', 'w7841',
+               '10060._ai', 'muneca bebe', 'camion grande', 'juguete ninos', 'cam-01', '90174', 'lampara', 'led lampra',
+               'a', 'ab', '  ', 'xyz', 'ni', 'seda rojo infantil', 'radio fm']
+    alphabet = list('abcdeinoruñáé ') + ['ción', 'rad', 'ros', '-', '_', '7841', 'luz']
+    rnd = random.Random(seed)
+
+    def _text(n):
+        return ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, n)))
+
+    for i in range(rounds):
+        rows.append((f"R{i}-{_text(3)}", {'name': _text(12), 'description': _text(30), 'product_code': _text(5)}))
+    for _ in range(rounds):
+        queries.append(_text(8))
+    index = ProductSearchIndex(rows)
+    mismatches = 0
+    for q in queries:
+        hits = index.search(q)
+        for pid, pinfo in rows:
+            expected = match_product_linear(q, pid, pinfo)
+            got = index.contains(hits, q, pid, pinfo)
+            if got != expected:
+                mismatches += 1
+                print(f"❌ 不一致 q={q!r} pid={pid!r}: 线性={expected} 索引={got}")
+    # 模糊词索引单独对照：逐词 SequenceMatcher
+    terms = FuzzyTermIndex(index._vocab)
+    for q in queries:
+        for kw in parse_query(q)[1]:
+            expected = sorted(w for w in terms.words if _fuzzy(kw, w))
+            got = sorted(terms.similar(kw))
+            if got != expected:
+                mismatches += 1
+                print(f"❌ 模糊词不一致 kw={kw!r}: 逐词={expected} 索引={got}")
+    # 前缀提示对照：逐个产品判断名称 / 名称中的词 / 代码是否以前缀开头，按新旧排名取前 k 个
+    for i, (pid, pinfo) in enumerate(rows):
+        pinfo.setdefault('created_at', f"2024-01-{i % 28 + 1:02d}T{i % 24:02d}:00:{i % 60:02d}")
+    suggest = ProductSuggestIndex(rows)
+    ranked = suggest._products
+    for q in queries + ['p', 'pa', 'ra', 'w-', 'cam', 'muneca b', 'lamp']:
+        prefix = fold_search_text(q).strip()
+        expected = []
+        if prefix:
+            for product in ranked:
+                name = fold_search_text(product['name'])
+                terms = [name, fold_search_text(product['product_code'])] + _WORD_SPLIT_RE.split(name)
+                if any(t and t.startswith(prefix) for t in terms):
+                    expected.append(product['product_code'])
+        got = [p['product_code'] for p in suggest.suggest(q, 5)]
+        if got != expected[:5]:
+            mismatches += 1
+            print(f"❌ 提示不一致 q={q!r}: 逐个={expected[:5]} 索引={got}")
+    print(f"{'✅' if not mismatches else '❌'} ProductSearchIndex 自检: {len(rows)} 个产品 × {len(queries)} 个查询，不一致 {mismatches} 个")
+    return mismatches
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='ProductSearchIndex 与原逐个搜索逻辑的一致性自检')
+    parser.add_argument('--selfcheck', action='store_true', help='运行内置样例 + 随机语料对照')
+    parser.add_argument('--rounds', type=int, default=400, help='随机产品数 / 查询数')
+    args = parser.parse_args()
+    if not args.selfcheck:
+        parser.print_help()
+        sys.exit(0)
+    sys.exit(1 if _selfcheck(args.rounds) else 0)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多个 gunicorn worker 进程共享的产品目录快照存储（SharedCatalogStore），基于本机 SQLite 文件（WAL）
+
+每个 worker 原先各自从 PostgreSQL 加载整个目录并各自刷新，worker 数 = 重复工作倍数。设置 CATALOG_SHARED_STORE 后：
+- 目录快照序列化（pickle + zlib）后写入 catalog_snapshot 单行表，带单调递增的版本号与内容指纹；
+- 刷新前需取得租约（leases 表，BEGIN IMMEDIATE 原子判断 + 过期时间），同一时刻只有一个 worker 查询 PostgreSQL；
+- 其他 worker 定期读取版本号（一行小查询），版本变化时加载同一份快照，所有 worker 看到相同的版本号与内容。
+文件只在本机进程间共享，内容来自本服务自己写入，反序列化不接受外部数据。
+"""
+
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 120.0
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS catalog_snapshot ("
+    " id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, fingerprint TEXT NOT NULL,"
+    " source TEXT, payload BLOB NOT NULL, updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)",
+)
+
+
+class SnapshotHead(NamedTuple):
+    version: int
+    fingerprint: str
+    updated_at: float
+
+
+class StoredSnapshot(NamedTuple):
+    version: int
+    fingerprint: str
+    source: str
+    updated_at: float
+    data: Dict[str, Any]
+
+
+class SharedCatalogStore:
+    """本机多进程共享的目录快照 + 刷新租约"""
+
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.path = os.path.abspath(path)
+        self.lease_seconds = float(lease_seconds)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for ddl in _SCHEMA:
+            conn.execute(ddl)
+        conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['SharedCatalogStore']:
+        """CATALOG_SHARED_STORE 设置时返回存储实例（值为 SQLite 文件路径），否则 None"""
+        path = (os.getenv('CATALOG_SHARED_STORE') or '').strip()
+        if not path:
+            return None
+        try:
+            lease = float(os.getenv('CATALOG_SHARED_LEASE_SECONDS') or DEFAULT_LEASE_SECONDS)
+        except ValueError:
+            lease = DEFAULT_LEASE_SECONDS
+        try:
+            return cls(path, lease_seconds=lease)
+        except Exception as e:
+            logger.warning(f"⚠️ 共享目录存储不可用，退回进程内快照: {path}: {e}")
+            return None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # ----- 快照 -----
+    def head(self) -> Optional[SnapshotHead]:
+        row = self._conn().execute("SELECT version, fingerprint, updated_at FROM catalog_snapshot WHERE id = 1").fetchone()
+        return SnapshotHead(*row) if row else None
+
+    def read(self) -> Optional[StoredSnapshot]:
+        row = self._conn().execute(
+            "SELECT version, fingerprint, source, updated_at, payload FROM catalog_snapshot WHERE id = 1").fetchone()
+        if not row:
+            return None
+        version, fingerprint, source, updated_at, payload = row
+        return StoredSnapshot(version, fingerprint, source or '', updated_at, pickle.loads(zlib.decompress(payload)))
+
+    def publish(self, fingerprint: str, data: Dict[str, Any], source: str) -> int:
+        """写入快照：指纹变化时版本号 +1 并替换内容，未变化时只更新时间；返回当前版本号"""
+        conn = self._conn()
+        payload = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT version, fingerprint FROM catalog_snapshot WHERE id = 1").fetchone()
+            now = time.time()
+            if row and row[1] == fingerprint:
+                conn.execute("UPDATE catalog_snapshot SET updated_at = ? WHERE id = 1", (now,))
+                version = row[0]
+            else:
+                payload = zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 3)
+                version = (row[0] if row else 0) + 1
+                conn.execute("INSERT OR REPLACE INTO catalog_snapshot (id, version, fingerprint, source, payload, updated_at) "
+                             "VALUES (1, ?, ?, ?, ?, ?)", (version, fingerprint, source, payload, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if payload is not None:
+            logger.info(f"📦 共享目录快照已发布 v{version}（{len(payload) / 1024:.0f} KB）")
+        return version
+
+    # ----- 租约 -----
+    def try_acquire(self, name: str = 'catalog-refresh') -> bool:
+        """取得租约返回 True（未被占用、已过期或本进程持有）；被其他 worker 持有时返回 False"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != self.owner and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+                         (name, self.owner, now + self.lease_seconds))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, name: str = 'catalog-refresh') -> None:
+        self._conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    def stats(self) -> Dict[str, Any]:
+        head = self.head()
+        lease = self._conn().execute("SELECT owner, expires FROM leases WHERE name = 'catalog-refresh'").fetchone()
+        return {
+            'path': self.path,
+            'version': head.version if head else 0,
+            'age_seconds': round(time.time() - head.updated_at, 1) if head else None,
+            'lease_owner': lease[0] if lease and lease[1] > time.time() else None,
+            'owner': self.owner,
+        }
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 按线程复用的长连接（供 database_manager.DatabaseManager 使用）
+
+DatabaseManager 原先每个方法都 sqlite3.connect() 一次、用完即 close：每次请求都要重新打开文件、
+重新执行 PRAGMA，语句缓存（sqlite3 按连接缓存已编译语句）随连接丢弃，从未命中。改为：
+- 每个线程一条长连接（gunicorn gthread 的请求线程固定，连接随线程复用），进程 fork 后自动重建；
+- PRAGMA（WAL、synchronous、busy_timeout、cache_size、mmap_size、temp_store）只在建立连接时执行一次；
+- cached_statements 放大语句缓存，同一 SQL 在同一线程内只编译一次；
+- 借出的是代理对象，调用方照旧 conn.close() 即归还，该线程最外层归还时未提交事务自动回滚（与原先 close() 语义一致）；
+  同一线程内嵌套借出（如 get_user_cart 内调用 get_all_products）共用同一条连接；
+- transaction() 上下文：BEGIN / COMMIT / 异常回滚，已在事务中时改用 SAVEPOINT，不会提前提交外层事务；
+- close() 真正关闭所有线程的连接（同步网页数据库覆盖文件前调用）；已结束线程的连接在建立新连接时清理。
+
+环境变量：SQLITE_CACHE_SIZE_KB（默认 16384）、SQLITE_MMAP_SIZE_MB（默认 128）、SQLITE_STATEMENT_CACHE（默认 256）。
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or '').strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        logger.warning(f"⚠️ 环境变量 {name}={raw!r} 非法，使用默认值 {default}")
+        return default
+
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_STATEMENT_CACHE = _env_int('SQLITE_STATEMENT_CACHE', 256)
+
+
+def default_pragmas() -> Tuple[str, ...]:
+    """每条连接建立时执行一次的 PRAGMA；WAL 下 synchronous=NORMAL 不会损坏数据库，只是掉电时可能丢最后几次提交"""
+    cache_kb = max(0, _env_int('SQLITE_CACHE_SIZE_KB', 16384))
+    mmap_bytes = max(0, _env_int('SQLITE_MMAP_SIZE_MB', 128)) * 1024 * 1024
+    return (
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        f'PRAGMA busy_timeout = {int(DEFAULT_TIMEOUT * 1000)}',
+        f'PRAGMA cache_size = -{cache_kb}',
+        f'PRAGMA mmap_size = {mmap_bytes}',
+        'PRAGMA temp_store = MEMORY',
+    )
+
+
+class _ThreadEntry:
+    """一个线程的长连接及其借出计数"""
+
+    __slots__ = ('raw', 'thread', 'pid', 'created_at', 'leases', 'uses')
+
+    def __init__(self, raw: sqlite3.Connection):
+        self.raw = raw
+        self.thread = threading.current_thread()
+        self.pid = os.getpid()
+        self.created_at = time.time()
+        self.leases = 0
+        self.uses = 0
+
+
+class PooledSQLiteConnection:
+    """借出的 sqlite3 连接代理：属性/方法透传原始连接，close() 改为归还（连接保持打开）。"""
+
+    def __init__(self, manager: 'SQLiteConnectionManager', entry: _ThreadEntry):
+        self._manager = manager
+        self._entry = entry
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._entry.raw, name)
+
+    def __setattr__(self, name, value):
+        # row_factory / text_factory 等连接属性写到原始连接
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._entry.raw, name, value)
+
+    def __enter__(self):
+        self._entry.raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._entry.raw.__exit__(exc_type, exc, tb)
+
+    def __del__(self):
+        # NOTE: 异常路径上未调用 close() 的连接，在代理被回收时归还（原先由连接对象回收时关闭）
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @property
+    def raw(self) -> sqlite3.Connection:
+        return self._entry.raw
+
+    def close(self):
+        """归还（重复调用无副作用）"""
+        if self._returned:
+            return
+        self._returned = True
+        self._manager._release(self._entry)
+
+
+class SQLiteConnectionManager:
+    """同一数据库文件按线程复用长连接"""
+
+    def __init__(self, path: str, timeout: float = DEFAULT_TIMEOUT, pragmas: Optional[Tuple[str, ...]] = None,
+                 cached_statements: int = DEFAULT_STATEMENT_CACHE, name: str = 'sqlite'):
+        self.path = path
+        self.timeout = float(timeout)
+        self.pragmas = tuple(pragmas) if pragmas is not None else default_pragmas()
+        self.cached_statements = max(0, int(cached_statements))
+        self.name = name
+        self._local = threading.local()
+        self._entries: Dict[int, _ThreadEntry] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._savepoint_seq = 0
+        self._stats = {'created': 0, 'checkouts': 0, 'reused': 0, 'rollbacks_on_release': 0,
+                       'closed_dead_threads': 0, 'closed': 0}
+
+    # ----- 借出 / 归还 -----
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False：close() 可能在其他线程（清理 / 同步数据库）执行；连接本身只由所属线程使用
+        raw = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                              cached_statements=self.cached_statements)
+        for pragma in self.pragmas:
+            try:
+                raw.execute(pragma)
+            except sqlite3.Error as e:
+                logger.debug(f"[{self.name}] {pragma} 未生效: {e}")
+        return raw
+
+    def connect(self) -> PooledSQLiteConnection:
+        """借出当前线程的长连接（不存在或 fork 后新建）"""
+        entry: Optional[_ThreadEntry] = getattr(self._local, 'entry', None)
+        if entry is None or entry.pid != os.getpid():
+            entry = self._new_entry()
+        else:
+            if entry.leases == 0 and entry.raw.in_transaction:
+                # 上次借出未正常归还（代理仍被引用），丢弃遗留的未提交修改
+                entry.raw.rollback()
+                self._count('rollbacks_on_release')
+            self._count('reused')
+        entry.leases += 1
+        entry.uses += 1
+        self._count('checkouts')
+        return PooledSQLiteConnection(self, entry)
+
+    def _new_entry(self) -> _ThreadEntry:
+        entry = _ThreadEntry(self._open())
+        self._local.entry = entry
+        dead = []
+        with self._lock:
+            if self._pid != entry.pid:
+                # fork 后父进程的连接不在子进程里关闭，只丢弃引用
+                self._entries, self._pid = {}, entry.pid
+            for key, other in list(self._entries.items()):
+                if not other.thread.is_alive():
+                    dead.append(self._entries.pop(key))
+            self._entries[id(entry)] = entry
+            self._stats['created'] += 1
+            self._stats['closed_dead_threads'] += len(dead)
+        for other in dead:
+            self._discard(other.raw)
+        return entry
+
+    def _release(self, entry: _ThreadEntry) -> None:
+        """归还：该线程最外层借出归还时，未提交的事务回滚"""
+        entry.leases = max(0, entry.leases - 1)
+        if entry.leases or entry.pid != os.getpid():
+            return
+        try:
+            if entry.raw.in_transaction:
+                entry.raw.rollback()
+                self._count('rollbacks_on_release')
+        except sqlite3.ProgrammingError:
+            pass  # 已被 close() 关闭
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _discard(raw: sqlite3.Connection) -> None:
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    # ----- 事务 -----
+    @contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator[PooledSQLiteConnection]:
+        """with manager.transaction() as conn: 正常结束提交，异常回滚并重新抛出；
+        immediate=True 时 BEGIN IMMEDIATE（开始即取得写锁）；已在事务中时用 SAVEPOINT，只提交/回滚本段"""
+        conn = self.connect()
+        try:
+            if conn.in_transaction:
+                with self._lock:
+                    self._savepoint_seq += 1
+                    savepoint = f'sp_{self._savepoint_seq}'
+                conn.execute(f'SAVEPOINT {savepoint}')
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute(f'ROLLBACK TO {savepoint}')
+                    conn.execute(f'RELEASE {savepoint}')
+                    raise
+                conn.execute(f'RELEASE {savepoint}')
+            else:
+                conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+                try:
+                    yield conn
+                except BaseException:
+                    conn.rollback()
+                    raise
+                conn.commit()
+        finally:
+            conn.close()
+
+    # ----- 管理 -----
+    def close(self) -> None:
+        """关闭所有线程的连接（进行中的查询会失败）；之后再借出时重新建立"""
+        with self._lock:
+            entries = list(self._entries.values()) if self._pid == os.getpid() else []
+            self._entries = {}
+            self._stats['closed'] += len(entries)
+        self._local = threading.local()
+        for entry in entries:
+            self._discard(entry.raw)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            entries = list(self._entries.values())
+        out.update({
+            'name': self.name,
+            'open': len(entries),
+            'in_use': sum(1 for e in entries if e.leases),
+            'cached_statements': self.cached_statements,
+            'pragmas': [p.replace('PRAGMA ', '') for p in self.pragmas],
+        })
+        return out
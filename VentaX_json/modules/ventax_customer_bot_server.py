@@ -12,6 +12,7 @@ import base64
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from ventax_customer_bot import chat, chat_with_image
+from compression import ResponseCompressor
 
 _FAST_MARKERS = [
     "Carolina", "Somos de Guayaquil", "hacemos env",
@@ -52,6 +53,8 @@ def create_app():
         return None
 
     app = Flask(__name__)
+    # 响应压缩（br/gzip 协商，超过阈值的 JSON/HTML 即时压缩）；须在 CORS 之前注册，压缩最后执行
+    ResponseCompressor().init_app(app)
     CORS(app)
     app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024  # 10MB
 